@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Alterações de Dados - Versões de mudança por módulo do /api/data
+Cada commit que altera uma tabela de um módulo recebe uma versão crescente e deixa
+registradas as chaves das linhas afetadas. Um cliente que guardou o cursor da última
+carga pede só o que mudou desde então, em vez de baixar o banco inteiro de novo.
+As mesmas versões invalidam o cache do JSON já serializado de cada módulo.
+"""
+import logging
+import time
+import uuid
+from collections import deque
+from threading import Lock
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class RegistroAlteracoes:
+    """
+    Registro em memória das alterações publicadas, em ordem de commit.
+
+    Cada entrada é (versao, modulo, chave); chave None indica que o módulo inteiro
+    mudou (ex: DELETE em massa) e precisa ser recarregado. O cursor entregue aos
+    clientes leva a época do processo: depois de um reinício, ou quando as entradas
+    pedidas já foram descartadas, desde() retorna None e o cliente faz a carga completa.
+    """
+
+    def __init__(self, max_alteracoes=100000):
+        """
+        Inicializa o registro
+
+        Args:
+            max_alteracoes: Quantas entradas manter; cursores mais antigos pedem carga completa
+        """
+        self.max_alteracoes = max_alteracoes
+        self.epoca = uuid.uuid4().hex[:8]
+        self.lock = Lock()
+        self.alteracoes = deque()
+        self.versao = 0
+        self.versao_descartada = 0  # Maior versão que já saiu do registro
+        self.versoes_modulos = {}  # modulo -> versão do último commit que o alterou
+
+        self.commits = 0
+        self.consultas_delta = 0
+        self.cursores_expirados = 0
+        self.ultima_alteracao = None
+
+    def publicar(self, alteracoes):
+        """
+        Publica as alterações de um commit com uma nova versão.
+
+        Args:
+            alteracoes: dict {modulo: set de chaves, ou None para o módulo inteiro}
+
+        Returns:
+            int: Versão atribuída (ou a atual, se não havia nada a publicar)
+        """
+        with self.lock:
+            if not alteracoes:
+                return self.versao
+            self.versao += 1
+            for modulo, chaves in alteracoes.items():
+                self.versoes_modulos[modulo] = self.versao
+                if chaves is None:
+                    self.alteracoes.append((self.versao, modulo, None))
+                else:
+                    for chave in chaves:
+                        self.alteracoes.append((self.versao, modulo, chave))
+            while len(self.alteracoes) > self.max_alteracoes:
+                self.versao_descartada = self.alteracoes.popleft()[0]
+            self.commits += 1
+            self.ultima_alteracao = time.time()
+            return self.versao
+
+    def cursor(self):
+        """Cursor da versão atual, para o cliente guardar junto com os dados que recebeu."""
+        with self.lock:
+            return f"{self.epoca}-{self.versao}"
+
+    def versao_modulo(self, modulo):
+        with self.lock:
+            return self.versoes_modulos.get(modulo, 0)
+
+    def desde(self, cursor):
+        """
+        Junta as alterações publicadas depois do cursor.
+
+        Returns:
+            tuple: (novo cursor, {modulo: set de chaves ou None}), ou None se o cursor
+                   não serve mais (outra época, inválido ou antigo demais)
+        """
+        try:
+            epoca, versao = cursor.rsplit('-', 1)
+            versao = int(versao)
+        except (AttributeError, ValueError):
+            return None
+
+        with self.lock:
+            self.consultas_delta += 1
+            if epoca != self.epoca or versao > self.versao or versao < self.versao_descartada:
+                self.cursores_expirados += 1
+                return None
+
+            por_modulo = {}
+            for versao_alteracao, modulo, chave in reversed(self.alteracoes):
+                if versao_alteracao <= versao:
+                    break
+                if chave is None:
+                    por_modulo[modulo] = None
+                else:
+                    chaves = por_modulo.setdefault(modulo, set())
+                    if chaves is not None:
+                        chaves.add(chave)
+            return f"{self.epoca}-{self.versao}", por_modulo
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'epoca': self.epoca,
+                'versao': self.versao,
+                'entradas': len(self.alteracoes),
+                'versao_descartada': self.versao_descartada,
+                'versoes_modulos': dict(self.versoes_modulos),
+                'commits': self.commits,
+                'consultas_delta': self.consultas_delta,
+                'cursores_expirados': self.cursores_expirados,
+                'ultima_alteracao': self.ultima_alteracao
+            }
+
+
+class CacheModulos:
+    """
+    Cache do JSON já serializado de cada módulo do /api/data.
+
+    Cada entrada guarda a versão do módulo no RegistroAlteracoes de quando foi gerada
+    e deixa de valer no commit seguinte que altera o módulo. Requisições que chegam
+    juntas (todos os clientes reagindo ao mesmo sinal do socket) esperam uma única
+    geração por módulo e reaproveitam o resultado.
+    """
+
+    def __init__(self, registro, idade_maxima=600):
+        """
+        Inicializa o cache
+
+        Args:
+            registro: RegistroAlteracoes com as versões dos módulos
+            idade_maxima: Segundos até regenerar mesmo sem alteração (escritas feitas fora da aplicação)
+        """
+        self.registro = registro
+        self.idade_maxima = idade_maxima
+        self.lock = Lock()
+        self.itens = {}  # modulo -> (versao, gerado_em, bytes)
+        self.locks_modulos = {}
+
+        self.acertos = 0
+        self.geracoes = 0
+        self.tempo_geracao = 0.0
+
+    def _valido(self, modulo, versao):
+        item = self.itens.get(modulo)
+        if item is not None and item[0] == versao and time.time() - item[1] < self.idade_maxima:
+            self.acertos += 1
+            return item[2]
+        return None
+
+    def atual(self, modulo):
+        """JSON do módulo se o cache estiver em dia, senão None (sem gerar)."""
+        versao = self.registro.versao_modulo(modulo)
+        with self.lock:
+            return self._valido(modulo, versao)
+
+    def guardar(self, modulo, versao, conteudo):
+        """Guarda um JSON gerado fora do cache (ex: durante um streaming), lido na versão informada."""
+        with self.lock:
+            self.itens[modulo] = (versao, time.time(), conteudo)
+            self.geracoes += 1
+
+    def obter(self, modulo, gerar):
+        """
+        JSON do módulo, do cache ou gerado por gerar() se o módulo mudou.
+
+        Args:
+            modulo: Nome do módulo
+            gerar: Função que consulta o banco e retorna os bytes JSON do módulo
+        """
+        versao = self.registro.versao_modulo(modulo)
+        with self.lock:
+            conteudo = self._valido(modulo, versao)
+            if conteudo is not None:
+                return conteudo
+            lock_modulo = self.locks_modulos.setdefault(modulo, Lock())
+
+        with lock_modulo:
+            # Quem esperou outra requisição gerar o mesmo módulo aproveita o resultado.
+            # A versão é lida antes da consulta: um commit no meio só causa uma geração a mais.
+            versao = self.registro.versao_modulo(modulo)
+            with self.lock:
+                conteudo = self._valido(modulo, versao)
+                if conteudo is not None:
+                    return conteudo
+            inicio = time.time()
+            conteudo = gerar()
+            with self.lock:
+                self.itens[modulo] = (versao, time.time(), conteudo)
+                self.geracoes += 1
+                self.tempo_geracao += time.time() - inicio
+            return conteudo
+
+    def limpar(self):
+        with self.lock:
+            self.itens.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'modulos': {modulo: {'versao': versao, 'bytes': len(conteudo)}
+                            for modulo, (versao, _, conteudo) in self.itens.items()},
+                'bytes_total': sum(len(item[2]) for item in self.itens.values()),
+                'acertos': self.acertos,
+                'geracoes': self.geracoes,
+                'tempo_geracao_segundos': round(self.tempo_geracao, 3)
+            }
@@ -1,11 +1,11 @@
 # app.py - VERSÃO OTIMIZADA PARA COMUNICAÇÃO INSTANTÂNEA
-from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, make_response
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, make_response, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import threading
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import UniqueConstraint, Identity, cast, String
+from sqlalchemy import UniqueConstraint, Identity, cast, String, event, inspect
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy import or_, and_
 from sqlalchemy.types import JSON as SQLJSON
@@ -17,20 +17,34 @@ import json
 import datetime
 import re
 import os
+import stat
+import sys
 from PIL import Image
 import traceback
 import io
+import zipfile
 import uuid
 from queue import Queue, PriorityQueue
 import logging
 from functools import wraps
 from collections import defaultdict, deque
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
+from werkzeug.http import is_resource_modified
+from urllib.parse import quote
 
 # =================================================================
 # IMPORTAÇÃO DO MÓDULO EAN
 # =================================================================
 from ean_module import init_ean_module
+from image_index import ImageIndexSnapshot, ImageIndex, EXTENSOES_IMAGEM, normalizar_chave_imagem, normalizar_sku_base
+from copia_imagens import MotorDeCopia, ArmazemStaging
+from miniaturas import ServicoMiniaturas
+from fundo_branco import VerificadorFundoBranco
+from limpeza_temporarios import LimpezaTemporarios
+from espelho_imagens import EspelhoImagens
+from alteracoes_dados import RegistroAlteracoes, CacheModulos
+from respostas_json import ProvedorJSONRapido, CompressaoRespostas, dumps_bytes
+from diferenca_tabelas import calcular_diferenca
 
 # =================================================================
 # CONFIGURAÇÃO DE LOGGING PARA DEBUG
@@ -40,17 +54,25 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
+# jsonify com orjson (quando instalado) e respostas JSON comprimidas com brotli/gzip
+app.json = ProvedorJSONRapido(app)
+compressao_respostas = CompressaoRespostas(tamanho_minimo=1024)
+
+
+@app.before_request
+def preparar_compressao():
+    compressao_respostas.preparar(request)
+
+
+@app.after_request
+def comprimir_respostas(response):
+    return compressao_respostas.processar(request, response)
 
 # Lock para proteger operações de escrita no banco de dados e evitar "database is locked".
 db_write_lock = Lock()
 
 # --- 1. CONFIGURAÇÕES GLOBAIS ---
 
-# Sistema de cache otimizado
-image_cache = {}
-is_cache_ready = False
-cache_lock = threading.Lock()
-
 
 # =================================================================
 # CONFIGURAÇÕES DO SERVIDOR
@@ -76,12 +98,76 @@ db = SQLAlchemy(app)
 IMAGE_SOURCE_PATH = r'\\Vcadms-02\IMPRESSAO\IMPRESSAO - VIA CORES\IMPRESSÃO MKTP - SKU'
 IMAGE_SEARCH_ROOT_PATH = r'\\Vcadms-02\VENDAS\VENDAS MARKETPLACE'
 IMAGE_TEMP_DEST_PATH = r'\\Vcadms-02\IMPRESSAO\TESTE'
-
-
-# Variáveis para cache em memória
-IMAGE_PATH_CACHE = {}
-CACHE_BUILD_LOCK = threading.Lock()
-IS_CACHE_READY = False
+# Armazém de staging das artes copiadas. Fica no mesmo volume das pastas de sessão
+# para que elas recebam hardlinks em vez de uma nova cópia vinda da rede.
+IMAGE_STAGING_PATH = os.path.join(IMAGE_TEMP_DEST_PATH, '_staging')
+IMAGE_STAGING_MAX_BYTES = 20 * 1024 * 1024 * 1024
+# Cota das pastas de sessão (busca_*) + anexos do chat na pasta temporária (o staging tem cota própria)
+TEMP_STORAGE_MAX_BYTES = 30 * 1024 * 1024 * 1024
+TEMP_SESSION_MAX_AGE_SECONDS = 24 * 60 * 60
+TEMP_CHAT_MAX_AGE_SECONDS = 90 * 24 * 60 * 60
+TEMP_CLEANUP_INTERVAL_SECONDS = 15 * 60
+# Espelho local (opcional) das duas raízes de imagem, lido antes da rede. None desativa.
+# A origem é espelhada inteira (a coleta considera qualquer extensão): reserve espaço em disco para ela.
+IMAGE_MIRROR_PATH = None
+IMAGE_MIRROR_WORKERS = 4
+
+
+# Snapshot local do índice de imagens (sobrevive a reinícios do servidor)
+IMAGE_INDEX_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'indice_imagens.sqlite3')
+image_index_snapshot = ImageIndexSnapshot(IMAGE_INDEX_SNAPSHOT_PATH)
+
+# Miniaturas dos cards (estoque/pedidos), geradas sob demanda e guardadas em disco local
+IMAGE_THUMBNAIL_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'miniaturas')
+servico_miniaturas = ServicoMiniaturas(IMAGE_THUMBNAIL_CACHE_PATH, tamanho=(320, 320), qualidade=80)
+# Conferência de fundo branco das fotos (resultado guardado por caminho + mtime)
+verificador_fundo_branco = VerificadorFundoBranco(max_itens_cache=50000, max_workers=8)
+
+# Reescaneamento incremental: só relista as pastas cujo mtime mudou
+IMAGE_RESCAN_INTERVAL_SECONDS = 300
+# Pastas da rede visitadas em paralelo em cada varredura (SMB é limitado pela latência, não pela CPU)
+IMAGE_SCAN_WORKERS = 16
+# Índice único de imagens: uma varredura por raiz serve todas as consultas.
+# A origem guarda todos os arquivos, pois a coleta (/api/images/collect) considera qualquer extensão.
+indice_imagens_origem = ImageIndex(IMAGE_SOURCE_PATH, image_index_snapshot, com_coleta=True, max_workers=IMAGE_SCAN_WORKERS)
+# A pasta de busca alimenta os cards (menor imagem por SKU) e guarda as gerações para /get_all_cached?desde=N
+indice_imagens_busca = ImageIndex(IMAGE_SEARCH_ROOT_PATH, image_index_snapshot, extensoes=EXTENSOES_IMAGEM, com_menores=True,
+                                  ao_publicar=lambda geracao, mudancas: notificar_geracao_image_cache(geracao, mudancas),
+                                  max_workers=IMAGE_SCAN_WORKERS, com_aproximado=True)
+# Espelhos locais, atualizados pelos deltas de cada varredura do índice correspondente
+espelhos_imagens = {}
+if IMAGE_MIRROR_PATH:
+    espelhos_imagens[indice_imagens_origem] = EspelhoImagens(IMAGE_SOURCE_PATH, os.path.join(IMAGE_MIRROR_PATH, 'origem'),
+                                                             max_workers=IMAGE_MIRROR_WORKERS)
+    espelhos_imagens[indice_imagens_busca] = EspelhoImagens(IMAGE_SEARCH_ROOT_PATH, os.path.join(IMAGE_MIRROR_PATH, 'busca'),
+                                                            extensoes=EXTENSOES_IMAGEM, max_workers=IMAGE_MIRROR_WORKERS)
+# Tempo máximo que uma coleta espera pelo índice da origem logo após o servidor subir sem snapshot
+COLETA_AGUARDAR_INDICE_SEGUNDOS = 600
+# Limite de SKUs aceitos por chamada de /api/images/resolve
+MAX_SKUS_RESOLVE = 5000
+# Quantidade padrão e máxima de sugestões da busca aproximada
+FUZZY_SEARCH_DEFAULT_LIMIT = 10
+FUZZY_SEARCH_MAX_LIMIT = 50
+# Limite de SKUs aceitos por chamada de /api/images/white_background
+MAX_SKUS_FUNDO_BRANCO = 2000
+# Tamanho de cada bloco lido da rede e enviado ao navegador no download em ZIP da coleta
+COLETA_ZIP_BLOCO_BYTES = 1024 * 1024
+# Motor de cópia compartilhado pelas coletas: workers e bytes em trânsito limitados no servidor inteiro
+armazem_staging_imagens = ArmazemStaging(IMAGE_STAGING_PATH, IMAGE_STAGING_MAX_BYTES)
+# Limpeza da pasta temporária: idade máxima + cota, removendo os itens mais antigos primeiro
+limpeza_temporarios = LimpezaTemporarios(IMAGE_TEMP_DEST_PATH, TEMP_STORAGE_MAX_BYTES,
+                                         idade_maxima_sessao=TEMP_SESSION_MAX_AGE_SECONDS,
+                                         idade_maxima_chat=TEMP_CHAT_MAX_AGE_SECONDS,
+                                         intervalo=TEMP_CLEANUP_INTERVAL_SECONDS,
+                                         em_uso=lambda: coletas_imagens_por_sessao.copy())
+motor_copia_imagens = MotorDeCopia(max_workers=8, max_bytes_em_transito=256 * 1024 * 1024, tentativas=3,
+                                   armazem=armazem_staging_imagens)
+# Coletas de imagens em andamento, indexadas pelo conjunto de SKUs (para recusar duplicadas) e pela sessão
+coletas_imagens_lock = Lock()
+coletas_imagens_por_skus = {}
+coletas_imagens_por_sessao = {}
+# Sessões já concluídas -> id da tarefa no task_queue (para consulta do resultado)
+coletas_imagens_concluidas = {}
 
 
 
@@ -124,12 +210,9 @@ class TaskQueue:
         with self.task_lock:
             self.task_counter += 1
             task_id = self.task_counter
-        
-        future = self.executor.submit(self._run_with_semaphore, task_id, task_type, func, *args, **kwargs)
-        
-        with self.task_lock:
+            # Registrada antes do submit: uma tarefa rápida pode terminar antes de o submit retornar
             self.active_tasks[task_id] = {
-                'future': future,
+                'future': None,
                 'priority': priority,
                 'task_type': task_type,
                 'start_time': time.time()
@@ -138,6 +221,17 @@ class TaskQueue:
             # Incrementa contador de tarefas do tipo
             self.task_counters[task_type] += 1
         
+        try:
+            future = self.executor.submit(self._run_with_semaphore, task_id, task_type, func, *args, **kwargs)
+        except Exception:
+            with self.task_lock:
+                self.active_tasks.pop(task_id, None)
+            raise
+        
+        with self.task_lock:
+            if task_id in self.active_tasks:
+                self.active_tasks[task_id]['future'] = future
+        
         logger.info(f"Tarefa #{task_id} do tipo '{task_type}' adicionada com prioridade {priority}")
         return task_id
     
@@ -151,16 +245,14 @@ class TaskQueue:
             try:
                 result = func(*args, **kwargs)
                 with self.task_lock:
-                    if task_id in self.active_tasks:
-                        self.task_results[task_id] = result
-                        del self.active_tasks[task_id]
+                    self.task_results[task_id] = result
+                    self.active_tasks.pop(task_id, None)
                 return result
             except Exception as e:
                 logger.error(f"Erro na tarefa #{task_id}: {e}")
                 with self.task_lock:
-                    if task_id in self.active_tasks:
-                        self.task_results[task_id] = {'error': str(e)}
-                        del self.active_tasks[task_id]
+                    self.task_results[task_id] = {'error': str(e)}
+                    self.active_tasks.pop(task_id, None)
                 raise
     
     def _get_semaphore_for_task_type(self, task_type):
@@ -204,120 +296,6 @@ class TaskQueue:
 task_queue = TaskQueue(max_workers=8)
 
 
-
-
-
-# =================================================================
-# CACHE OTIMIZADO COM COMPRESSÃO E PREFETCH
-# =================================================================
-
-class OptimizedImageCache:
-    """
-    Cache otimizado para imagens com compressão e prefetch.
-    """
-    
-    def __init__(self, max_size=1000):
-        self.max_size = max_size
-        self.cache = {}
-        self.access_times = {}
-        self.cache_lock = threading.Lock()
-        self.compression_enabled = True
-        self.prefetch_pool = ThreadPoolExecutor(max_workers=3)
-        
-        logger.info(f"Cache otimizado inicializado com capacidade para {max_size} imagens")
-    
-    def get_image_paths(self, sku_base):
-        """Busca caminhos de imagem com cache e prefetch."""
-        with self.cache_lock:
-            if sku_base in self.cache:
-                # Atualiza timestamp de acesso
-                self.access_times[sku_base] = time.time()
-                logger.debug(f"Cache HIT para SKU: {sku_base}")
-                return self.cache[sku_base]
-        
-        # Cache miss - busca no disco
-        logger.info(f"Cache MISS para SKU: {sku_base} - buscando no disco")
-        paths = self._search_images_on_disk(sku_base)
-        
-        if paths:
-            with self.cache_lock:
-                self._evict_if_needed()
-                self.cache[sku_base] = paths
-                self.access_times[sku_base] = time.time()
-            
-            # Prefetch imagens relacionadas em background
-            self.prefetch_related_images(sku_base)
-        
-        return paths
-    
-    def _search_images_on_disk(self, sku_base):
-        """Busca imagens no disco de forma otimizada."""
-        valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.cdr')
-        paths = []
-        
-        # Lista de caminhos para verificar
-        search_paths = [
-            r'\\Vcadms-02\IMPRESSAO\IMPRESSAO - VIA CORES\IMPRESSÃO MKTP - SKU',
-            r'\\Vcadms-02\VENDAS\VENDAS MARKETPLACE'
-        ]
-        
-        for search_path in search_paths:
-            if not os.path.isdir(search_path):
-                continue
-                
-            try:
-                # Usa listdir em vez de walk para melhor performance
-                for filename in os.listdir(search_path):
-                    if filename.lower().endswith(valid_extensions):
-                        file_sku_base = filename.split('-')[0].split(' ')[0].upper()
-                        if file_sku_base == sku_base.upper():
-                            paths.append(os.path.join(search_path, filename))
-            except (PermissionError, OSError) as e:
-                logger.warning(f"Erro ao acessar {search_path}: {e}")
-                continue
-        
-        return paths
-    
-    def prefetch_related_images(self, sku_base):
-        """Prefetch de imagens relacionadas em background."""
-        related_skus = self._get_related_skus(sku_base)
-        
-        for related_sku in related_skus:
-            if related_sku not in self.cache:
-                self.prefetch_pool.submit(self.get_image_paths, related_sku)
-    
-    def _get_related_skus(self, sku_base):
-        """Retorna SKUs relacionados para prefetch."""
-        # Baseado no SKU atual, gera possíveis variações
-        related = [] 
-        
-        # Adiciona variações comuns
-        variations = ['-100', '-130', '-150', '-175', '-VF', '-F', '-P']
-        for var in variations:
-            related.append(sku_base + var)
-        
-        return related[:5]  # Limita prefetch para 5 itens
-    
-    def _evict_if_needed(self):
-        """Remove itens antigos do cache se necessário."""
-        if len(self.cache) <= self.max_size:
-            return
-        
-        # Remove os 20% menos acessados
-        items_to_remove = int(self.max_size * 0.2)
-        sorted_items = sorted(self.access_times.items(), key=lambda x: x[1])
-        
-        for sku, _ in sorted_items[:items_to_remove]:
-            if sku in self.cache:
-                del self.cache[sku]
-            del self.access_times[sku]
-        
-        logger.info(f"Cache limpo: {items_to_remove} itens removidos")
-
-# Inicializa cache otimizado
-optimized_cache = OptimizedImageCache(max_size=1500)
-
-
 # =================================================================
 # DECORATORS PARA RATE LIMITING E PERFORMANCE
 # =================================================================
@@ -369,179 +347,9 @@ ean_module = init_ean_module(app, db, socketio)
 
 
 
-# Em app.py, adicione esta nova função
-
 import os
 import shutil
 
-def cleanup_temp_folders():
-    """
-    Função que executa em segundo plano para limpar pastas de busca antigas.
-    Remove pastas com idade maior que 24 horas.
-    """
-    print("🧹 [CLEANUP THREAD] Serviço de limpeza de pastas temporárias iniciado.")
-    
-    # Define o tempo máximo de vida de uma pasta em segundos (24 horas)
-    MAX_AGE_SECONDS = 24 * 60 * 60  # 86400 segundos
-
-    # Tempo entre verificações (em segundos). Em produção, 3600 (1 hora) é razoável.
-    SLEEP_SECONDS = 3600
-
-    while True:
-        try:
-            print(f"🧹 [CLEANUP THREAD] Verificando pastas em '{IMAGE_TEMP_DEST_PATH}'...")
-            
-            # Garante que o diretório de destino existe
-            if not os.path.isdir(IMAGE_TEMP_DEST_PATH):
-                print(f"⚠️ [CLEANUP THREAD] Diretório de pastas temporárias não encontrado: {IMAGE_TEMP_DEST_PATH}. A limpeza será ignorada.")
-                time.sleep(SLEEP_SECONDS)
-                continue
-
-            pastas_encontradas = os.listdir(IMAGE_TEMP_DEST_PATH)
-            pastas_removidas = 0
-            now = int(time.time())
-
-            for folder_name in pastas_encontradas:
-                # Apenas processa pastas que seguem o nosso padrão "busca_..."
-                if not folder_name.startswith('busca_'):
-                    continue
-
-                full_folder_path = os.path.join(IMAGE_TEMP_DEST_PATH, folder_name)
-
-                # Segurança: só processa se for diretório e estiver dentro do caminho esperado
-                if not os.path.isdir(full_folder_path):
-                    continue
-
-                folder_age = None
-
-                # Tenta extrair timestamp do nome: 'busca_1761840769_9324' -> 1761840769
-                try:
-                    parts = folder_name.split('_')
-                    if len(parts) >= 2 and parts[1].isdigit():
-                        folder_creation_time = int(parts[1])
-                        folder_age = now - folder_creation_time
-                    else:
-                        raise ValueError("timestamp não encontrado no nome")
-                except Exception:
-                    # Fallback: usa tempo de modificação do diretório (getmtime)
-                    try:
-                        folder_mtime = int(os.path.getmtime(full_folder_path))
-                        folder_age = now - folder_mtime
-                    except Exception as e:
-                        print(f"⚠️ [CLEANUP THREAD] Não foi possível obter tempo da pasta {full_folder_path}: {e}")
-                        continue  # pula esta pasta
-
-                # Se a pasta for mais antiga que o limite, remove-a
-                try:
-                    if folder_age is not None and folder_age > MAX_AGE_SECONDS:
-                        hours = folder_age / 3600
-                        print(f"🗑️ [CLEANUP THREAD] Removendo pasta expirada: {folder_name} (Idade: {hours:.2f} horas)")
-                        
-                        # shutil.rmtree remove a pasta e todo o seu conteúdo
-                        shutil.rmtree(full_folder_path)
-                        pastas_removidas += 1
-                except Exception as e:
-                    print(f"❌ [CLEANUP THREAD] Erro ao tentar remover a pasta {full_folder_path}: {e}")
-
-            if pastas_removidas > 0:
-                print(f"✅ [CLEANUP THREAD] Limpeza concluída. {pastas_removidas} pastas removidas.")
-            else:
-                print("✅ [CLEANUP THREAD] Nenhuma pasta expirada encontrada.")
-
-        except Exception as e:
-            print(f"❌ [CLEANUP THREAD] Erro crítico no ciclo de limpeza: {e}")
-
-        # Espera antes de rodar a verificação novamente
-        time.sleep(SLEEP_SECONDS)
-
-
-
-
-
-
-# =================================================================
-# FUNÇÕES DE CONSTRUÇÃO DE CACHE OTIMIZADA
-# =================================================================
-
-def build_image_path_cache_optimized():
-    """
-    VERSÃO OTIMIZADA: Constrói cache de imagens com processamento paralelo
-    e loading incremental para não travar o servidor.
-    """
-    global IMAGE_PATH_CACHE, IS_CACHE_READY
-    logger.info("🚀 [CACHE THREAD OTIMIZADO] Iniciando mapeamento otimizado de imagens...")
-    start_time = time.time()
-    
-    temp_cache = {}
-    valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.cdr')
-    
-    if not os.path.isdir(IMAGE_SOURCE_PATH):
-        logger.error(f"❌ [CACHE THREAD] Diretório de origem não encontrado: {IMAGE_SOURCE_PATH}")
-        with CACHE_BUILD_LOCK:
-            IS_CACHE_READY = True
-        return
-    
-    # Processamento em chunks para evitar timeout
-    chunk_size = 1000  # Processa 1000 arquivos por vez
-    total_files = 0
-    processed_files = 0
-    
-    try:
-        # Lista todos os arquivos primeiro
-        all_files = []
-        for root, _, files in os.walk(IMAGE_SOURCE_PATH):
-            for filename in files:
-                if filename.lower().endswith(valid_extensions):
-                    all_files.append((root, filename))
-        
-        total_files = len(all_files)
-        logger.info(f"📁 Encontrados {total_files} arquivos de imagem para processar")
-        
-        # Processa em chunks
-        for i in range(0, len(all_files), chunk_size):
-            chunk = all_files[i:i + chunk_size]
-            chunk_start_time = time.time()
-            
-            # Processa chunk atual
-            for root, filename in chunk:
-                try:
-                    sku_base = filename.split('-')[0].split(' ')[0].upper()
-                    
-                    if sku_base not in temp_cache:
-                        temp_cache[sku_base] = []
-                    
-                    temp_cache[sku_base].append(os.path.join(root, filename))
-                    processed_files += 1
-                    
-                except Exception as e:
-                    logger.warning(f"Erro ao processar {filename}: {e}")
-                    continue
-            
-            chunk_time = time.time() - chunk_start_time
-            logger.info(f"✅ Chunk {i//chunk_size + 1} processado: {len(chunk)} arquivos em {chunk_time:.2f}s")
-            
-            # Atualiza cache incrementalmente para não perder tudo se falhar
-            with CACHE_BUILD_LOCK:
-                IMAGE_PATH_CACHE.update(temp_cache)
-            
-            # Pausa pequena entre chunks para não sobrecarregar
-            time.sleep(0.1)
-    
-    except Exception as e:
-        logger.error(f"Erro durante construção do cache: {e}")
-    
-    with CACHE_BUILD_LOCK:
-        IMAGE_PATH_CACHE.update(temp_cache)
-        IS_CACHE_READY = True
-    
-    total_time = time.time() - start_time
-    logger.info(f"✅ [CACHE THREAD] Mapeamento concluído: {len(IMAGE_PATH_CACHE)} SKUs em {total_time:.2f}s")
-    logger.info(f"📊 Processados {processed_files}/{total_files} arquivos")
-
-
-
-
-
 
 # =================================================================
 # FUNÇÃO DE OTIMIZAÇÃO DE IMAGEM MELHORADA
@@ -563,115 +371,7 @@ def optimize_image_async(source_path, dest_path, max_size=(1024, 1024), quality=
         logger.error(f"❌ Erro na cópia de {source_path}: {e}")
         return False
 
-def cleanup_temp_folders_optimized():
-    """
-    VERSÃO OTIMIZADA: Limpeza de pastas temporárias com processamento paralelo.
-    """
-    logger.info("🧹 [CLEANUP THREAD OTIMIZADO] Serviço de limpeza iniciado.")
-    
-    MAX_AGE_SECONDS = 24 * 60 * 60  # 24 horas
-    SLEEP_SECONDS = 3600  # 1 hora
-    
-    while True:
-        try:
-            logger.debug("🧹 [CLEANUP] Verificando pastas temporárias...")
-            
-            if not os.path.isdir(IMAGE_TEMP_DEST_PATH):
-                logger.warning(f"Pasta de destino não encontrada: {IMAGE_TEMP_DEST_PATH}")
-                time.sleep(SLEEP_SECONDS)
-                continue
-            
-            pastas_encontradas = [p for p in os.listdir(IMAGE_TEMP_DEST_PATH) 
-                                if p.startswith('busca_') and os.path.isdir(os.path.join(IMAGE_TEMP_DEST_PATH, p))]
-            
-            if not pastas_encontradas:
-                logger.debug("Nenhuma pasta para limpar encontrada")
-                time.sleep(SLEEP_SECONDS)
-                continue
-            
-            # Processa limpeza em paralelo usando thread pool
-            def check_and_remove_folder(folder_name):
-                full_path = os.path.join(IMAGE_TEMP_DEST_PATH, folder_name)
-                now = int(time.time())
-                
-                try:
-                    # Extrai timestamp do nome
-                    parts = folder_name.split('_')
-                    if len(parts) >= 2 and parts[1].isdigit():
-                        folder_age = now - int(parts[1])
-                    else:
-                        folder_age = now - int(os.path.getmtime(full_path))
-                    
-                    if folder_age > MAX_AGE_SECONDS:
-                        import shutil
-                        shutil.rmtree(full_path)
-                        return folder_name
-                except Exception as e:
-                    logger.warning(f"Erro ao processar pasta {folder_name}: {e}")
-                
-                return None
-            
-            # Executa verificação em paralelo
-            with ThreadPoolExecutor(max_workers=4) as executor:
-                futures = [executor.submit(check_and_remove_folder, folder) for folder in pastas_encontradas]
-                pastas_removidas = []
-                
-                for future in as_completed(futures):
-                    result = future.result()
-                    if result:
-                        pastas_removidas.append(result)
-            
-            if pastas_removidas:
-                logger.info(f"🗑️ [CLEANUP] Removidas {len(pastas_removidas)} pastas expiradas")
-            else:
-                logger.debug("✅ [CLEANUP] Nenhuma pasta expirada encontrada")
-                
-        except Exception as e:
-            logger.error(f"❌ [CLEANUP] Erro crítico: {e}")
-        
-        time.sleep(SLEEP_SECONDS)
-
-
-
-# --- 2. FUNÇÃO DE CONSTRUÇÃO DO CACHE (coloque junto com outras funções auxiliares) ---
-
-def build_image_path_cache():
-    """
-    Mapeia todos os arquivos de imagem na rede e guarda seus caminhos na memória.
-    Executa em segundo plano para não travar o servidor.
-    """
-    global IMAGE_PATH_CACHE, IS_CACHE_READY
-    print("🚀 [CACHE THREAD] Iniciando mapeamento de imagens da rede...")
-    start_time = time.time()
-    
-    temp_cache = {}
-    valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.cdr')
-
-    if not os.path.isdir(IMAGE_SOURCE_PATH):
-        print(f"❌ [CACHE THREAD] ERRO CRÍTICO: Diretório de origem não encontrado: {IMAGE_SOURCE_PATH}")
-        with CACHE_BUILD_LOCK:
-            IS_CACHE_READY = True # Marca como "pronto" para não tentar de novo.
-        return
-
-    for root, _, files in os.walk(IMAGE_SOURCE_PATH):
-        for filename in files:
-            if filename.lower().endswith(valid_extensions):
-                # Extrai o SKU base do nome do arquivo (ex: 'PCRV029' de 'PCRV029-ARTE.jpg')
-                # A chave do cache deve ser o SKU base para permitir a busca ampla.
-                sku_base = filename.split('-')[0].split(' ')[0].upper()
-                
-                if sku_base not in temp_cache:
-                    temp_cache[sku_base] = []
-                
-                # Adiciona o caminho completo do arquivo à lista daquele SKU base
-                temp_cache[sku_base].append(os.path.join(root, filename))
 
-    with CACHE_BUILD_LOCK:
-        IMAGE_PATH_CACHE = temp_cache
-        IS_CACHE_READY = True
-    
-    total_time = time.time() - start_time
-    print(f"✅ [CACHE THREAD] Mapeamento de imagens concluído em {total_time:.2f} segundos. {len(IMAGE_PATH_CACHE)} SKUs base mapeados.")
 
 
 # app.py
@@ -712,85 +412,108 @@ def optimize_image(source_path, dest_path, max_size=(1024, 1024), quality=85):
 # =================================================================================
 # TAREFA ASSÍNCRONA PARA COLETA DE IMAGENS (ADICIONE ESTA NOVA FUNÇÃO)
 # =================================================================================
-def collect_images_task(skus_input, session_id, socket_id):
+def collect_images_task(skus_to_search, session_id, socket_id, cancelado):
     """
     Esta é a tarefa que roda em segundo plano para coletar as imagens.
-    Ela faz todo o trabalho pesado (I/O de rede) e, no final, emite um sinal
-    de volta para o cliente específico que solicitou a ação.
+    Ela faz todo o trabalho pesado (I/O de rede), informa o progresso de cada
+    arquivo e, no final, emite um sinal de volta para o cliente que solicitou a ação.
     """
     print(f"✅ [TAREFA EM BACKGROUND] Iniciada para sessão {session_id} (Cliente: {socket_id})")
     session_folder_path = os.path.join(IMAGE_TEMP_DEST_PATH, session_id)
-    
-    try:
-        os.makedirs(session_folder_path, exist_ok=True)
-    except Exception as e:
-        # Se falhar aqui, notifica o cliente do erro
-        error_data = {'status': 'error', 'message': f'Falha ao criar diretório da sessão: {e}'}
-        socketio.emit('image_collection_complete', error_data, room=socket_id)
-        return
 
-    # O restante deste código é a sua lógica original de busca e cópia de arquivos.
-    # A única diferença é que ela agora roda isolada em uma thread.
-    found_files_info = []
-    not_found_skus = set(skus_input)
-    
-    sku_map = {}
-    for sku in skus_input:
-        sku_base = sku.split('-')[0].upper()
-        if sku_base not in sku_map:
-            sku_map[sku_base] = []
-        sku_map[sku_base].append(sku)
-
-    skus_base_to_search = set(sku_map.keys())
-    
-    candidate_files = {}
-    with CACHE_BUILD_LOCK:
-        cache_is_currently_ready = IS_CACHE_READY
-
-    if cache_is_currently_ready and IMAGE_PATH_CACHE:
-        print(f"⚡️ [TAREFA {session_id}] Usando cache em memória para encontrar candidatos.")
-        for sku_base in skus_base_to_search:
-            if sku_base in IMAGE_PATH_CACHE:
-                candidate_files[sku_base] = IMAGE_PATH_CACHE[sku_base]
-    else:
-        print(f"⏳ [TAREFA {session_id}] Cache não pronto. Executando busca em tempo real.")
-        # ... (sua lógica de os.walk para busca em tempo real) ...
+    def notificar(evento, dados):
+        if socket_id:
+            socketio.emit(evento, dados, room=socket_id)
 
-    files_to_copy_set = set()
-    variation_suffixes = ['-100', '-130', '-150', '-175', '-999', '-VF', '-F', '-P', '-V', '-C']
-
-    # ... (toda a sua lógica de filtragem inteligente para 'files_to_copy_set') ...
-    # (O código aqui permanece o mesmo, pois a lógica de filtragem não muda)
-
-    print(f"📂 [TAREFA {session_id}] Copiando {len(files_to_copy_set)} arquivos filtrados...")
-    for source_path, origin_sku in files_to_copy_set:
+    try:
+        # 1. Criar pasta de sessão
         try:
-            filename = os.path.basename(source_path)
-            dest_path = os.path.join(session_folder_path, filename)
-            
-            if optimize_image(source_path, dest_path): # optimize_image agora é só uma cópia
-                found_files_info.append({
-                    'filename': filename,
-                    'sku': origin_sku,
-                    'url': f'/api/images/temp/{session_id}/{filename}'
-                })
+            os.makedirs(session_folder_path, exist_ok=True)
         except Exception as e:
-            print(f"❌ [TAREFA {session_id}] Erro ao copiar o arquivo {source_path}: {e}")
+            error_data = {'status': 'error', 'session_folder': session_id, 'message': f'Não foi possível criar o diretório de destino: {e}'}
+            notificar('image_collection_complete', error_data)
+            return error_data
+
+        # 2. Validar caminho de origem
+        if not os.path.isdir(IMAGE_SOURCE_PATH):
+            error_msg = f"Caminho de origem das imagens inacessível: {IMAGE_SOURCE_PATH}"
+            logger.error(f"❌ ERRO: {error_msg}")
+            error_data = {'status': 'error', 'session_folder': session_id, 'message': error_msg}
+            notificar('image_collection_complete', error_data)
+            return error_data
+
+        # 3. Lógica principal de busca e seleção de arquivos (regras em ColetaImagensIndex.selecionar)
+        files_to_copy, found_skus = selecionar_arquivos_para_coleta(skus_to_search)
+        files_to_copy = {caminho_para_leitura(caminho) for caminho in files_to_copy}
+        notificar('image_collection_progress', {
+            'session_folder': session_id,
+            'filename': None,
+            'status': 'selecionado',
+            'erro': None,
+            'concluidos': 0,
+            'total': len(files_to_copy),
+            'bytes_copiados': 0
+        })
 
-    # =================================================================
-    # PONTO-CHAVE: EMITIR O RESULTADO VIA SOCKET.IO
-    # =================================================================
-    response_data = {
-        'status': 'ok',
-        'session_folder': session_id,
-        'session_folder_full_path': session_folder_path,
-        'found': found_files_info,
-        'not_found': list(not_found_skus)
-    }
-    
-    # Emite o resultado APENAS para o cliente que fez a requisição, usando seu socket_id.
-    socketio.emit('image_collection_complete', response_data, room=socket_id)
-    print(f"✅ [TAREFA EM BACKGROUND] Coleta de imagens para a sessão {session_id} concluída. Notificando cliente.")
+        # 4. Executar a cópia dos arquivos selecionados em paralelo, informando o progresso ao cliente
+        def informar_progresso(resultado, concluidos, total, bytes_copiados):
+            notificar('image_collection_progress', {
+                'session_folder': session_id,
+                'filename': resultado['filename'],
+                'status': resultado['status'],
+                'erro': resultado['erro'],
+                'concluidos': concluidos,
+                'total': total,
+                'bytes_copiados': bytes_copiados
+            })
+
+        resultados_copia = motor_copia_imagens.copiar_lote(
+            files_to_copy, session_folder_path, ao_progredir=informar_progresso, cancelado=cancelado
+        )
+        copied_files_info = [
+            {'filename': r['filename'], 'caminho_origem': r['caminho_origem'], 'nome_original': r['colisao']}
+            for r in resultados_copia if r['status'] == 'ok'
+        ]
+        failed_files_info = [
+            {'filename': r['filename'], 'caminho_origem': r['caminho_origem'], 'erro': r['erro']}
+            for r in resultados_copia if r['status'] == 'erro'
+        ]
+        arquivos_cancelados = sum(1 for r in resultados_copia if r['status'] == 'cancelado')
+        arquivos_renomeados = sum(1 for r in resultados_copia if r['colisao'])
+
+        # =================================================================
+        # PONTO-CHAVE: EMITIR O RESULTADO VIA SOCKET.IO
+        # =================================================================
+        not_found_skus = list(skus_to_search - found_skus)
+        response_data = {
+            'status': 'cancelado' if cancelado.is_set() else 'ok',
+            'session_folder': session_id,
+            'session_folder_full_path': session_folder_path,
+            'found': copied_files_info,
+            'not_found': not_found_skus,
+            'failed': failed_files_info,
+            'summary': {
+                'total_skus_buscados': len(skus_to_search),
+                'arquivos_copiados': len(copied_files_info),
+                'arquivos_com_falha': len(failed_files_info),
+                'arquivos_cancelados': arquivos_cancelados,
+                'arquivos_renomeados': arquivos_renomeados,
+                'skus_nao_encontrados': len(not_found_skus)
+            }
+        }
+
+        # Emite o resultado APENAS para o cliente que fez a requisição, usando seu socket_id.
+        notificar('image_collection_complete', response_data)
+        logger.info(f"✅ Operação concluída ({response_data['status']}). {len(copied_files_info)} arquivo(s) copiados para a pasta '{session_id}'.")
+        return response_data
+    except Exception as e:
+        logger.error(f"❌ [TAREFA {session_id}] Erro na coleta de imagens: {e}")
+        traceback.print_exc()
+        error_data = {'status': 'error', 'session_folder': session_id, 'message': f'Erro na coleta de imagens: {e}'}
+        notificar('image_collection_complete', error_data)
+        return error_data
+    finally:
+        finalizar_coleta_imagens(session_id)
 
 
 
@@ -826,6 +549,84 @@ def copy_file_safely(source_path, dest_path):
         logger.error(f"❌ ERRO ao copiar o arquivo {source_path}: {e}")
         return False
 
+def selecionar_arquivos_para_coleta(skus_to_search):
+    """
+    Aplica as regras de coleta (cilindros, variações e SKU base) usando o índice
+    em memória da origem. Logo após subir sem snapshot, espera a varredura da origem terminar.
+    Retorna (set de caminhos a copiar, set de SKUs encontrados).
+    """
+    indice = indice_imagens_origem.coleta
+    if indice is None:
+        # A varredura da origem já está em andamento: espera por ela em vez de iniciar outra
+        logger.info("⏳ Índice de coleta ainda não está pronto. Aguardando a varredura da origem...")
+        indice = indice_imagens_origem.aguardar_coleta(timeout=COLETA_AGUARDAR_INDICE_SEGUNDOS)
+        if indice is None:
+            raise RuntimeError("O índice de imagens da origem ainda está sendo montado. Tente novamente em alguns minutos.")
+    return indice.selecionar(skus_to_search)
+
+
+class _SaidaZip:
+    """Destino do ZipFile que só acumula os bytes escritos até o gerador repassá-los ao cliente."""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        return dados
+
+
+def gerar_zip_coleta(caminhos, nao_encontrados):
+    """
+    Gera um ZIP (sem compressão: as artes já são comprimidas) dos arquivos da origem em blocos,
+    lendo direto da rede e sem gravar nada em disco. Arquivos que sumiram entre a seleção e
+    o envio, e os SKUs sem arte, são listados em um texto no final do ZIP.
+    """
+    saida = _SaidaZip()
+    nomes_usados = set()
+    falhas = []
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for caminho in caminhos:
+            nome = os.path.basename(caminho)
+            raiz, extensao = os.path.splitext(nome)
+            sufixo = 2
+            while nome.upper() in nomes_usados:
+                nome = f"{raiz} ({sufixo}){extensao}"
+                sufixo += 1
+            try:
+                info = zipfile.ZipInfo.from_file(caminho, nome)
+                origem = open(caminho, 'rb')
+            except OSError as e:
+                logger.warning(f"⚠️ [ZIP] Arquivo ignorado {caminho}: {e}")
+                falhas.append(f"{caminho}: {e}")
+                continue
+            nomes_usados.add(nome.upper())
+            with origem, zf.open(info, 'w') as destino:
+                while True:
+                    bloco = origem.read(COLETA_ZIP_BLOCO_BYTES)
+                    if not bloco:
+                        break
+                    destino.write(bloco)
+                    yield saida.retirar()
+            yield saida.retirar()
+
+        if nao_encontrados or falhas:
+            linhas = []
+            if nao_encontrados:
+                linhas += ['SKUs sem arte encontrada:'] + sorted(nao_encontrados) + ['']
+            if falhas:
+                linhas += ['Arquivos que não puderam ser lidos:'] + falhas
+            zf.writestr('_LEIA-ME.txt', '\r\n'.join(linhas))
+    yield saida.retirar()
+
 # Em app.py, substitua a função collect_images_by_sku pela versão final:
 
 # =================================================================================
@@ -834,8 +635,9 @@ def copy_file_safely(source_path, dest_path):
 @app.route('/api/images/collect', methods=['POST'])
 def collect_images_with_smart_logic_v2():
     """
-    ROTA CORRIGIDA: Aplica regras de busca específicas e garante que todas as
-    partes de um kit (painel + cilindros) sejam encontradas corretamente.
+    Agenda a coleta de imagens em segundo plano e responde na hora com o id da tarefa.
+    O progresso e o resultado chegam pelo Socket.IO ao cliente do cabeçalho X-Socket-ID
+    (e também podem ser consultados em /api/images/collect/<session_id>).
     """
     # 1. Obter e validar os dados da requisição
     data = request.get_json()
@@ -844,101 +646,167 @@ def collect_images_with_smart_logic_v2():
         return jsonify({'status': 'error', 'message': 'Nenhum SKU foi fornecido.'}), 400
 
     skus_to_search = {sku.strip().upper() for sku in skus_raw if sku.strip()}
+    if not skus_to_search:
+        return jsonify({'status': 'error', 'message': 'Nenhum SKU foi fornecido.'}), 400
     logger.info(f"🔍 Iniciando busca inteligente (v2) para os SKUs: {list(skus_to_search)}")
 
-    # 2. Criar pasta de sessão
-    session_id = f"busca_{int(time.time())}"
-    session_folder_path = os.path.join(IMAGE_TEMP_DEST_PATH, session_id)
+    # 2. Recusar uma segunda coleta para o mesmo conjunto de SKUs enquanto a primeira não termina
+    chave = frozenset(skus_to_search)
+    socket_id = request.headers.get('X-Socket-ID')
+    with coletas_imagens_lock:
+        em_andamento = coletas_imagens_por_skus.get(chave)
+        if em_andamento:
+            return jsonify({
+                'status': 'error',
+                'message': 'Já existe uma coleta em andamento para estes SKUs.',
+                'task_id': em_andamento['task_id'],
+                'session_folder': em_andamento['session_id']
+            }), 409
+
+        session_id = f"busca_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+        coleta = {
+            'task_id': None,
+            'session_id': session_id,
+            'skus': chave,
+            'socket_id': socket_id,
+            'cancelado': threading.Event(),
+            'inicio': time.time()
+        }
+        coletas_imagens_por_skus[chave] = coleta
+        coletas_imagens_por_sessao[session_id] = coleta
+
+    # 3. Enfileirar a tarefa (prioridade baixa, limitada pelo semáforo de imagens)
     try:
-        os.makedirs(session_folder_path, exist_ok=True)
+        task_id = task_queue.submit_task(
+            3, collect_images_task, set(skus_to_search), session_id, socket_id, coleta['cancelado'],
+            task_type='image_processing'
+        )
     except Exception as e:
-        return jsonify({'status': 'error', 'message': f'Não foi possível criar o diretório de destino: {e}'}), 500
+        finalizar_coleta_imagens(session_id)
+        return jsonify({'status': 'error', 'message': f'Não foi possível agendar a coleta: {e}'}), 500
 
-    # 3. Validar caminho de origem e coletar todos os arquivos uma única vez
-    if not os.path.isdir(IMAGE_SOURCE_PATH):
-        error_msg = f"Caminho de origem das imagens inacessível: {IMAGE_SOURCE_PATH}"
-        logger.error(f"❌ ERRO: {error_msg}")
-        return jsonify({'status': 'error', 'message': error_msg}), 500
-    
-    all_source_files = [os.path.join(root, filename) for root, _, files in os.walk(IMAGE_SOURCE_PATH) for filename in files]
-    logger.info(f"Encontrados {len(all_source_files)} arquivos no total para análise.")
-
-    # 4. Lógica principal de busca e seleção de arquivos
-    files_to_copy = set()
-    found_skus = set()
-
-    for sku in skus_to_search:
-        sku_base = sku.split('-')[0]
-        is_base_search = (sku == sku_base)
-
-        for file_path in all_source_files:
-            filename_upper = os.path.basename(file_path).upper()
-
-            # =================================================================
-            # REGRA 1: BUSCA POR CILINDROS (Universal)
-            # Sempre busca cilindros que correspondam ao SKU base.
-            # =================================================================
-            if sku_base in filename_upper and 'CILINDRO' in filename_upper:
-                files_to_copy.add(file_path)
-                found_skus.add(sku)
-                continue # Otimização: Já classificamos este arquivo, podemos pular para o próximo.
-
-            # =================================================================
-            # REGRA 2: BUSCA POR SKU COM VARIAÇÃO (ex: "VCFZ001-VF", "PCRV029-130")
-            # =================================================================
-            if not is_base_search:
-                # A condição é simples: o nome do arquivo DEVE conter o SKU completo.
-                # Isso garante que "VCFZ001-VF" encontre "VCFZ001-VF - PAINEL.jpg".
-                if sku in filename_upper:
-                    files_to_copy.add(file_path)
-                    found_skus.add(sku)
-
-            # =================================================================
-            # REGRA 3: BUSCA POR SKU BASE (ex: "PRDA001", "PCRV029")
-            # =================================================================
-            else: # is_base_search is True
-                # O arquivo deve começar com o SKU base.
-                if filename_upper.startswith(sku_base):
-                    # E NÃO PODE conter uma variação que não seja a padrão.
-                    # Ex: "PRDA001-130" será ignorado, mas "PRDA001 - ARTE" será incluído.
-                    file_part_after_sku = filename_upper[len(sku_base):]
-                    if not any(f'-{suffix}' in file_part_after_sku for suffix in ['100', '130', '999', 'VF', 'F', 'P', 'V', 'C']):
-                        files_to_copy.add(file_path)
-                        found_skus.add(sku)
-                
-                # REGRA ESPECIAL: Se a busca for por "PCRV029", incluir também o painel "-150".
-                if sku == 'PCRV029' and 'PCRV029-150' in filename_upper:
-                    files_to_copy.add(file_path)
-                    found_skus.add(sku)
-
-    # 5. Executar a cópia dos arquivos selecionados
-    copied_files_info = []
-    for source_path in files_to_copy:
-        filename = os.path.basename(source_path)
-        dest_path = os.path.join(session_folder_path, filename)
-        if copy_file_safely(source_path, dest_path):
-            copied_files_info.append({'filename': filename, 'caminho_origem': source_path})
-
-    # 6. Preparar a resposta final
-    not_found_skus = list(skus_to_search - found_skus)
-    response_data = {
-        'status': 'ok',
+    with coletas_imagens_lock:
+        coleta['task_id'] = task_id
+        # A tarefa pode ter terminado antes de o id ser registrado
+        if session_id not in coletas_imagens_por_sessao:
+            coletas_imagens_concluidas[session_id] = task_id
+
+    return jsonify({
+        'status': 'accepted',
+        'task_id': task_id,
         'session_folder': session_id,
-        'session_folder_full_path': session_folder_path,
-        'found': copied_files_info,
-        'not_found': not_found_skus,
-        'summary': {
-            'total_skus_buscados': len(skus_to_search),
-            'arquivos_copiados': len(copied_files_info),
-            'skus_nao_encontrados': len(not_found_skus)
-        }
-    }
-    
-    logger.info(f"✅ Operação concluída. {len(copied_files_info)} arquivo(s) copiados para a pasta '{session_id}'.")
-    return jsonify(response_data), 200
+        'session_folder_full_path': os.path.join(IMAGE_TEMP_DEST_PATH, session_id)
+    }), 202
+
+
+@app.route('/api/images/collect/<session_id>', methods=['GET'])
+def get_image_collection_status(session_id):
+    """Consulta o andamento ou o resultado de uma coleta de imagens."""
+    with coletas_imagens_lock:
+        coleta = coletas_imagens_por_sessao.get(session_id)
+        task_id = coleta['task_id'] if coleta else coletas_imagens_concluidas.get(session_id)
+
+    if task_id is None:
+        if coleta:
+            return jsonify({'status': 'queued', 'session_folder': session_id}), 200
+        return jsonify({'status': 'not_found', 'message': 'Coleta não encontrada.'}), 404
+
+    status = task_queue.get_task_status(task_id)
+    status['task_id'] = task_id
+    status['session_folder'] = session_id
+    status.pop('start_time', None)
+    return jsonify(status), 200
+
+
+@app.route('/api/images/collect/<session_id>/cancel', methods=['POST'])
+def cancel_image_collection(session_id):
+    """Pede o cancelamento de uma coleta: os arquivos que ainda não começaram a ser copiados são pulados."""
+    with coletas_imagens_lock:
+        coleta = coletas_imagens_por_sessao.get(session_id)
+    if not coleta:
+        return jsonify({'status': 'error', 'message': 'Coleta não encontrada ou já concluída.'}), 404
+
+    coleta['cancelado'].set()
+    logger.info(f"🛑 Cancelamento solicitado para a coleta '{session_id}'.")
+    return jsonify({'status': 'ok', 'message': 'Cancelamento solicitado.', 'session_folder': session_id}), 200
+
+
+@app.route('/api/images/collect/zip', methods=['GET', 'POST'])
+def download_image_collection_zip():
+    """
+    Baixa as artes dos SKUs em um único ZIP transmitido em blocos, direto dos arquivos da origem
+    (sem passar pela pasta busca_*). Aceita {"skus": [...]} em JSON, o campo "skus" de um
+    formulário ou ?skus=A,B na URL.
+    """
+    data = request.get_json(silent=True) or {}
+    skus_raw = data.get('skus') or request.values.get('skus', '')
+    if isinstance(skus_raw, str):
+        skus_raw = re.split(r'[\s,]+', skus_raw)
+    if not isinstance(skus_raw, list):
+        return jsonify({'status': 'error', 'message': 'O campo "skus" deve ser uma lista.'}), 400
+
+    skus_to_search = {str(sku).strip().upper() for sku in skus_raw if sku and str(sku).strip()}
+    if not skus_to_search:
+        return jsonify({'status': 'error', 'message': 'Nenhum SKU foi fornecido.'}), 400
+
+    try:
+        files_to_copy, found_skus = selecionar_arquivos_para_coleta(skus_to_search)
+    except RuntimeError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+
+    logger.info(f"📦 [ZIP] Enviando {len(files_to_copy)} arquivo(s) para {len(skus_to_search)} SKU(s)")
+    nome_zip = f"artes_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    response = Response(gerar_zip_coleta([caminho_para_leitura(c) for c in sorted(files_to_copy)], skus_to_search - found_skus), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{nome_zip}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def finalizar_coleta_imagens(session_id):
+    """Remove a coleta do registro de coletas em andamento, guardando o id da tarefa para consultas."""
+    with coletas_imagens_lock:
+        coleta = coletas_imagens_por_sessao.pop(session_id, None)
+        if not coleta:
+            return
+        if coletas_imagens_por_skus.get(coleta['skus']) is coleta:
+            del coletas_imagens_por_skus[coleta['skus']]
+        if coleta['task_id'] is not None:
+            coletas_imagens_concluidas[session_id] = coleta['task_id']
+            # Mantém só as consultas mais recentes
+            while len(coletas_imagens_concluidas) > 500:
+                coletas_imagens_concluidas.pop(next(iter(coletas_imagens_concluidas)))
+    # A pasta nova pode ter passado a cota da pasta temporária
+    limpeza_temporarios.solicitar()
+
+
 
 
 
+def enviar_arquivo_condicional(file_path, mimetype=None, max_age=0, as_attachment=False, st=None):
+    """
+    Envia um arquivo com validação por ETag/Last-Modified e suporte a Range.
+    O ETag (tamanho + mtime) sai de um único stat, então uma revalidação do
+    navegador é respondida com 304 sem abrir o arquivo na rede.
+    Quem já tem o stat do arquivo pode passá-lo em st.
+    Lança FileNotFoundError se o arquivo não existir.
+    """
+    if st is None:
+        st = os.stat(file_path)
+    if not stat.S_ISREG(st.st_mode):
+        raise FileNotFoundError(file_path)
+    etag = f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=st.st_mtime):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.last_modified = st.st_mtime
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response
+
+    # conditional=True trata If-Range/Range (206) para downloads retomados de artes grandes
+    return send_file(file_path, mimetype=mimetype, as_attachment=as_attachment, conditional=True,
+                     etag=etag, last_modified=st.st_mtime, max_age=max_age)
 
 
 # --- ROTA PARA SERVIR IMAGENS (MODIFICADA PARA ACEITAR PASTAS DINÂMICAS) ---
@@ -954,7 +822,11 @@ def serve_temp_image(session_id, filename):
     try:
         # O diretório de busca agora é a pasta da sessão específica
         directory = os.path.join(IMAGE_TEMP_DEST_PATH, session_id)
-        return send_from_directory(directory, filename)
+        file_path = safe_join(directory, filename)
+        if file_path is None:
+            return "Arquivo não encontrado na sessão especificada.", 404
+        # As cópias da sessão não mudam depois de criadas
+        return enviar_arquivo_condicional(file_path, max_age=3600)
     except FileNotFoundError:
         return "Arquivo não encontrado na sessão especificada.", 404
 
@@ -1125,6 +997,116 @@ with app.app_context():
     db.create_all()
 
 
+# =================================================================
+# MÓDULOS DO /api/data E VERSÕES DE ALTERAÇÃO
+# =================================================================
+
+def _linhas_pedido(p):
+    """Um pedido vira uma linha por item (o frontend trabalha com os itens "achatados")."""
+    if not isinstance(p.itens, list):
+        return []
+    return [ { "id": p.pedido_id, "marketplace": p.marketplace, "status": p.status, **item } for item in p.itens ]
+
+# Cada módulo do /api/data: o modelo e como um registro vira linha(s) do frontend.
+# Para o delta, 'chave' é o atributo do modelo que identifica as linhas e 'campo' o nome dele
+# nas linhas do frontend. Módulos com 'limite' trazem só os registros mais recentes; no delta
+# eles recebem apenas os novos, e qualquer alteração ou remoção recarrega o módulo inteiro.
+MODULOS_DADOS = {
+    'users': {'modelo': User, 'chave': 'username', 'campo': 'username',
+              'linha': lambda u: { "username": u.username, "password": u.password, "role": u.role, "permissions": u.permissions, "gruposCostura": u.gruposCostura, "setor": u.setor, "isGroup": u.isGroup, "groupName": u.groupName, "members": u.members }},
+    'itensEstoque': {'modelo': ItemEstoque, 'chave': 'id', 'campo': 'id',
+                     'linha': lambda i: { "id": i.id, "sku": i.sku, "qtd": i.quantidade, "prateleira": i.prateleira, "capacidade": i.detalhes.get('capacidade', 25), "minStock": i.detalhes.get('minStock', 10), "status": i.detalhes.get('status', 'Disponível'), "reservadoPor": i.detalhes.get('reservadoPor') }},
+    'logs': {'modelo': Log, 'limite': 500,
+             'linha': lambda l: { "data": l.data, "usuario": l.usuario, "acao": l.acao }},
+    'pedidos': {'modelo': Pedido, 'chave': 'pedido_id', 'campo': 'id', 'linhas': _linhas_pedido},
+    'costura': {'modelo': Costura, 'chave': 'item_id', 'campo': 'lote',
+                'linha': lambda c: { "lote": c.item_id, **c.detalhes }},
+    'producao': {'modelo': Producao, 'chave': 'item_id', 'campo': 'op',
+                 'linha': lambda pr: { "op": pr.item_id, "impressora": pr.impressora, **pr.detalhes }},
+    'expedicao': {'modelo': Expedicao, 'chave': 'pacote_id', 'campo': 'id',
+                  'linha': lambda e: { "id": e.pacote_id, "itens": e.itens, "status": e.status, **e.detalhes }},
+    'historicoExpedicao': {'modelo': HistoricoExpedicao, 'limite': 1000,
+                           'linha': lambda h: { "pedidoId": h.pedido_id, "dataEnvio": h.data_envio, "usuarioEnvio": h.usuario_envio, **h.detalhes }},
+    'relatoriosArquivados': {'modelo': RelatorioArquivado, 'chave': 'data', 'campo': 'data',
+                             'linha': lambda r: { "data": r.data, "conteudo": r.conteudo }},
+    'transacoesEstoque': {'modelo': TransacaoEstoque, 'limite': 5000,
+                          'linha': lambda t: { "id": t.id, "timestamp": t.data, "usuario": t.usuario, "sku": t.sku, "tipo": t.tipo, "quantidade": t.quantidade, "prateleira": t.prateleira, "motivo": t.motivo }},
+    'stockClearRequests': {'modelo': StockClearRequest, 'chave': 'id', 'campo': 'id',
+                           'linha': lambda scr: { "id": scr.id, "requester": scr.requester, "timestamp": scr.timestamp, "details": scr.details, "status": scr.status, "authorizer": scr.authorizer, "authorization_timestamp": scr.authorization_timestamp }},
+    'historicoArtes': {'modelo': ArtHistory, 'limite': 500,
+                       'linha': lambda ah: { "id": ah.id, "quantidade": ah.quantidade, "sku": ah.sku, "impressora": ah.impressora, "usuario": ah.usuario, "timestamp": ah.timestamp }},
+    # 'id' do frontend é o 'pedido_id' do banco
+    'pedidosComErro': {'modelo': PedidoComErro, 'chave': 'pedido_id', 'campo': 'id',
+                       'linha': lambda pe: { "id": pe.pedido_id, "motivo": pe.motivo, "marketplace": pe.marketplace, "timestamp": pe.timestamp }},
+    'conversas': {'modelo': ChatMessage, 'chave': 'id', 'campo': 'id',
+                  'linha': lambda cm: { "id": cm.id, "conversaId": cm.conversaId, "remetente": cm.remetente, "destinatario": cm.destinatario, "mensagem": cm.mensagem, "anexo": cm.anexo, "timestamp": cm.timestamp, "lidaPor": cm.lidaPor }},
+}
+MODULO_POR_MODELO = {spec['modelo']: modulo for modulo, spec in MODULOS_DADOS.items()}
+
+# Acima desta quantidade de chaves alteradas, o delta manda o módulo inteiro (sai mais barato que o IN)
+LIMITE_CHAVES_DELTA = 2000
+# Carga completa em streaming: registros lidos por vez do cursor no servidor, tamanho dos blocos
+# enviados e maior módulo guardado no cache de JSON durante o streaming
+DADOS_STREAM_YIELD_PER = 1000
+DADOS_STREAM_BLOCO_BYTES = 64 * 1024
+DADOS_STREAM_MAX_CACHE_BYTES = 16 * 1024 * 1024
+
+registro_alteracoes = RegistroAlteracoes()
+cache_modulos_dados = CacheModulos(registro_alteracoes)
+
+
+def _anotar_alteracao(session, modulo, chaves):
+    """Acumula na sessão as chaves alteradas até o commit (None = módulo inteiro)."""
+    pendentes = session.info.setdefault('alteracoes_pendentes', {})
+    if chaves is None:
+        pendentes[modulo] = None
+    elif pendentes.get(modulo, ()) is not None:
+        pendentes.setdefault(modulo, set()).update(chaves)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _registrar_alteracoes_do_flush(session, flush_context):
+    """Anota as linhas inseridas, alteradas e removidas de cada módulo do /api/data."""
+    for tipo, objetos in (('novo', session.new), ('alterado', session.dirty), ('removido', session.deleted)):
+        for obj in objetos:
+            modulo = MODULO_POR_MODELO.get(type(obj))
+            if modulo is None:
+                continue
+            if tipo == 'alterado' and not session.is_modified(obj):
+                continue
+            spec = MODULOS_DADOS[modulo]
+            if 'limite' in spec:
+                # Módulos "mais recentes" só acompanham inserções; o resto recarrega o módulo
+                _anotar_alteracao(session, modulo, {obj.id} if tipo == 'novo' else None)
+                continue
+            # Valor atual e, se a chave mudou, o antigo (as linhas antigas somem do frontend)
+            historico = inspect(obj).attrs[spec['chave']].history
+            chaves = {valor for valor in (*historico.added, *historico.unchanged, *historico.deleted) if valor is not None}
+            _anotar_alteracao(session, modulo, chaves or None)
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _registrar_alteracoes_em_massa(execute_state):
+    """UPDATE/DELETE em massa (query.delete()) não passam pelo flush: o módulo inteiro é recarregado."""
+    if execute_state.is_update or execute_state.is_delete:
+        for mapper in execute_state.all_mappers:
+            modulo = MODULO_POR_MODELO.get(mapper.class_)
+            if modulo is not None:
+                _anotar_alteracao(execute_state.session, modulo, None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publicar_alteracoes(session):
+    pendentes = session.info.pop('alteracoes_pendentes', None)
+    if pendentes:
+        registro_alteracoes.publicar(pendentes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_alteracoes(session):
+    session.info.pop('alteracoes_pendentes', None)
+
+
 # =================================================================================
 # ROTAS DEDICADAS DO CHAT (VERSÃO OTIMIZADA)
 # ========================================================================================
@@ -1431,9 +1413,13 @@ def get_system_status():
     """Retorna status completo do sistema de performance."""
     try:
         cache_stats = {
-            'is_cache_ready': IS_CACHE_READY,
-            'cached_skus': len(IMAGE_PATH_CACHE),
-            'optimized_cache_size': len(optimized_cache.cache)
+            'is_cache_ready': indice_imagens_origem.pronto and indice_imagens_busca.pronto,
+            'cached_skus': len(indice_imagens_origem.por_base),
+            'indice_origem': indice_imagens_origem.get_stats(),
+            'indice_busca': indice_imagens_busca.get_stats(),
+            'fundo_branco': verificador_fundo_branco.get_stats(),
+            'limpeza_temporarios': limpeza_temporarios.get_stats(),
+            'espelhos': [espelho.get_stats() for espelho in espelhos_imagens.values()]
         }
         
         queue_stats = task_queue.get_queue_stats()
@@ -1455,8 +1441,11 @@ def get_system_status():
             'system': system_stats,
             'database': {
                 'pool_size': app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'],
-                'active_connections': len(db.engine.pool.checkedout())
-            }
+                'active_connections': len(db.engine.pool.checkedout()),
+                'alteracoes': registro_alteracoes.get_stats(),
+                'cache_modulos': cache_modulos_dados.get_stats()
+            },
+            'compressao': compressao_respostas.get_stats()
         })
         
     except Exception as e:
@@ -2207,96 +2196,137 @@ create_default_admin()
 # FUNÇÕES AUXILIARES DE CONVERSÃO
 # ==============================
 
-def data_to_dict(modulos=None):
-    """
-    VERSÃO OTIMIZADA: Converte dados do banco para dicionário de forma seletiva.
-    
-    - Se 'modulos' for None ou uma lista vazia, carrega TUDO (para o boot inicial).
-    - Se 'modulos' for uma lista de nomes (ex: ['pedidos', 'estoque']), carrega APENAS
-      os dados desses módulos, tornando a resposta muito mais rápida e leve.
-    """
-    if not modulos:
-        # Carrega todos os módulos se nenhum for especificado
-        modulos = [
-            'users', 'itensEstoque', 'logs', 'pedidos', 'costura', 'producao', 
-            'expedicao', 'historicoExpedicao',
-            'relatoriosArquivados', 'transacoesEstoque', 
-            'stockClearRequests', 'historicoArtes', 'pedidosComErro', 'conversas'
-        ]
+def linhas_do_modulo(modulo, registros):
+    """Converte registros do banco nas linhas que o frontend espera para o módulo."""
+    spec = MODULOS_DADOS[modulo]
+    if 'linhas' in spec:
+        return [linha for registro in registros for linha in spec['linhas'](registro)]
+    return [spec['linha'](registro) for registro in registros]
 
-    data = {}
 
-    if 'users' in modulos:
-        data["users"] = [ { "username": u.username, "password": u.password, "role": u.role, "permissions": u.permissions, "gruposCostura": u.gruposCostura, "setor": u.setor, "isGroup": u.isGroup, "groupName": u.groupName, "members": u.members } for u in User.query.all() ]
-    
-    if 'itensEstoque' in modulos:
-        data["itensEstoque"] = [ { "id": i.id, "sku": i.sku, "qtd": i.quantidade, "prateleira": i.prateleira, "capacidade": i.detalhes.get('capacidade', 25), "minStock": i.detalhes.get('minStock', 10), "status": i.detalhes.get('status', 'Disponível'), "reservadoPor": i.detalhes.get('reservadoPor') } for i in ItemEstoque.query.all() ]
-
-    if 'logs' in modulos:
-        # Otimização: Carrega apenas os 500 logs mais recentes para não sobrecarregar
-        data["logs"] = [ { "data": l.data, "usuario": l.usuario, "acao": l.acao } for l in Log.query.order_by(Log.id.desc()).limit(500).all() ]
-
-    if 'pedidos' in modulos:
-        pedidos_planos = []
-        # Otimização: Usa 'joinedload' para carregar itens relacionados de forma mais eficiente (se aplicável)
-        for p in Pedido.query.all():
-            if isinstance(p.itens, list):
-                for item in p.itens:
-                    pedidos_planos.append({ "id": p.pedido_id, "marketplace": p.marketplace, "status": p.status, **item })
-        data["pedidos"] = pedidos_planos
-
-    if 'costura' in modulos:
-        data["costura"] = [ { "lote": c.item_id, **c.detalhes } for c in Costura.query.all() ]
-
-    if 'producao' in modulos:
-        data["producao"] = [ { "op": pr.item_id, "impressora": pr.impressora, **pr.detalhes } for pr in Producao.query.all() ]
-
-    if 'expedicao' in modulos:
-        # Lógica de 'expedicao' permanece a mesma
-        data["expedicao"] = [ { "id": e.pacote_id, "itens": e.itens, "status": e.status, **e.detalhes } for e in Expedicao.query.all() ]
-
-    if 'historicoExpedicao' in modulos:
-        # Converte os dados da tabela HistoricoExpedicao para o formato que o frontend espera
-        historico_formatado = []
-        for h in HistoricoExpedicao.query.order_by(HistoricoExpedicao.id.desc()).limit(1000).all(): # Limita para 1000 registros recentes
-            item_formatado = {
-                "pedidoId": h.pedido_id,
-                "dataEnvio": h.data_envio,
-                "usuarioEnvio": h.usuario_envio,
-                **h.detalhes  # Expande o JSON 'detalhes' (que contém a lista de itens)
-            }
-            historico_formatado.append(item_formatado)
-        data["historicoExpedicao"] = historico_formatado
-    
-    
-    if 'relatoriosArquivados' in modulos:
-        data["relatoriosArquivados"] = [ { "data": r.data, "conteudo": r.conteudo } for r in RelatorioArquivado.query.all() ]
+def query_do_modulo(modulo):
+    """Consulta dos registros de um módulo (só os mais recentes nos módulos com limite)."""
+    spec = MODULOS_DADOS[modulo]
+    query = spec['modelo'].query
+    if 'limite' in spec:
+        query = query.order_by(spec['modelo'].id.desc()).limit(spec['limite'])
+    return query
 
-    if 'transacoesEstoque' in modulos:
-        # Otimização: Carrega apenas as 5000 transações mais recentes
-        data["transacoesEstoque"] = [ { "id": t.id, "timestamp": t.data, "usuario": t.usuario, "sku": t.sku, "tipo": t.tipo, "quantidade": t.quantidade, "prateleira": t.prateleira, "motivo": t.motivo } for t in TransacaoEstoque.query.order_by(TransacaoEstoque.id.desc()).limit(5000).all() ]
 
-    if 'stockClearRequests' in modulos:
-        data["stockClearRequests"] = [ { "id": scr.id, "requester": scr.requester, "timestamp": scr.timestamp, "details": scr.details, "status": scr.status, "authorizer": scr.authorizer, "authorization_timestamp": scr.authorization_timestamp } for scr in StockClearRequest.query.all() ]
+def consultar_modulo(modulo):
+    return query_do_modulo(modulo).all()
 
-    if 'historicoArtes' in modulos:
-        # Otimização: Carrega apenas os 500 registros mais recentes
-        data["historicoArtes"] = [ { "id": ah.id, "quantidade": ah.quantidade, "sku": ah.sku, "impressora": ah.impressora, "usuario": ah.usuario, "timestamp": ah.timestamp } for ah in ArtHistory.query.order_by(ArtHistory.id.desc()).limit(500).all() ]
 
-    if 'pedidosComErro' in modulos:
-        data["pedidosComErro"] = [
-            {
-                "id": pe.pedido_id, # Mapeia 'pedido_id' do banco para 'id' no frontend
-                "motivo": pe.motivo,
-                "marketplace": pe.marketplace,
-                "timestamp": pe.timestamp
-            } for pe in PedidoComErro.query.all()
-        ]
+def _json_bytes(valor):
+    """Serializa um valor em JSON compacto (UTF-8), com orjson quando instalado."""
+    return dumps_bytes(valor)
+
+
+def _juntar_json(partes):
+    """Monta um objeto JSON a partir de pares (nome, valor já serializado em bytes)."""
+    return b'{' + b','.join(_json_bytes(nome) + b':' + valor for nome, valor in partes) + b'}'
+
 
-    if 'conversas' in modulos:
-        data["conversas"] = [ { "id": cm.id, "conversaId": cm.conversaId, "remetente": cm.remetente, "destinatario": cm.destinatario, "mensagem": cm.mensagem, "anexo": cm.anexo, "timestamp": cm.timestamp, "lidaPor": cm.lidaPor } for cm in ChatMessage.query.all() ]
+def json_do_modulo(modulo):
+    """JSON das linhas de um módulo, reaproveitado do cache até o próximo commit que o altere."""
+    return cache_modulos_dados.obter(modulo, lambda: _json_bytes(linhas_do_modulo(modulo, consultar_modulo(modulo))))
 
-    return data
+
+def resposta_json(conteudo):
+    return Response(conteudo, mimetype='application/json')
+
+
+def _json_modulo_em_partes(modulo):
+    """Gera o JSON de um módulo linha por linha, lendo o banco em lotes por um cursor no servidor."""
+    yield b'['
+    separador = b''
+    for registro in query_do_modulo(modulo).yield_per(DADOS_STREAM_YIELD_PER):
+        for linha in linhas_do_modulo(modulo, (registro,)):
+            yield separador + _json_bytes(linha)
+            separador = b','
+    yield b']'
+
+
+def _em_blocos(partes, tamanho=DADOS_STREAM_BLOCO_BYTES):
+    """Junta pedaços pequenos em blocos de ~tamanho bytes; pedaços grandes seguem direto."""
+    buffer = []
+    acumulado = 0
+    for parte in partes:
+        if len(parte) >= tamanho:
+            if buffer:
+                yield b''.join(buffer)
+                buffer, acumulado = [], 0
+            yield parte
+            continue
+        buffer.append(parte)
+        acumulado += len(parte)
+        if acumulado >= tamanho:
+            yield b''.join(buffer)
+            buffer, acumulado = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gerar_carga_completa(cursor):
+    """
+    Gera o JSON da carga completa do /api/data módulo por módulo, sem montá-lo inteiro na memória.
+
+    Módulos em dia no cache saem dele; os outros são lidos do banco em lotes e, se couberem
+    em DADOS_STREAM_MAX_CACHE_BYTES, ficam no cache para as próximas cargas.
+    """
+    yield b'{'
+    for indice, modulo in enumerate(MODULOS_DADOS):
+        yield (b',' if indice else b'') + _json_bytes(modulo) + b':'
+        conteudo = cache_modulos_dados.atual(modulo)
+        if conteudo is not None:
+            yield conteudo
+            continue
+
+        versao = registro_alteracoes.versao_modulo(modulo)  # lida antes da consulta, como no cache
+        guardado = bytearray()
+        for parte in _json_modulo_em_partes(modulo):
+            if guardado is not None:
+                guardado += parte
+                if len(guardado) > DADOS_STREAM_MAX_CACHE_BYTES:
+                    guardado = None
+            yield parte
+        if guardado is not None:
+            cache_modulos_dados.guardar(modulo, versao, bytes(guardado))
+    yield b',"cursor":' + _json_bytes(cursor) + b'}'
+
+
+def dados_desde(cursor):
+    """
+    Monta o delta do /api/data desde um cursor.
+
+    Para cada módulo alterado, a resposta traz um destes formatos:
+    - {'campo', 'chaves', 'itens'}: as linhas com 'campo' em 'chaves' devem ser trocadas por 'itens'
+    - {'recentes', 'limite'}: linhas novas (mais novas primeiro) a colocar no topo da lista
+    - {'completo'}: o módulo inteiro
+
+    Returns:
+        bytes: JSON do delta com o novo cursor, ou None se o cursor expirou (o cliente faz a carga completa)
+    """
+    alteracoes = registro_alteracoes.desde(cursor)
+    if alteracoes is None:
+        return None
+    novo_cursor, por_modulo = alteracoes
+
+    modulos = []
+    for modulo, chaves in por_modulo.items():
+        spec = MODULOS_DADOS[modulo]
+        modelo = spec['modelo']
+        if chaves is None or len(chaves) > LIMITE_CHAVES_DELTA:
+            # Depois de um save_all todos os clientes pedem o módulo inteiro: sai do cache
+            modulos.append((modulo, _juntar_json([('completo', json_do_modulo(modulo))])))
+        elif 'limite' in spec:
+            registros = modelo.query.filter(modelo.id.in_(chaves)).order_by(modelo.id.desc()).all()
+            modulos.append((modulo, _json_bytes({'recentes': linhas_do_modulo(modulo, registros), 'limite': spec['limite']})))
+        else:
+            registros = modelo.query.filter(getattr(modelo, spec['chave']).in_(chaves)).all()
+            modulos.append((modulo, _json_bytes({'campo': spec['campo'], 'chaves': list(chaves), 'itens': linhas_do_modulo(modulo, registros)})))
+
+    return _juntar_json([('delta', b'true'), ('cursor', _json_bytes(novo_cursor)), ('modulos', _juntar_json(modulos))])
 
 # ==============================
 # ROTAS
@@ -2314,162 +2344,185 @@ def get_data():
     - /api/data (para carregar tudo na inicialização)
     - /api/data?modulos=pedidos (para carregar apenas dados de pedidos)
     - /api/data?modulos=estoque,transacoesEstoque (para carregar múltiplos módulos)
+    - /api/data?since=<cursor> (só o que mudou desde a última carga; ver dados_desde)
+    
+    A carga completa traz o 'cursor' para a próxima chamada com 'since'. Ele é lido antes
+    das consultas: uma alteração que chegue no meio da carga volta no próximo delta.
+    
+    Cada módulo sai do cache de JSON já serializado (cache_modulos_dados) enquanto nenhum
+    commit o alterar, então os clientes que reagem ao mesmo sinal do socket custam uma
+    consulta ao banco no total, e não uma cada.
     """
+    cursor = request.args.get('since')
+    if cursor:
+        delta = dados_desde(cursor)
+        if delta is not None:
+            return resposta_json(delta)
+        print("🔁 Cursor de dados expirado, enviando a carga completa...")
+
+    cursor_atual = registro_alteracoes.cursor()
     modulos_requisitados_str = request.args.get('modulos')
     
     if modulos_requisitados_str:
         # Converte a string de módulos (separada por vírgula) em uma lista
         modulos_lista = modulos_requisitados_str.split(',')
         print(f"🚀 Carregando dados específicos para os módulos: {modulos_lista}")
-        dados = data_to_dict(modulos=modulos_lista)
-    else:
-        # Se nenhum módulo for especificado, carrega tudo (comportamento para o boot inicial)
-        print("🚀 Carregando todos os dados para o boot inicial...")
-        dados = data_to_dict()
-        
-    return jsonify(dados)
+        partes = [(modulo, json_do_modulo(modulo)) for modulo in MODULOS_DADOS if modulo in modulos_lista]
+        return resposta_json(_juntar_json(partes))
+
+    # Se nenhum módulo for especificado, carrega tudo (comportamento para o boot inicial).
+    # A resposta vai em streaming (chunked), então a memória não cresce com o tamanho das tabelas.
+    print("🚀 Carregando todos os dados para o boot inicial...")
+    return Response(stream_with_context(_em_blocos(gerar_carga_completa(cursor_atual))), mimetype='application/json')
 
 # =================================================================
 # ROTA /api/save (MANTIDA PARA BACKUPS, MAS NÃO PARA USO DIÁRIO)
 # =================================================================
+
+def _registros_pedidos(linhas):
+    """Reagrupa as linhas "achatadas" do frontend em um registro por pedido."""
+    pedidos_agrupados = {}
+    for item_plano in linhas:
+        item_plano = dict(item_plano)
+        pedido_id = item_plano.pop('id', None)
+        if not pedido_id: continue
+        marketplace = item_plano.pop('marketplace', 'N/A')
+        status = item_plano.pop('status', 'pendente')
+        if pedido_id not in pedidos_agrupados:
+            pedidos_agrupados[pedido_id] = {'pedido_id': pedido_id, 'marketplace': marketplace, 'status': status, 'itens': []}
+        pedidos_agrupados[pedido_id]['itens'].append(item_plano)
+    return list(pedidos_agrupados.values())
+
+
+def _registro_log(l_data):
+    acao = l_data.get('acao')
+    if isinstance(acao, dict):
+        acao = json.dumps(acao, ensure_ascii=False)
+    return {'data': l_data.get('data'), 'usuario': l_data.get('usuario'), 'acao': acao}
+
+
+# Como cada módulo do /api/save vira registros do banco: colunas gravadas e chave usada para
+# parear os registros enviados com os existentes (None = o registro inteiro, só insere/remove).
+# Nos módulos com 'limite' em MODULOS_DADOS o frontend só conhece os mais recentes: a comparação
+# é feita contra eles e só há remoção dentro da janela pareada (ver calcular_diferenca).
+COLUNAS_USUARIO = ('username', 'password', 'role', 'permissions', 'gruposCostura', 'setor', 'isGroup', 'groupName', 'members')
+MODULOS_GRAVACAO = {
+    'users': {'modelo': User, 'colunas': COLUNAS_USUARIO, 'chave': ('username',),
+              'registros': lambda linhas: [{k: v for k, v in u.items() if k in COLUNAS_USUARIO} for u in linhas]},
+    'itensEstoque': {'modelo': ItemEstoque, 'colunas': ('sku', 'quantidade', 'prateleira', 'detalhes'), 'chave': ('sku', 'prateleira'),
+                     'registros': lambda linhas: [{'sku': i.get('sku'), 'quantidade': i.get('qtd', 0), 'prateleira': i.get('prateleira'),
+                                                   'detalhes': {'capacidade': i.get('capacidade'), 'minStock': i.get('minStock'),
+                                                                'status': i.get('status'), 'reservadoPor': i.get('reservadoPor')}} for i in linhas]},
+    'transacoesEstoque': {'modelo': TransacaoEstoque, 'colunas': ('data', 'usuario', 'sku', 'tipo', 'quantidade', 'prateleira', 'motivo'), 'chave': None,
+                          'registros': lambda linhas: [{'data': t.get('timestamp'), 'usuario': t.get('usuario'), 'sku': t.get('sku'), 'tipo': t.get('tipo'),
+                                                        'quantidade': t.get('quantidade'), 'prateleira': t.get('prateleira'), 'motivo': t.get('motivo')} for t in linhas]},
+    'pedidos': {'modelo': Pedido, 'colunas': ('pedido_id', 'marketplace', 'status', 'itens'), 'chave': ('pedido_id',),
+                'registros': _registros_pedidos},
+    # 'id' do frontend é o 'pedido_id' do banco
+    'pedidosComErro': {'modelo': PedidoComErro, 'colunas': ('pedido_id', 'motivo', 'marketplace', 'timestamp'), 'chave': ('pedido_id',),
+                       'registros': lambda linhas: [{'pedido_id': e.get('id'), 'motivo': e.get('motivo'), 'marketplace': e.get('marketplace'),
+                                                     'timestamp': e.get('timestamp', datetime.datetime.now().isoformat())} for e in linhas]},
+    'producao': {'modelo': Producao, 'colunas': ('item_id', 'impressora', 'detalhes'), 'chave': ('item_id',),
+                 'registros': lambda linhas: [{'item_id': p.get('op'), 'impressora': p.get('impressora'),
+                                               'detalhes': {k: v for k, v in p.items() if k not in ['op', 'impressora']}} for p in linhas if p.get('op')]},
+    'costura': {'modelo': Costura, 'colunas': ('item_id', 'detalhes'), 'chave': ('item_id',),
+                'registros': lambda linhas: [{'item_id': c.get('lote'), 'detalhes': {k: v for k, v in c.items() if k != 'lote'}} for c in linhas if c.get('lote')]},
+    'expedicao': {'modelo': Expedicao, 'colunas': ('pacote_id', 'itens', 'status', 'detalhes'), 'chave': ('pacote_id',),
+                  'registros': lambda linhas: [{'pacote_id': e.get('id'), 'itens': e.get('itens', []), 'status': e.get('status', 'pendente'),
+                                                'detalhes': {k: v for k, v in e.items() if k not in ['id', 'itens', 'status']}} for e in linhas if e.get('id')]},
+    # O resto dos dados (como a lista de 'itens') vai para o campo 'detalhes'
+    'historicoExpedicao': {'modelo': HistoricoExpedicao, 'colunas': ('pedido_id', 'data_envio', 'usuario_envio', 'detalhes'), 'chave': ('pedido_id',),
+                           'registros': lambda linhas: [{'pedido_id': h.get('pedidoId'), 'data_envio': h.get('dataEnvio'), 'usuario_envio': h.get('usuarioEnvio'),
+                                                         'detalhes': {k: v for k, v in h.items() if k not in ['pedidoId', 'dataEnvio', 'usuarioEnvio']}}
+                                                        for h in linhas if h.get('pedidoId')]},
+    'logs': {'modelo': Log, 'colunas': ('data', 'usuario', 'acao'), 'chave': None,
+             'registros': lambda linhas: [_registro_log(l) for l in linhas]},
+}
+# Ids removidos por DELETE (listas muito grandes de parâmetros são divididas)
+SAVE_LOTE_REMOCAO = 5000
+
+
+def gravar_modulo(modulo, linhas):
+    """
+    Leva ao banco o estado de um módulo enviado pelo frontend aplicando só a diferença:
+    inserções, atualizações (apenas das colunas alteradas) e remoções, cada uma em lote.
+
+    Returns:
+        dict: Quantidade de registros inseridos, atualizados e removidos
+    """
+    spec = MODULOS_GRAVACAO[modulo]
+    modelo = spec['modelo']
+    tabela = modelo.__table__
+    limite = MODULOS_DADOS[modulo].get('limite')
+    chave_delta = MODULOS_DADOS[modulo].get('chave')
+    registros = spec['registros'](linhas)
+
+    if not registros:
+        # Lista vazia limpa a tabela inteira, como sempre foi (ex: "excluir todos os dados")
+        removidos = db.session.execute(tabela.delete()).rowcount
+        if removidos:
+            _anotar_alteracao(db.session, modulo, None)
+        return {'inseridos': 0, 'atualizados': 0, 'removidos': removidos}
+
+    consulta = db.session.query(modelo.id, *[getattr(modelo, coluna) for coluna in spec['colunas']])
+    if limite:
+        # A janela do frontend mais a folga para o que outros usuários criaram depois da carga dele
+        consulta = consulta.order_by(modelo.id.desc()).limit(len(registros) + limite)
+    existentes = [linha._asdict() for linha in consulta]
+
+    inserir, atualizar, remover = calcular_diferenca(existentes, registros, spec['colunas'], spec['chave'],
+                                                     somente_janela=bool(limite))
+    ids_remover = [registro['id'] for registro in remover]
+    for inicio in range(0, len(ids_remover), SAVE_LOTE_REMOCAO):
+        db.session.execute(tabela.delete().where(tabela.c.id.in_(ids_remover[inicio:inicio + SAVE_LOTE_REMOCAO])))
+    if atualizar:
+        db.session.bulk_update_mappings(modelo, atualizar)
+    if inserir:
+        # Quando a chave do delta é o id, ele precisa voltar do banco para avisar os clientes
+        db.session.bulk_insert_mappings(modelo, inserir, return_defaults=(chave_delta == 'id'))
+
+    # Bulk não passa pelos eventos do flush: anota as chaves alteradas para o delta do /api/data
+    if inserir or atualizar or remover:
+        if limite or chave_delta is None:
+            _anotar_alteracao(db.session, modulo, None)
+        else:
+            existentes_por_id = {registro['id']: registro for registro in existentes}
+            chaves = {registro[chave_delta] for registro in remover}
+            chaves.update(existentes_por_id[registro['id']][chave_delta] for registro in atualizar)
+            chaves.update(registro[chave_delta] for registro in inserir)
+            _anotar_alteracao(db.session, modulo, chaves)
+
+    return {'inseridos': len(inserir), 'atualizados': len(atualizar), 'removidos': len(remover)}
+
+
 @app.route('/api/save', methods=['POST'])
 def save_data():
     """
     Recebe o estado completo da aplicação e atualiza o banco de dados.
+    
+    Cada módulo enviado é comparado com o que já está no banco e só a diferença é gravada
+    (ver gravar_modulo), então o tempo com o db_write_lock cresce com o que mudou, não com
+    o tamanho das tabelas.
     """
     data = request.get_json()
     
     with db_write_lock:
         try:
-            if 'users' in data:
-                User.query.delete()
-                for u_data in data.get('users', []):
-                    db.session.add(User(**u_data))
-
-            if 'itensEstoque' in data:
-                ItemEstoque.query.delete()
-                for i_data in data.get('itensEstoque', []):
-                    detalhes = {
-                        'capacidade': i_data.get('capacidade'),
-                        'minStock': i_data.get('minStock'),
-                        'status': i_data.get('status'),
-                        'reservadoPor': i_data.get('reservadoPor')
-                    }
-                    item = ItemEstoque(
-                        sku=i_data.get('sku'),
-                        quantidade=i_data.get('qtd', 0),
-                        prateleira=i_data.get('prateleira'),
-                        detalhes=detalhes
-                    )
-                    db.session.add(item)
-                    
-            if 'transacoesEstoque' in data:
-                TransacaoEstoque.query.delete()
-                for t_data in data.get('transacoesEstoque', []):
-                    transacao = TransacaoEstoque(
-                        data=t_data.get('timestamp'),
-                        usuario=t_data.get('usuario'),
-                        sku=t_data.get('sku'),
-                        tipo=t_data.get('tipo'),
-                        quantidade=t_data.get('quantidade'),
-                        prateleira=t_data.get('prateleira'),
-                        motivo=t_data.get('motivo')
-                    )
-                    db.session.add(transacao)    
-                    
-            if 'pedidos' in data:
-                Pedido.query.delete()
-                pedidos_agrupados = {}
-                for item_plano in data.get('pedidos', []):
-                    pedido_id = item_plano.pop('id', None)
-                    if not pedido_id: continue
-                    marketplace = item_plano.pop('marketplace', 'N/A')
-                    status = item_plano.pop('status', 'pendente')
-                    if pedido_id not in pedidos_agrupados:
-                        pedidos_agrupados[pedido_id] = {'pedido_id': pedido_id, 'marketplace': marketplace, 'status': status, 'itens': []}
-                    pedidos_agrupados[pedido_id]['itens'].append(item_plano)
-                for p_data in pedidos_agrupados.values():
-                    db.session.add(Pedido(**p_data))
-
-            # >>> ADICIONE ESTE NOVO BLOCO AQUI <<<
-            if 'pedidosComErro' in data:
-                # Primeiro, limpa a tabela de erros para sincronizar com o estado do frontend
-                PedidoComErro.query.delete()
-                # Depois, adiciona os novos erros
-                for erro_data in data.get('pedidosComErro', []):
-                    novo_erro = PedidoComErro(
-                        pedido_id=erro_data.get('id'), # Mapeia 'id' do frontend para 'pedido_id' no banco
-                        motivo=erro_data.get('motivo'),
-                        marketplace=erro_data.get('marketplace'),
-                        timestamp=erro_data.get('timestamp', datetime.datetime.now().isoformat())
-                    )
-                    db.session.add(novo_erro)
-
-            
-            if 'producao' in data:
-                Producao.query.delete()
-                for p_data in data.get('producao', []):
-                    item_id, impressora = p_data.get('op'), p_data.get('impressora')
-                    detalhes = {k: v for k, v in p_data.items() if k not in ['op', 'impressora']}
-                    if item_id: db.session.add(Producao(item_id=item_id, impressora=impressora, detalhes=detalhes))
-
-            if 'costura' in data:
-                Costura.query.delete()
-                for c_data in data.get('costura', []):
-                    item_id = c_data.get('lote')
-                    detalhes = {k: v for k, v in c_data.items() if k != 'lote'}
-                    if item_id: db.session.add(Costura(item_id=item_id, detalhes=detalhes))
-
-            if 'expedicao' in data:
-                Expedicao.query.delete()
-                for e_data in data.get('expedicao', []):
-                    pacote_id, itens, status = e_data.get('id'), e_data.get('itens', []), e_data.get('status', 'pendente')
-                    detalhes = {k: v for k, v in e_data.items() if k not in ['id', 'itens', 'status']}
-                    if pacote_id: db.session.add(Expedicao(pacote_id=pacote_id, itens=itens, status=status, detalhes=detalhes))
-
-            # ======================= INÍCIO DA ALTERAÇÃO =======================
-            # >>> ADICIONE ESTE NOVO BLOCO <<<
-            
-            if 'historicoExpedicao' in data:
-                # Limpa a tabela para sincronizar com o estado atual do frontend
-                HistoricoExpedicao.query.delete() 
-                
-                # Itera sobre cada pacote no histórico enviado pelo frontend
-                for h_data in data.get('historicoExpedicao', []):
-                    # Extrai os campos principais
-                    pedido_id = h_data.get('pedidoId')
-                    data_envio = h_data.get('dataEnvio')
-                    usuario_envio = h_data.get('usuarioEnvio')
-                    
-                    # O resto dos dados (como a lista de 'itens') vai para o campo 'detalhes'
-                    detalhes = {k: v for k, v in h_data.items() if k not in ['pedidoId', 'dataEnvio', 'usuarioEnvio']}
-                    
-                    # Cria o novo registro no banco de dados
-                    if pedido_id:
-                        novo_historico = HistoricoExpedicao(
-                            pedido_id=pedido_id,
-                            data_envio=data_envio,
-                            usuario_envio=usuario_envio,
-                            detalhes=detalhes
-                        )
-                        db.session.add(novo_historico)
-            
-            
-            if 'logs' in data:
-                Log.query.delete()
-                for l_data in data.get('logs', []):
-                    acao = l_data.get('acao')
-                    if isinstance(acao, dict):
-                        l_data['acao'] = json.dumps(acao, ensure_ascii=False)
-                    db.session.add(Log(**l_data))
+            inicio = time.time()
+            resumo = {}
+            for modulo in MODULOS_GRAVACAO:
+                if isinstance(data.get(modulo), list):
+                    resumo[modulo] = gravar_modulo(modulo, data[modulo])
             
             db.session.commit()
+            alterados = {modulo: r for modulo, r in resumo.items() if any(r.values())}
+            print(f"💾 /api/save aplicado em {time.time() - inicio:.2f}s: {alterados or 'nenhuma alteração'}")
             
             socketio.emit('dados_atualizados', 
                                  {'modulo': 'save_all', 'origem': request.remote_addr},
                                  namespace='/')
             
-            return jsonify({"status": "ok", "message": "Dados salvos com sucesso no banco de dados."}), 200
+            return jsonify({"status": "ok", "message": "Dados salvos com sucesso no banco de dados.", "alteracoes": alterados}), 200
 
         except Exception as e:
             db.session.rollback()
@@ -2643,193 +2696,100 @@ def update_stock_item(item_id):
 
 # --- FUNÇÕES DE LÓGICA DE IMAGEM ---
 def get_sku_base_for_cache(filename):
-    """Extrai o SKU base de um NOME DE ARQUIVO para usar como chave no cache."""
-    if not filename:
-        return None
-    # Lógica para extrair a base do SKU, ex: "PRDA115-F.jpg" -> "prda115"
-    base = filename.split(' ')[0].split('.')[0]
-    suffixes_to_strip = ['-999', '-VF', '-100', '-130', '-175', '-F', '-P', '-V', '-C']
-    base_upper = base.upper()
-    for suffix in suffixes_to_strip:
-        if base_upper.endswith(suffix):
-            base = base[:-len(suffix)]
-            break
-    return base.lower()
+    """Extrai o SKU base de um NOME DE ARQUIVO (ou de um SKU) para usar como chave no índice de imagens."""
+    # Mesma normalização usada pelo índice (image_index.normalizar_chave_imagem)
+    return normalizar_chave_imagem(filename)
 
-def build_image_cache_async():
-    """
-    Constrói o cache em segundo plano. Para cada SKU, armazena apenas a imagem de MENOR TAMANHO (KB).
-    """
-    global image_cache, is_cache_ready
-    
-    print("🚀 [THREAD DE CACHE] Iniciando a construção do cache de imagens em segundo plano...")
-    start_time = time.time()
-    
-    temp_cache = {}
-    valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-    
-    if not os.path.isdir(IMAGE_SEARCH_ROOT_PATH):
-        print(f"❌ [THREAD DE CACHE] ERRO CRÍTICO: Diretório '{IMAGE_SEARCH_ROOT_PATH}' não encontrado.")
-        with cache_lock:
-            is_cache_ready = True # Marca como "pronto" para não tentar de novo
+def notificar_geracao_image_cache(geracao, mudancas):
+    """Avisa os clientes conectados que o índice de imagens ganhou uma nova geração."""
+    if geracao is None:
         return
+    removidos = sum(1 for valor in mudancas.values() if valor is None)
+    socketio.emit('indice_imagens_atualizado', {
+        'geracao': geracao,
+        'alterados': len(mudancas) - removidos,
+        'removidos': removidos
+    })
 
-    # Percorre recursivamente todas as pastas e arquivos
-    for dirpath, _, filenames in os.walk(IMAGE_SEARCH_ROOT_PATH):
-        for filename in filenames:
-            if not filename.lower().endswith(valid_extensions):
-                continue
 
-            sku_key = get_sku_base_for_cache(filename)
-            if not sku_key:
-                continue
+def caminho_para_leitura(caminho):
+    """Caminho de onde ler um arquivo das raízes de imagem: a cópia do espelho local, quando existe, senão a rede."""
+    for espelho in espelhos_imagens.values():
+        if espelho.cobre(caminho):
+            return espelho.ler(caminho)
+    return caminho
 
-            full_path = os.path.join(dirpath, filename)
-            
+
+def caminho_e_stat_para_leitura(caminho):
+    """Como caminho_para_leitura, devolvendo também o os.stat do arquivo (None se não existir), com um único stat."""
+    for espelho in espelhos_imagens.values():
+        if espelho.cobre(caminho):
+            return espelho.ler_com_stat(caminho)
+    try:
+        return caminho, os.stat(caminho)
+    except OSError:
+        return caminho, None
+
+
+def reescanear_indice_imagens():
+    """
+    Executa um reescaneamento incremental das duas raízes de imagem. Cada índice
+    aplica as mudanças em todas as suas visões e grava só o que mudou no snapshot;
+    o espelho local (se houver) copia ou apaga só os arquivos do delta.
+    """
+    for indice in (indice_imagens_origem, indice_imagens_busca):
+        delta = indice.reescanear()
+        espelho = espelhos_imagens.get(indice)
+        if espelho is not None:
             try:
-                file_size = os.path.getsize(full_path)
-                
-                # Lógica que garante a escolha da menor imagem
-                if sku_key not in temp_cache or file_size < temp_cache[sku_key]['size']:
-                    temp_cache[sku_key] = {'path': full_path, 'size': file_size}
+                espelho.atualizar(delta, indice.scanner.iterar_arquivos)
+            except Exception as e:
+                logger.error(f"❌ [ESPELHO] Erro ao sincronizar o espelho de '{indice.raiz}': {e}")
 
-            except (OSError, FileNotFoundError):
-                continue
-    
-    # Ao final, o cache global recebe a lista final
-    with cache_lock:
-        image_cache = temp_cache
-        is_cache_ready = True
-
-    total_time = time.time() - start_time
-    print("-" * 60)
-    print(f"✅ [THREAD DE CACHE] Cache de imagens construído! Apenas a menor imagem de cada SKU foi mantida.")
-    print(f"   Tempo total: {total_time:.2f}s | SKUs únicos mapeados: {len(image_cache)}")
-    print("-" * 60)
-
-def find_image_realtime(sku):
-    """
-    Busca em tempo real (lento), usado APENAS como fallback enquanto o cache não está pronto.
-    """
-    search_key = get_sku_base_for_cache(sku)
-    valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-    best_match = None
-
-    for dirpath, _, filenames in os.walk(IMAGE_SEARCH_ROOT_PATH):
-        for filename in filenames:
-            if filename.lower().endswith(valid_extensions):
-                file_sku_key = get_sku_base_for_cache(filename)
-                if file_sku_key == search_key:
-                    full_path = os.path.join(dirpath, filename)
-                    try:
-                        file_size = os.path.getsize(full_path)
-                        if best_match is None or file_size < best_match['size']:
-                            best_match = {'path': full_path, 'size': file_size}
-                    except (OSError, FileNotFoundError):
-                        continue
-                        
-    return best_match['path'] if best_match else None
-
-
-def build_image_cache():
-    """
-    Varre o diretório de imagens UMA ÚNICA VEZ e constrói o cache.
-    VERSÃO OTIMIZADA com feedback de progresso.
-    """
-    global image_cache
-    print("⏳ Iniciando a construção do cache de imagens... (Isso pode levar alguns minutos na primeira vez)")
-    start_time = time.time()
-    
-    temp_cache = {}
-    valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-    
-    if not os.path.isdir(IMAGE_SEARCH_ROOT_PATH):
-        print(f"❌ ERRO CRÍTICO: O diretório de rede '{IMAGE_SEARCH_ROOT_PATH}' não foi encontrado ou está inacessível.")
-        print("   Verifique se o computador tem acesso à pasta e se o caminho está correto.")
-        # Se o caminho não existe, não há o que fazer. O cache ficará vazio.
-        image_cache = {}
-        return
 
-    # --- NOVO: Feedback de Progresso ---
-    processed_folders = 0
-    processed_files = 0
-    last_print_time = time.time()
+def loop_reescaneamento_imagens():
+    """Thread de fundo: mantém o índice de imagens atualizado a cada IMAGE_RESCAN_INTERVAL_SECONDS."""
+    logger.info(f"🔄 [INDICE IMAGENS] Reescaneamento incremental a cada {IMAGE_RESCAN_INTERVAL_SECONDS}s iniciado.")
 
-    print(f"   Analisando o diretório: {IMAGE_SEARCH_ROOT_PATH}")
+    # Os índices de coleta e de busca aproximada são montados primeiro a partir do snapshot, sem esperar a rede
+    for indice in (indice_imagens_origem, indice_imagens_busca):
+        try:
+            indice.montar_indices_do_snapshot()
+        except Exception as e:
+            logger.error(f"❌ [INDICE IMAGENS] Erro ao montar os índices de nomes de '{indice.raiz}': {e}")
+
+    while True:
+        try:
+            reescanear_indice_imagens()
+        except Exception as e:
+            logger.error(f"❌ [INDICE IMAGENS] Erro no reescaneamento: {e}")
+            traceback.print_exc()
+        time.sleep(IMAGE_RESCAN_INTERVAL_SECONDS)
 
-    for dirpath, _, filenames in os.walk(IMAGE_SEARCH_ROOT_PATH):
-        processed_folders += 1
-        
-        # Imprime o progresso a cada 100 pastas ou a cada 5 segundos
-        current_time = time.time()
-        if processed_folders % 100 == 0 or current_time - last_print_time > 5:
-            print(f"   ... Pastas analisadas: {processed_folders} | Arquivos encontrados: {processed_files} | Tempo: {current_time - start_time:.0f}s")
-            last_print_time = current_time
-
-        for filename in filenames:
-            if filename.lower().endswith(valid_extensions):
-                processed_files += 1
-                sku_key = get_sku_base_for_cache(filename)
-                if not sku_key:
-                    continue
-
-                full_path = os.path.join(dirpath, filename)
-                
-                try:
-                    # Otimização: os.path.getsize() é uma chamada de rede extra.
-                    # Vamos fazer isso apenas se necessário.
-                    if sku_key not in temp_cache:
-                        file_size = os.path.getsize(full_path)
-                        temp_cache[sku_key] = {'path': full_path, 'size': file_size}
-                    else:
-                        # Só verifica o tamanho se a chave já existe, para ver se o novo arquivo é menor.
-                        current_smallest_size = temp_cache[sku_key]['size']
-                        file_size = os.path.getsize(full_path)
-                        if file_size < current_smallest_size:
-                            temp_cache[sku_key] = {'path': full_path, 'size': file_size}
-                except (OSError, FileNotFoundError):
-                    continue
-
-    image_cache = temp_cache
-    end_time = time.time()
-    total_time = end_time - start_time
-    
-    print("-" * 50)
-    print(f"✅ Cache de imagens construído com sucesso!")
-    print(f"   Tempo total: {total_time:.2f} segundos")
-    print(f"   Pastas totais analisadas: {processed_folders}")
-    print(f"   SKUs únicos mapeados: {len(image_cache)}")
-    print("-" * 50)
-
-def get_sku_base_key(text):
-    """
-    Cria uma chave de SKU base a partir de um nome de arquivo ou SKU de pedido.
-    1. Pega a primeira parte antes de um espaço.
-    2. Remove sufixos comuns de variação (-F, -P, -100, etc.).
-    Ex: "PRRV078 - Arte.jpg" -> "prrv078"
-    Ex: "PVNV001-VF-P" -> "pvnv001"
-    """
-    if not text:
-        return None
-    base = text.split(' ')[0].lower()
-    # Remove agressivamente qualquer sufixo que comece com '-' no final da string.
-    base = re.sub(r'-[a-z0-9]+$', '', base, flags=re.IGNORECASE)
-    return base
+
+def iniciar_servicos_de_imagem():
+    """
+    Carrega o índice de imagens do snapshot local e dispara a atualização
+    em segundo plano a partir da rede. Chamado na inicialização do servidor.
+    """
+    for indice in (indice_imagens_origem, indice_imagens_busca):
+        try:
+            indice.carregar_snapshot()
+        except Exception as e:
+            logger.error(f"❌ Erro ao carregar snapshot de imagens de '{indice.raiz}': {e}")
+    logger.info(f"⚡️ Snapshot de imagens aplicado: {len(indice_imagens_origem.por_base)} SKUs base (origem) | "
+                f"{len(indice_imagens_busca.candidatos)} SKUs (busca)")
+
+    Thread(target=loop_reescaneamento_imagens, daemon=True).start()
+    Thread(target=armazem_staging_imagens.carregar, daemon=True).start()
+    limpeza_temporarios.iniciar()
+    for espelho in espelhos_imagens.values():
+        espelho.iniciar()
 
 def is_white_background(image_path, threshold=240, percentage=0.95):
-    # (Sua função original - sem alterações)
+    # Lê só as bordas com operações do Pillow; o resultado fica em cache por (caminho, mtime)
     try:
-        img = Image.open(image_path).convert('RGB')
-        width, height = img.size
-        border_pixels = []
-        for x in range(width):
-            border_pixels.append(img.getpixel((x, 0)))
-            border_pixels.append(img.getpixel((x, height - 1)))
-        for y in range(1, height - 1):
-            border_pixels.append(img.getpixel((0, y)))
-            border_pixels.append(img.getpixel((width - 1, y)))
-        white_pixels_count = sum(1 for r, g, b in border_pixels if r > threshold and g > threshold and b > threshold)
-        return (white_pixels_count / len(border_pixels)) >= percentage
+        return verificador_fundo_branco.verificar(image_path, threshold, percentage)
     except Exception as e:
         print(f"Erro ao processar imagem {image_path}: {e}")
         return False
@@ -2839,31 +2799,46 @@ def is_white_background(image_path, threshold=240, percentage=0.95):
 @app.route('/get_card_image/<sku>')
 def get_card_image(sku):
     """
-    VERSÃO OTIMIZADA: Busca a imagem de um SKU usando o cache em memória.
-    Se o cache não estiver pronto, faz uma busca em tempo real como fallback.
-    """
-    image_path = None
-    
-    with cache_lock:
-        cache_esta_pronto = is_cache_ready
+    VERSÃO OTIMIZADA: Busca a imagem de um SKU usando o índice em memória.
+    Enquanto o índice ainda está sendo montado, usa o índice parcial e uma
+    sondagem só nas pastas prováveis (uma por SKU, compartilhada entre requisições).
+    """
+    image_path = st = None
+
+    found_image = indice_imagens_busca.localizar(get_sku_base_for_cache(sku))
+    if not found_image:
+        # Arte salva com espaços ou outro separador no nome (ex: "PRDA 115.jpg"): só aceita a forma compacta idêntica
+        sugestoes = indice_imagens_busca.buscar_aproximado(sku, somente_exata=True)
+        if sugestoes:
+            found_image = sugestoes[0]
+    if found_image:
+        # Lê do espelho local quando ele tem a imagem; o mesmo stat serve para a miniatura e o envio
+        image_path, st = caminho_e_stat_para_leitura(found_image['path'])
+
+    if st is not None and stat.S_ISREG(st.st_mode):
+        # ?original=1 devolve o arquivo em tamanho real (ex: para abrir a arte em outra aba)
+        if request.args.get('original') != '1':
+            try:
+                formato = servico_miniaturas.formato_para(request.accept_mimetypes)
+                # A chave usa o caminho da rede: a miniatura (e o ETag) não muda quando a leitura passa para o espelho
+                chave = servico_miniaturas.chave(found_image['path'], formato, st=st)
 
-    if cache_esta_pronto:
-        # Se o cache está pronto, a busca é quase instantânea
-        search_key = get_sku_base_for_cache(sku)
-        found_image = image_cache.get(search_key)
-        if found_image:
-            image_path = found_image['path']
-    else:
-        # Fallback: se o cache ainda está sendo construído, faz a busca lenta
-        print(f"⚠️  Cache de imagens ainda não está pronto. Buscando SKU '{sku}' em tempo real (lento)...")
-        image_path = find_image_realtime(sku)
+                # O ETag muda sozinho quando a imagem na rede muda; se o navegador já tem esta versão, nada é enviado
+                if chave in request.if_none_match:
+                    response = make_response('', 304)
+                else:
+                    miniatura = servico_miniaturas.obter(image_path, formato, chave=chave)
+                    response = make_response(send_file(miniatura, mimetype=ServicoMiniaturas.MIMETYPES[formato]))
+                response.set_etag(chave)
+                response.headers['Cache-Control'] = 'public, max-age=86400' # Cache de 1 dia
+                response.headers['Vary'] = 'Accept'
+                return response
+            except Exception as e:
+                logger.warning(f"⚠️ Falha ao gerar miniatura de {image_path}: {e}. Enviando o original.")
 
-    if image_path and os.path.exists(image_path):
         try:
-            # Adiciona um cabeçalho de cache no navegador para não pedir a mesma imagem de novo
-            response = make_response(send_file(image_path))
-            response.headers['Cache-Control'] = 'public, max-age=86400' # Cache de 1 dia
-            return response
+            # Cache de 1 dia no navegador; depois disso, revalida com ETag/Last-Modified
+            return enviar_arquivo_condicional(image_path, max_age=86400, st=st)
         except Exception:
             pass # Se falhar, cai para a imagem padrão
 
@@ -2877,59 +2852,220 @@ def get_card_image(sku):
 def search_images():
     """
     Endpoint que busca a imagem de um SKU.
+    Usa a mesma chave (get_sku_base_for_cache) de get_card_image e /api/images/resolve.
     """
-    sku_to_search = request.args.get('sku', '').lower()
+    sku_to_search = request.args.get('sku', '').strip()
     if not sku_to_search:
         return jsonify({'error': 'SKU não fornecido'}), 400
 
-    # Constrói o cache na primeira requisição, se estiver vazio.
-    if not image_cache:
-        build_image_cache()
-        if not image_cache:
-            return jsonify({'error': 'Cache de imagens não pôde ser construído.'}), 500
-
-    base_sku = get_sku_base_key(sku_to_search)
-    if not base_sku:
+    search_key = get_sku_base_for_cache(sku_to_search)
+    if not search_key:
         return jsonify({'error': 'SKU base inválido.'}), 400
 
-    found_images = image_cache.get(base_sku, [])
-    if not found_images:
-        return jsonify({'message': f'Nenhuma imagem encontrada para o SKU: {sku_to_search}'}), 404
-
-    # Estratégia: Retorna a imagem de menor tamanho (mais rápida para carregar)
-    smallest_image = min(found_images, key=lambda img: img.get('size', float('inf')))
+    found_image = indice_imagens_busca.localizar(search_key)
+    if not found_image:
+        # Sugere as imagens de nome parecido (SKU digitado errado, arte com espaços ou sufixos no nome)
+        return jsonify({
+            'message': f'Nenhuma imagem encontrada para o SKU: {sku_to_search}',
+            'suggestions': [formatar_sugestao_imagem(s) for s in indice_imagens_busca.buscar_aproximado(sku_to_search, limite=5)]
+        }), 404
 
+    # Estratégia: o índice já guarda a imagem de menor tamanho (mais rápida para carregar)
     return jsonify({
         'sku': sku_to_search,
-        'image': smallest_image
+        'image': {'full_path': found_image['path'], 'size': found_image['size']}
     })
     
 
 
 
 
+def formatar_sugestao_imagem(sugestao):
+    """Resultado da busca aproximada no formato da API, com a URL do arquivo."""
+    caminho_url = quote(sugestao['path'].replace('\\', '/'), safe='')
+    return {
+        'key': sugestao['key'],
+        'name': sugestao['name'],
+        'full_path': sugestao['path'],
+        'size': sugestao['size'],
+        'score': sugestao['score'],
+        'exact': sugestao['exact'],
+        'url': f"/api/images/{caminho_url}"
+    }
+
+
+@app.route('/api/images/search/fuzzy', methods=['GET'])
+def search_images_fuzzy():
+    """
+    Busca aproximada de imagens: devolve as imagens cujo nome mais se parece com o texto
+    (?q=...&limit=10), da mais parecida para a menos. Tolera SKU digitado errado, espaços,
+    hífens e sufixos de variação; 'exact' indica nomes iguais ao texto depois de compactados.
+    """
+    texto = request.args.get('q', '').strip()
+    if not texto:
+        return jsonify({'error': 'Texto da busca não fornecido (parâmetro q).'}), 400
+    limite = min(max(request.args.get('limit', FUZZY_SEARCH_DEFAULT_LIMIT, type=int), 1), FUZZY_SEARCH_MAX_LIMIT)
+
+    start_time = time.time()
+    resultados = indice_imagens_busca.buscar_aproximado(texto, limite=limite)
+    return jsonify({
+        'query': texto,
+        'key': get_sku_base_for_cache(texto),
+        'results': [formatar_sugestao_imagem(s) for s in resultados],
+        # Enquanto a primeira varredura não termina a busca aproximada fica vazia
+        'cache_ready': indice_imagens_busca.aproximado is not None,
+        'elapsed_ms': round((time.time() - start_time) * 1000, 1)
+    }), 200
+
+
 @app.route('/api/images/get_all_cached')
 def get_all_cached_images():
     """
     Retorna um dicionário (mapa) de todos os SKUs e seus caminhos de imagem
     que estão atualmente no cache. O frontend usará isso para popular
     as imagens da tabela de estoque de forma eficiente.
-    """
-    with cache_lock:
-        # Garante que o cache esteja pronto antes de enviar
-        if not is_cache_ready:
-            # Se o cache não estiver pronto, podemos esperar um pouco ou retornar vazio.
-            # Retornar vazio é mais seguro para não travar a requisição.
-            return jsonify({}), 200 # Retorna um objeto vazio se o cache ainda está construindo
+    Com ?desde=<geração>, devolve apenas as mudanças desde aquela geração
+    (ou 304 se nada mudou); é o que o cache de resoluções do frontend usa a cada
+    evento 'indice_imagens_atualizado'. O ETag do mapa completo é a geração atual.
+    """
+    desde = request.args.get('desde', type=int)
+    indice = indice_imagens_busca
+
+    # Garante que o cache esteja pronto antes de enviar
+    if not indice.pronto:
+        # Se o cache não estiver pronto, podemos esperar um pouco ou retornar vazio.
+        # Retornar vazio é mais seguro para não travar a requisição.
+        if desde is not None:
+            # Quem pede delta recebe o mesmo envelope, sem mudanças, na geração atual
+            return jsonify({
+                'geracao': indice.historico.geracao_atual(),
+                'completo': False,
+                'alterados': {},
+                'removidos': []
+            })
+        return jsonify({}), 200 # Retorna um objeto vazio se o cache ainda está construindo
+
+    # Consulta incremental: ?desde=<geração> devolve só os SKUs alterados/removidos
+    if desde is not None:
+        geracao, mudancas = indice.historico.mudancas_desde(desde)
+        if mudancas is not None and not mudancas:
+            response = make_response('', 304)
+            response.headers['X-Image-Index-Generation'] = str(geracao)
+            return response
+        if mudancas is None:
+            # Geração muito antiga (ou de antes de um reinício): envia o índice completo
+            return jsonify({
+                'geracao': geracao,
+                'completo': True,
+                'alterados': indice.mapa_menores(),
+                'removidos': []
+            })
+        return jsonify({
+            'geracao': geracao,
+            'completo': False,
+            'alterados': {sku: caminho for sku, caminho in mudancas.items() if caminho is not None},
+            'removidos': [sku for sku, caminho in mudancas.items() if caminho is None]
+        })
 
-        # Cria um novo dicionário apenas com o SKU (chave) e o caminho do arquivo (valor)
-        # O frontend não precisa do tamanho do arquivo, apenas do caminho.
-        path_map = {sku: data['path'] for sku, data in image_cache.items()}
-        
-        return jsonify(path_map)
+    # Mapa apenas com o SKU (chave) e o caminho do arquivo (valor)
+    # O frontend não precisa do tamanho do arquivo, apenas do caminho.
+    geracao = indice.historico.geracao_atual()
+    etag = f"g{geracao}"
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(jsonify(indice.mapa_menores()))
+    response.set_etag(etag)
+    response.headers['X-Image-Index-Generation'] = str(geracao)
+    return response
     
 
 
+@app.route('/api/images/resolve', methods=['POST'])
+def resolve_images():
+    """
+    Resolve um lote de SKUs para as URLs das suas imagens em uma única requisição.
+    Recebe {"skus": [...]} e devolve, para cada SKU encontrado, a URL do arquivo
+    original e a da miniatura; os SKUs sem imagem vão em "missing". "geracao" é a
+    geração do índice usada, para o cache do frontend sincronizar via get_all_cached?desde=.
+    """
+    data = request.get_json(silent=True) or {}
+    skus = data.get('skus', [])
+    if not isinstance(skus, list):
+        return jsonify({'error': 'O campo "skus" deve ser uma lista.'}), 400
+    if len(skus) > MAX_SKUS_RESOLVE:
+        return jsonify({'error': f'Máximo de {MAX_SKUS_RESOLVE} SKUs por requisição.'}), 400
+
+    cache_esta_pronto = indice_imagens_busca.pronto
+    # Lida antes da resolução: o cliente guarda o resultado como sendo (no mínimo) desta geração
+    geracao = indice_imagens_busca.historico.geracao_atual()
+
+    resolved = {}
+    missing = []
+    for sku in dict.fromkeys(str(s).strip() for s in skus if s and str(s).strip()):
+        search_key = get_sku_base_for_cache(sku)
+        # Enquanto o índice é montado, responde com o que já foi listado (cache_ready indica se vale tentar de novo)
+        found_image = indice_imagens_busca.menor_imagem(search_key)
+        if not found_image:
+            missing.append(sku)
+            continue
+        caminho_url = quote(found_image['path'].replace('\\', '/'), safe='')
+        resolved[sku] = {
+            'key': search_key,
+            'url': f"/api/images/{caminho_url}",
+            'thumbnail_url': f"/get_card_image/{quote(sku, safe='')}"
+        }
+
+    return jsonify({'resolved': resolved, 'missing': missing, 'cache_ready': cache_esta_pronto, 'geracao': geracao}), 200
+
+
+@app.route('/api/images/white_background', methods=['POST'])
+def white_background_images():
+    """
+    Confere em lote se as fotos dos SKUs têm fundo branco (exigência dos marketplaces).
+    Recebe {"skus": [...], "threshold": 240, "percentage": 0.95} e devolve, para cada SKU
+    com imagem, {"path", "white_background"}; SKUs sem imagem vão em "missing" e
+    arquivos que não puderam ser lidos em "errors".
+    """
+    data = request.get_json(silent=True) or {}
+    skus = data.get('skus', [])
+    if not isinstance(skus, list):
+        return jsonify({'error': 'O campo "skus" deve ser uma lista.'}), 400
+    if len(skus) > MAX_SKUS_FUNDO_BRANCO:
+        return jsonify({'error': f'Máximo de {MAX_SKUS_FUNDO_BRANCO} SKUs por requisição.'}), 400
+    try:
+        threshold = int(data.get('threshold', 240))
+        percentage = float(data.get('percentage', 0.95))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Parâmetros "threshold" e "percentage" inválidos.'}), 400
+    if not (0 <= threshold <= 255) or not (0 < percentage <= 1):
+        return jsonify({'error': 'Use "threshold" entre 0 e 255 e "percentage" entre 0 e 1.'}), 400
+
+    caminhos = {}
+    missing = []
+    for sku in dict.fromkeys(str(s).strip() for s in skus if s and str(s).strip()):
+        found_image = indice_imagens_busca.menor_imagem(get_sku_base_for_cache(sku))
+        if found_image:
+            caminhos[sku] = found_image['path']
+        else:
+            missing.append(sku)
+
+    leituras = {caminho: caminho_para_leitura(caminho) for caminho in caminhos.values()}
+    verificados = verificador_fundo_branco.verificar_lote(leituras.values(), threshold, percentage)
+
+    results = {}
+    errors = {}
+    for sku, caminho in caminhos.items():
+        resultado = verificados[leituras[caminho]]
+        if isinstance(resultado, Exception):
+            errors[sku] = str(resultado)
+        else:
+            results[sku] = {'path': caminho, 'white_background': resultado}
+
+    return jsonify({'results': results, 'missing': missing, 'errors': errors,
+                    'cache_ready': indice_imagens_busca.pronto}), 200
+
+
 # =================================================================
 # LÓGICA DE IMAGEM
 # =================================================================
@@ -2950,7 +3086,12 @@ def serve_image(image_path):
         if not os.path.abspath(directory).startswith(os.path.abspath(IMAGE_SEARCH_ROOT_PATH)):
              return jsonify({'error': 'Acesso negado.'}), 403
 
-        return send_from_directory(directory, filename, as_attachment=False)
+        file_path = safe_join(directory, filename)
+        if file_path is None:
+            return jsonify({'error': 'Arquivo de imagem não encontrado no servidor.'}), 404
+        # A arte pode ser trocada na rede: o navegador sempre revalida (304 barato via ETag)
+        caminho_leitura, st = caminho_e_stat_para_leitura(file_path)
+        return enviar_arquivo_condicional(caminho_leitura, max_age=0, st=st)
     except FileNotFoundError:
         return jsonify({'error': 'Arquivo de imagem não encontrado no servidor.'}), 404
 
@@ -3263,8 +3404,12 @@ def serve_chat_file(subpath):
     directory = os.path.join(IMAGE_TEMP_DEST_PATH, 'chat_files', conversa_folder)
 
     try:
-        # send_from_directory faz checks e é mais seguro que send_file direto
-        return send_from_directory(directory, filename, as_attachment=False)
+        # safe_join faz os mesmos checks do send_from_directory
+        file_path = safe_join(directory, filename)
+        if file_path is None:
+            return "Arquivo não encontrado.", 404
+        # Arquivos do chat nunca são alterados depois de enviados
+        return enviar_arquivo_condicional(file_path, max_age=86400)
     except FileNotFoundError:
         return "Arquivo não encontrado.", 404
 
@@ -3333,13 +3478,8 @@ def handle_get_task_status(data):
 if __name__ == '__main__':
     logger.info("🚀 Iniciando sistema otimizado para múltiplas ações simultâneas...")
     
-    # Inicia cache em thread separada
-    cache_thread = Thread(target=build_image_path_cache_optimized, daemon=True)
-# cache_thread.start()
-# cleanup_thread.start()
-    
-    # Inicia limpeza otimizada
-    cleanup_thread = Thread(target=cleanup_temp_folders_optimized, daemon=True)
+    # Carrega o índice de imagens do snapshot e atualiza a partir da rede em segundo plano
+    iniciar_servicos_de_imagem()
     
     logger.info("✅ Sistema otimizado inicializado!")
     
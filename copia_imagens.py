@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Cópia de Imagens - Motor de cópia paralela para a coleta de imagens
+Copia os arquivos selecionados da rede para a pasta de sessão com vários workers,
+buffer grande, novas tentativas com espera crescente e um limite de bytes em trânsito,
+informando o progresso de cada arquivo a quem pediu a cópia. As artes já copiadas
+ficam em um armazém de staging e são reaproveitadas nas próximas coletas.
+"""
+import os
+import shutil
+import logging
+import time
+import hashlib
+from threading import Condition, Lock, Event
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from execucao_nativa import executar_bloqueante
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+
+class ArmazemStaging:
+    """
+    Armazém de staging endereçado pelo conteúdo das artes já copiadas.
+
+    Cada arquivo é guardado com o nome derivado de (caminho de origem, tamanho,
+    mtime), então uma arte alterada na rede gera uma entrada nova e a antiga
+    acaba descartada pelo LRU. As pastas de sessão recebem um hardlink para a
+    entrada (ou uma cópia local, quando o sistema de arquivos não permite link).
+    Como o hardlink compartilha o conteúdo, cada acerto confere tamanho e mtime
+    da entrada: um arquivo de sessão editado no lugar invalida a entrada.
+    """
+
+    # Diferença de mtime tolerada entre a entrada e a origem (arredondamento do float)
+    TOLERANCIA_MTIME = 0.01
+
+    def __init__(self, pasta, limite_bytes):
+        """
+        Inicializa o armazém
+
+        Args:
+            pasta: Pasta do armazém. Para usar hardlinks, precisa estar no mesmo
+                   volume das pastas de sessão
+            limite_bytes: Tamanho máximo do armazém; as entradas menos usadas são removidas
+        """
+        self.pasta = pasta
+        self.limite_bytes = limite_bytes
+        self.lock = Lock()
+        self.entradas = OrderedDict()  # caminho no armazém -> tamanho, da menos para a mais usada
+        self.total_bytes = 0
+        self.em_preenchimento = {}  # caminho no armazém -> Event, para não copiar a mesma arte duas vezes
+        self.acertos = 0
+        self.faltas = 0
+        self.invalidadas = 0
+
+    def carregar(self):
+        """Registra as entradas que já estão no disco (após um reinício), da menos para a mais usada."""
+        encontrados = []
+        try:
+            for subpasta in os.scandir(self.pasta):
+                if not subpasta.is_dir():
+                    continue
+                for entry in os.scandir(subpasta.path):
+                    if entry.name.endswith('.parcial'):
+                        continue
+                    st = entry.stat()
+                    encontrados.append((st.st_atime, entry.path, st.st_size))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"❌ Erro ao carregar o armazém de staging: {e}")
+            return
+
+        encontrados.sort()
+        with self.lock:
+            # Entradas criadas antes da carga são as mais recentes e continuam no fim da fila
+            recentes = list(self.entradas.items())
+            self.entradas.clear()
+            for _, caminho, tamanho in encontrados:
+                self.entradas[caminho] = tamanho
+            for caminho, tamanho in recentes:
+                self.entradas[caminho] = tamanho
+                self.entradas.move_to_end(caminho)
+            self.total_bytes = sum(self.entradas.values())
+            self._despejar()
+        logger.info(f"📦 Armazém de staging: {len(self.entradas)} artes, {self.total_bytes / (1024 * 1024):.1f} MB")
+
+    def _caminho_entrada(self, origem, st):
+        chave = hashlib.sha1(f"{os.path.normcase(origem)}|{st.st_size}|{st.st_mtime_ns}".encode('utf-8')).hexdigest()
+        extensao = os.path.splitext(origem)[1].lower()
+        return os.path.join(self.pasta, chave[:2], chave + extensao)
+
+    def _despejar(self):
+        """Remove as entradas menos usadas até caber no limite. Chamar com self.lock adquirido."""
+        while self.total_bytes > self.limite_bytes and len(self.entradas) > 1:
+            caminho, tamanho = self.entradas.popitem(last=False)
+            self.total_bytes -= tamanho
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+    def obter(self, origem, st, copiar):
+        """
+        Retorna o caminho da arte no armazém, copiando-a da origem se ainda não estiver lá.
+
+        Args:
+            origem: Caminho do arquivo na rede
+            st: Resultado de os.stat(origem)
+            copiar: Função copiar(origem, destino) usada quando a arte não está no armazém
+
+        Returns:
+            tuple: (caminho no armazém, True se já estava no armazém)
+        """
+        caminho = self._caminho_entrada(origem, st)
+        while True:
+            with self.lock:
+                if caminho in self.entradas:
+                    self.entradas.move_to_end(caminho)
+                    acerto = True
+                else:
+                    acerto = False
+                    aguardando = self.em_preenchimento.get(caminho)
+                    if aguardando is None:
+                        aguardando = self.em_preenchimento[caminho] = Event()
+                        break
+            if acerto:
+                if self._integra(caminho, st):
+                    with self.lock:
+                        self.acertos += 1
+                    self._marcar_uso(caminho, st)
+                    return caminho, True
+                # Editada ou apagada por fora (ex: pelo hardlink de uma sessão); copia de novo da rede
+                self._invalidar(caminho, st)
+                continue
+            # Outro worker está copiando a mesma arte; espera e tenta de novo
+            aguardando.wait()
+
+        try:
+            if self._integra(caminho, st):
+                copiada = False
+            else:
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                copiar(origem, caminho)
+                copiada = True
+            # O mtime da origem é gravado antes da entrada ficar visível para os outros workers
+            self._marcar_uso(caminho, st)
+            with self.lock:
+                self.entradas[caminho] = st.st_size
+                self.total_bytes += st.st_size
+                if copiada:
+                    self.faltas += 1
+                else:
+                    self.acertos += 1
+                self._despejar()
+            return caminho, not copiada
+        finally:
+            with self.lock:
+                self.em_preenchimento.pop(caminho, None)
+            aguardando.set()
+
+    def _integra(self, caminho, st):
+        """Indica se a entrada no disco ainda tem o tamanho e o mtime da arte de origem."""
+        try:
+            atual = os.stat(caminho)
+        except OSError:
+            return False
+        return atual.st_size == st.st_size and abs(atual.st_mtime - st.st_mtime) < self.TOLERANCIA_MTIME
+
+    def _invalidar(self, caminho, st):
+        """Remove do armazém (e do disco) uma entrada que não confere mais com a origem."""
+        with self.lock:
+            # Outro worker pode já ter invalidado e copiado de novo a mesma entrada
+            if caminho not in self.entradas or self._integra(caminho, st):
+                return
+            self.total_bytes -= self.entradas.pop(caminho)
+            self.invalidadas += 1
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        logger.warning(f"⚠️ Entrada do staging alterada por fora, copiando de novo: {caminho}")
+
+    def descartar(self, caminho):
+        """Esquece uma entrada que não pôde ser usada (ex: removida do disco por fora)."""
+        with self.lock:
+            tamanho = self.entradas.pop(caminho, None)
+            if tamanho is not None:
+                self.total_bytes -= tamanho
+
+    def _marcar_uso(self, caminho, st):
+        """Grava o último uso no atime (o mtime continua o da arte original), para o LRU sobreviver a reinícios."""
+        try:
+            os.utime(caminho, (time.time(), st.st_mtime))
+        except OSError:
+            pass
+
+    def materializar(self, caminho, destino, copiar):
+        """Coloca a arte do armazém na pasta de sessão: hardlink quando possível, senão cópia local."""
+        try:
+            os.remove(destino)
+        except OSError:
+            pass
+        try:
+            os.link(caminho, destino)
+        except OSError:
+            copiar(caminho, destino)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'entradas': len(self.entradas),
+                'bytes': self.total_bytes,
+                'limite_bytes': self.limite_bytes,
+                'acertos': self.acertos,
+                'faltas': self.faltas,
+                'invalidadas': self.invalidadas
+            }
+
+
+class MotorDeCopia:
+    """
+    Motor de cópia compartilhado por todas as coletas de imagens.
+
+    O pool de workers e o limite de bytes em trânsito valem para o servidor
+    inteiro, então duas coletas grandes ao mesmo tempo não saturam a rede.
+    """
+
+    def __init__(self, max_workers=8, tamanho_buffer=1024 * 1024,
+                 max_bytes_em_transito=256 * 1024 * 1024, tentativas=3, espera_inicial=0.5, armazem=None):
+        """
+        Inicializa o motor de cópia
+
+        Args:
+            max_workers: Número máximo de arquivos copiados ao mesmo tempo
+            tamanho_buffer: Tamanho do bloco de leitura/escrita (bytes)
+            max_bytes_em_transito: Soma máxima dos tamanhos dos arquivos sendo copiados
+            tentativas: Número de tentativas por arquivo antes de desistir
+            espera_inicial: Espera (segundos) antes da 2ª tentativa; dobra a cada nova falha
+            armazem: ArmazemStaging opcional; quando presente, as artes passam por ele
+        """
+        self.tamanho_buffer = tamanho_buffer
+        self.max_bytes_em_transito = max_bytes_em_transito
+        self.tentativas = max(1, tentativas)
+        self.espera_inicial = espera_inicial
+        self.armazem = armazem
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='copia_imagens')
+        self.condicao = Condition()
+        self.bytes_em_transito = 0
+
+    def _reservar_bytes(self, tamanho):
+        """Bloqueia até haver espaço no limite de bytes em trânsito. Retorna o valor reservado."""
+        # Um arquivo maior que o limite sozinho ainda pode passar quando não houver mais nada em trânsito
+        reserva = min(tamanho, self.max_bytes_em_transito)
+        with self.condicao:
+            while self.bytes_em_transito and self.bytes_em_transito + reserva > self.max_bytes_em_transito:
+                self.condicao.wait()
+            self.bytes_em_transito += reserva
+        return reserva
+
+    def _liberar_bytes(self, reserva):
+        with self.condicao:
+            self.bytes_em_transito -= reserva
+            self.condicao.notify_all()
+
+    def _copiar_arquivo(self, origem, destino):
+        """
+        Copia um arquivo com buffer grande, preservando metadados. Grava primeiro em
+        um arquivo temporário e só então o renomeia, para que uma falha no meio da
+        cópia não deixe uma imagem cortada na pasta de sessão.
+        """
+        temporario = destino + '.parcial'
+        with open(origem, 'rb') as fsrc, open(temporario, 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, self.tamanho_buffer)
+        shutil.copystat(origem, temporario)
+        os.replace(temporario, destino)
+
+    def _copiar_fora_do_hub(self, origem, destino):
+        """_copiar_arquivo em uma thread nativa, para a cópia não travar o hub do eventlet."""
+        executar_bloqueante(self._copiar_arquivo, origem, destino)
+
+    def _tarefa_copia(self, origem, destino, cancelado):
+        """Executa a cópia de um arquivo com novas tentativas. Roda dentro de um worker do pool."""
+        resultado = {
+            'filename': os.path.basename(destino),
+            'caminho_origem': origem,
+            'status': 'erro',
+            'bytes': 0,
+            'tentativas': 0,
+            'staging': False,
+            'erro': None
+        }
+        for tentativa in range(self.tentativas):
+            if cancelado is not None and cancelado.is_set():
+                resultado['status'] = 'cancelado'
+                return resultado
+
+            resultado['tentativas'] = tentativa + 1
+            reserva = 0
+            caminho_staging = None
+            try:
+                st = executar_bloqueante(os.stat, origem)
+                reserva = self._reservar_bytes(st.st_size)
+                if self.armazem is not None:
+                    caminho_staging, resultado['staging'] = self.armazem.obter(origem, st, self._copiar_fora_do_hub)
+                    self.armazem.materializar(caminho_staging, destino, self._copiar_fora_do_hub)
+                else:
+                    self._copiar_fora_do_hub(origem, destino)
+                resultado['status'] = 'ok'
+                resultado['bytes'] = st.st_size
+                resultado['erro'] = None
+                return resultado
+            except Exception as e:
+                resultado['erro'] = str(e)
+                if caminho_staging is not None:
+                    # A entrada do staging pode estar corrompida ou ter sumido; a próxima tentativa copia da rede
+                    self.armazem.descartar(caminho_staging)
+                logger.warning(f"⚠️ Falha ao copiar {origem} (tentativa {tentativa + 1}/{self.tentativas}): {e}")
+                try:
+                    os.remove(destino + '.parcial')
+                except OSError:
+                    pass
+            finally:
+                if reserva:
+                    self._liberar_bytes(reserva)
+
+            if tentativa + 1 < self.tentativas:
+                time.sleep(self.espera_inicial * (2 ** tentativa))
+
+        logger.error(f"❌ ERRO ao copiar o arquivo {origem}: {resultado['erro']}")
+        return resultado
+
+    @staticmethod
+    def _nomes_destino(arquivos):
+        """
+        Nome de destino de cada arquivo do lote. O primeiro de cada nome fica com ele;
+        os seguintes com o mesmo nome (vindos de outras pastas) ganham o nome da pasta
+        de origem como sufixo, para que duas cópias nunca gravem no mesmo destino.
+        """
+        destinos = {}
+        usados = set()
+        for origem in arquivos:
+            nome = os.path.basename(origem)
+            if os.path.normcase(nome) in usados:
+                raiz, extensao = os.path.splitext(nome)
+                pasta = os.path.basename(os.path.dirname(origem)) or 'origem'
+                nome = f"{raiz} ({pasta}){extensao}"
+                contador = 2
+                while os.path.normcase(nome) in usados:
+                    nome = f"{raiz} ({pasta} {contador}){extensao}"
+                    contador += 1
+                logger.warning(f"⚠️ Nome repetido no lote: {origem} será copiado como {nome}")
+            usados.add(os.path.normcase(nome))
+            destinos[origem] = nome
+        return destinos
+
+    def copiar_lote(self, arquivos, pasta_destino, ao_progredir=None, cancelado=None):
+        """
+        Copia um lote de arquivos para uma pasta e espera todos terminarem.
+
+        Args:
+            arquivos: Caminhos de origem a copiar
+            pasta_destino: Pasta onde os arquivos serão gravados (com o mesmo nome)
+            ao_progredir: Função chamada a cada arquivo concluído com
+                          (resultado, concluidos, total, bytes_copiados)
+            cancelado: threading.Event opcional; quando marcado, os arquivos que
+                       ainda não começaram são pulados
+
+        Returns:
+            list: Um dicionário de resultado por arquivo, na ordem de conclusão. Arquivos
+                  de pastas diferentes com o mesmo nome recebem o nome da pasta de origem
+                  como sufixo; 'colisao' traz o nome original nesses casos (senão None)
+        """
+        arquivos = sorted(set(arquivos))
+        total = len(arquivos)
+        inicio = time.time()
+        destinos = self._nomes_destino(arquivos)
+        futuros = {
+            self.executor.submit(self._tarefa_copia, origem, os.path.join(pasta_destino, destinos[origem]), cancelado): origem
+            for origem in arquivos
+        }
+
+        resultados = []
+        bytes_copiados = 0
+        for futuro in as_completed(futuros):
+            resultado = futuro.result()
+            nome_original = os.path.basename(futuros[futuro])
+            resultado['colisao'] = nome_original if destinos[futuros[futuro]] != nome_original else None
+            resultados.append(resultado)
+            bytes_copiados += resultado['bytes']
+            if ao_progredir is not None:
+                try:
+                    ao_progredir(resultado, len(resultados), total, bytes_copiados)
+                except Exception as e:
+                    logger.error(f"❌ Erro ao informar progresso da cópia: {e}")
+
+        duracao = time.time() - inicio
+        copiados = sum(1 for r in resultados if r['status'] == 'ok')
+        do_staging = sum(1 for r in resultados if r['staging'])
+        logger.info(f"📦 Cópia concluída: {copiados}/{total} arquivos ({do_staging} do staging), "
+                    f"{bytes_copiados / (1024 * 1024):.1f} MB em {duracao:.2f}s")
+        return resultados
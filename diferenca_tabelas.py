@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Diferença de Tabelas - Compara o estado enviado pelo frontend com o banco
+Em vez de apagar e reinserir uma tabela inteira a cada /api/save, pareia os registros
+enviados com os existentes por uma chave e devolve só o que precisa ser inserido,
+atualizado ou removido, para ser aplicado em lote.
+"""
+import json
+import logging
+from collections import defaultdict, deque
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def congelar(valor):
+    """Versão comparável e "hashable" de um valor de coluna (colunas JSON viram texto canônico)."""
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, sort_keys=True, ensure_ascii=False, default=str)
+    return valor
+
+
+def calcular_diferenca(existentes, novos, colunas, campos_chave=None, somente_janela=False):
+    """
+    Pareia os registros novos com os existentes e calcula as operações necessárias.
+
+    Registros com a mesma chave são pareados na ordem (existentes por id, novos na ordem
+    recebida); um par com alguma coluna diferente vira atualização, novos sem par viram
+    inserção e existentes sem par viram remoção.
+
+    Args:
+        existentes: Lista de dicts do banco, com 'id' e as colunas
+        novos: Lista de dicts com as colunas desejadas (sem 'id'); colunas ausentes não são comparadas
+        colunas: Colunas consideradas na comparação
+        campos_chave: Colunas que identificam o registro (None = todas as colunas, só há inserções e remoções)
+        somente_janela: Só remove existentes sem par que estejam dentro da janela que o frontend
+                        conhece (id entre o menor e o maior pareado). Para tabelas das quais o
+                        frontend só tem os registros mais recentes: os mais antigos que a janela e
+                        os criados depois dela por outros usuários nunca são removidos.
+
+    Returns:
+        tuple: (inserir, atualizar, remover) - dicts a inserir, dicts com 'id' e só as colunas
+               alteradas, e os registros existentes a remover
+    """
+    campos_chave = tuple(campos_chave or colunas)
+    if len(campos_chave) == 1:
+        campo_chave = campos_chave[0]
+
+        def chave(registro):
+            return congelar(registro.get(campo_chave))
+    else:
+        def chave(registro):
+            return tuple(congelar(registro.get(campo)) for campo in campos_chave)
+
+    disponiveis = defaultdict(deque)
+    for existente in sorted(existentes, key=lambda registro: registro['id']):
+        disponiveis[chave(existente)].append(existente)
+
+    inserir = []
+    atualizar = []
+    menor_id_pareado = maior_id_pareado = None
+    for novo in novos:
+        candidatos = disponiveis.get(chave(novo))
+        if not candidatos:
+            inserir.append(novo)
+            continue
+        existente = candidatos.popleft()
+        if maior_id_pareado is None or existente['id'] > maior_id_pareado:
+            maior_id_pareado = existente['id']
+        if menor_id_pareado is None or existente['id'] < menor_id_pareado:
+            menor_id_pareado = existente['id']
+        alteradas = {coluna: novo[coluna] for coluna in colunas
+                     if coluna in novo and novo[coluna] != existente.get(coluna)}
+        if alteradas:
+            alteradas['id'] = existente['id']
+            atualizar.append(alteradas)
+
+    remover = []
+    for candidatos in disponiveis.values():
+        for existente in candidatos:
+            if somente_janela and (menor_id_pareado is None
+                                   or not menor_id_pareado <= existente['id'] <= maior_id_pareado):
+                continue
+            remover.append(existente)
+
+    return inserir, atualizar, remover
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Espelho de Imagens - Cópia local das pastas de imagem da rede
+Mantém em disco local uma cópia de uma raiz de rede, sincronizada pelas mudanças
+que o scanner do índice de imagens já detecta (só os arquivos novos, alterados ou
+removidos são copiados ou apagados). As rotas de imagem leem do espelho quando a
+cópia local está em dia, e o tempo de resposta deixa de depender do servidor de arquivos.
+"""
+import os
+import stat
+import shutil
+import logging
+import time
+from queue import Queue
+from threading import Lock, Thread, get_ident
+from execucao_nativa import executar_bloqueante
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class EspelhoImagens:
+    """
+    Espelho local de uma raiz de imagens da rede.
+
+    O caminho local de cada arquivo é o caminho relativo à raiz dentro da pasta do
+    espelho. Um arquivo alterado ou removido na rede é apagado do espelho assim
+    que a varredura percebe a mudança (a leitura volta para a rede) e a nova
+    versão é copiada em segundo plano, gravada em um temporário e trocada de uma vez.
+    Antes da troca o arquivo da rede é conferido de novo, então uma cópia que
+    terminou depois de uma nova alteração é descartada em vez de ficar no espelho.
+    As leituras nunca esperam pela rede; cada cópia servida é reconferida com a
+    rede em segundo plano, no máximo uma vez por intervalo_revalidacao.
+    """
+
+    # Cópias lembradas como revalidadas há pouco (acima disso a lista recomeça)
+    MAX_REVALIDADOS = 200000
+
+    def __init__(self, raiz, pasta, extensoes=None, max_workers=4, intervalo_revalidacao=300):
+        """
+        Inicializa o espelho
+
+        Args:
+            raiz: Pasta raiz na rede
+            pasta: Pasta local do espelho
+            extensoes: Extensões espelhadas (None = todos os arquivos)
+            max_workers: Cópias simultâneas a partir da rede
+            intervalo_revalidacao: Segundos entre duas conferências da mesma cópia com a rede
+        """
+        self.raiz = raiz
+        self.pasta = pasta
+        self.extensoes = tuple(extensoes) if extensoes else None
+        self.max_workers = max_workers
+        self.intervalo_revalidacao = intervalo_revalidacao
+        self._prefixo = os.path.join(os.path.normcase(raiz.rstrip('\\/')), '')
+
+        self.lock = Lock()
+        self.fila = Queue()  # (origem, local, tamanho, mtime) vistos na varredura
+        self.fila_revalidacao = Queue()  # (origem, local) de cópias servidas
+        self.revalidados = {}  # local -> quando foi agendada a última revalidação
+        self.workers = []
+        self.sincronizado = False
+
+        self.copiados = 0
+        self.bytes_copiados = 0
+        self.removidos = 0
+        self.falhas = 0
+        self.leituras_locais = 0
+        self.leituras_rede = 0
+        self.desatualizados = 0
+        self.ultima_sincronizacao = None
+
+    def iniciar(self):
+        """Inicia os workers de cópia."""
+        if self.workers:
+            return
+        os.makedirs(self.pasta, exist_ok=True)
+        for i in range(self.max_workers):
+            worker = Thread(target=self._worker, daemon=True, name=f'espelho_{i}')
+            worker.start()
+            self.workers.append(worker)
+        Thread(target=self._worker_revalidacao, daemon=True, name='espelho_revalidacao').start()
+        logger.info(f"🪞 Espelho local de '{self.raiz}' em '{self.pasta}' ({self.max_workers} workers)")
+
+    # ------------------------------------------------------------------
+    # Caminhos
+    # ------------------------------------------------------------------
+
+    def cobre(self, origem):
+        """Indica se o arquivo da rede pertence à raiz deste espelho."""
+        return os.path.normcase(origem).startswith(self._prefixo)
+
+    def local_de(self, origem):
+        """Caminho no espelho de um arquivo da rede, ou None se ele não for da raiz."""
+        if not self.cobre(origem):
+            return None
+        return os.path.join(self.pasta, origem[len(self._prefixo):])
+
+    def _espelhavel(self, nome):
+        return self.extensoes is None or nome.lower().endswith(self.extensoes)
+
+    def ler(self, origem):
+        """
+        Caminho de onde ler um arquivo da rede: a cópia local quando ela existe,
+        senão o próprio caminho da rede. Só consulta o disco local.
+        """
+        return self.ler_com_stat(origem, stat_rede=False)[0]
+
+    def ler_com_stat(self, origem, stat_rede=True):
+        """
+        Caminho de onde ler um arquivo da rede e o os.stat dele, com um único stat:
+        o da cópia local quando ela existe, senão o da rede.
+
+        A cópia local é servida sem ir à rede: os deltas da varredura a mantêm em dia
+        (arquivos alterados ou removidos saem do espelho assim que a varredura os vê).
+        Uma sobrescrita no lugar, que não muda o mtime da pasta, é conferida depois,
+        fora da requisição, pela fila de revalidação.
+
+        Args:
+            origem: Caminho do arquivo na rede
+            stat_rede: Se False, não faz o stat quando a leitura cai na rede (devolve None)
+
+        Returns:
+            tuple: (caminho, os.stat_result ou None se o arquivo não existe)
+        """
+        local = self.local_de(origem)
+        if local is not None:
+            try:
+                st = os.stat(local)
+            except OSError:
+                st = None
+            if st is not None and stat.S_ISREG(st.st_mode):
+                self._revalidar_depois(origem, local)
+                with self.lock:
+                    self.leituras_locais += 1
+                return local, st
+        with self.lock:
+            self.leituras_rede += 1
+        if not stat_rede:
+            return origem, None
+        try:
+            return origem, os.stat(origem)
+        except OSError:
+            return origem, None
+
+    def _revalidar_depois(self, origem, local):
+        """Agenda a conferência da cópia local com a rede, no máximo uma vez por intervalo_revalidacao."""
+        agora = time.time()
+        with self.lock:
+            ultima = self.revalidados.get(local)
+            if ultima is not None and agora - ultima < self.intervalo_revalidacao:
+                return
+            if len(self.revalidados) >= self.MAX_REVALIDADOS:
+                self.revalidados.clear()
+            self.revalidados[local] = agora
+        self.fila_revalidacao.put((origem, local))
+
+    def _worker_revalidacao(self):
+        while True:
+            origem, local = self.fila_revalidacao.get()
+            try:
+                try:
+                    st = executar_bloqueante(os.stat, origem)
+                except FileNotFoundError:
+                    self._apagar(local)
+                    continue
+                except OSError:
+                    continue  # Rede inacessível: a cópia local continua valendo
+                if not self._em_dia(local, st.st_size, st.st_mtime):
+                    # Sobrescrita no lugar: sai do espelho (as leituras voltam para a rede) e a versão nova é copiada
+                    self._apagar(local)
+                    self._agendar(origem, local, st.st_size, st.st_mtime)
+                    with self.lock:
+                        self.desatualizados += 1
+            except Exception as e:
+                logger.warning(f"⚠️ [ESPELHO] Falha ao revalidar {local}: {e}")
+            finally:
+                self.fila_revalidacao.task_done()
+
+    # ------------------------------------------------------------------
+    # Sincronização
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _em_dia(local, tamanho, mtime):
+        """Compara a cópia local com o tamanho e mtime vistos na rede (o mtime tem precisão diferente entre sistemas)."""
+        try:
+            st = os.stat(local)
+        except OSError:
+            return False
+        return st.st_size == tamanho and (mtime is None or abs(st.st_mtime - mtime) < 1)
+
+    def _agendar(self, origem, local, tamanho, mtime):
+        self.fila.put((origem, local, tamanho, mtime))
+
+    def _apagar(self, local):
+        try:
+            os.remove(local)
+            with self.lock:
+                self.removidos += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"⚠️ [ESPELHO] Não foi possível apagar {local}: {e}")
+
+    def atualizar(self, delta, arquivos):
+        """
+        Leva ao espelho o resultado de uma varredura. Na primeira chamada compara o espelho
+        inteiro com a lista de arquivos; depois, aplica só o delta.
+
+        Args:
+            delta: DeltaVarredura da varredura (ou None se a raiz estava inacessível)
+            arquivos: Função que gera (diretorio, nome, tamanho, mtime) de todos os arquivos conhecidos
+        """
+        if not self.sincronizado:
+            if delta is None:
+                return
+            self.sincronizar(arquivos())
+            self.sincronizado = True
+        elif delta is not None and not delta.vazio():
+            self.aplicar_delta(delta)
+
+    def sincronizar(self, arquivos):
+        """Compara o espelho inteiro com a lista da rede: copia o que falta ou mudou e apaga o que sobrou."""
+        inicio = time.time()
+        esperados = set()
+        agendados = 0
+        for diretorio, nome, tamanho, mtime in arquivos:
+            if not self._espelhavel(nome):
+                continue
+            origem = os.path.join(diretorio, nome)
+            local = self.local_de(origem)
+            if local is None:
+                continue
+            esperados.add(os.path.normcase(local))
+            if not self._em_dia(local, tamanho, mtime):
+                self._agendar(origem, local, tamanho, mtime)
+                agendados += 1
+
+        sobras = 0
+        # Temporários dos workers atuais são cópias em andamento; os de execuções anteriores são sobras
+        em_copia = tuple(f".{worker.ident}.parcial" for worker in self.workers)
+        for pasta_atual, _, nomes in os.walk(self.pasta):
+            for nome in nomes:
+                local = os.path.join(pasta_atual, nome)
+                if os.path.normcase(local) in esperados or (em_copia and nome.endswith(em_copia)):
+                    continue
+                self._apagar(local)
+                sobras += 1
+
+        self.ultima_sincronizacao = time.time()
+        logger.info(f"🪞 [ESPELHO] '{self.raiz}': {len(esperados)} arquivos conferidos, {agendados} a copiar, "
+                    f"{sobras} sobras apagadas em {time.time() - inicio:.1f}s")
+
+    def aplicar_delta(self, delta):
+        """Apaga do espelho o que mudou ou sumiu na rede e agenda a cópia do que é novo ou foi alterado."""
+        for diretorio, nome in delta.removidos:
+            local = self.local_de(os.path.join(diretorio, nome))
+            if local is not None:
+                self._apagar(local)
+        for diretorio in delta.diretorios_removidos:
+            local = self.local_de(os.path.join(diretorio, ''))
+            if local and local.rstrip('\\/') != self.pasta.rstrip('\\/'):
+                shutil.rmtree(local, ignore_errors=True)
+        for diretorio, nome, tamanho, mtime in delta.adicionados:
+            if not self._espelhavel(nome):
+                continue
+            origem = os.path.join(diretorio, nome)
+            local = self.local_de(origem)
+            if local is not None and not self._em_dia(local, tamanho, mtime):
+                self._agendar(origem, local, tamanho, mtime)
+        self.ultima_sincronizacao = time.time()
+
+    def _copiar(self, origem, local, id_worker):
+        """
+        Copia um arquivo da rede para o espelho de forma atômica. O temporário leva o
+        ident do worker (e não o da thread nativa onde a cópia roda), que é o que a
+        sincronização reconhece como cópia em andamento.
+
+        Returns:
+            int: Bytes copiados, ou None se o arquivo mudou na rede durante a cópia
+        """
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        temporario = f"{local}.{id_worker}.parcial"
+        try:
+            shutil.copy2(origem, temporario)
+            copiado = os.stat(temporario)
+            # Mudou (ou sumiu) durante a cópia: a varredura que perceber a mudança agenda a versão nova
+            if not self._em_dia(origem, copiado.st_size, copiado.st_mtime):
+                os.remove(temporario)
+                return None
+            os.replace(temporario, local)
+            return copiado.st_size
+        except Exception:
+            try:
+                os.remove(temporario)
+            except OSError:
+                pass
+            raise
+
+    def _worker(self):
+        while True:
+            origem, local, tamanho, mtime = self.fila.get()
+            try:
+                # A mesma versão pode ter sido agendada duas vezes (sincronização inicial + delta)
+                if self._em_dia(local, tamanho, mtime):
+                    continue
+                # Cópia da rede fora do hub do eventlet (_copiar só faz I/O)
+                copiado = executar_bloqueante(self._copiar, origem, local, get_ident())
+                if copiado is not None:
+                    with self.lock:
+                        self.copiados += 1
+                        self.bytes_copiados += copiado
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"⚠️ [ESPELHO] Falha ao copiar {origem}: {e}")
+                with self.lock:
+                    self.falhas += 1
+            finally:
+                self.fila.task_done()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'raiz': self.raiz,
+                'pasta': self.pasta,
+                'sincronizado': self.sincronizado,
+                'pendentes': self.fila.qsize(),
+                'revalidacoes_pendentes': self.fila_revalidacao.qsize(),
+                'copiados': self.copiados,
+                'bytes_copiados': self.bytes_copiados,
+                'removidos': self.removidos,
+                'falhas': self.falhas,
+                'leituras_locais': self.leituras_locais,
+                'leituras_rede': self.leituras_rede,
+                'desatualizados': self.desatualizados,
+                'ultima_sincronizacao': self.ultima_sincronizacao
+            }
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Execução Nativa - I/O bloqueante fora do hub do eventlet
+O run.py aplica o eventlet.monkey_patch(): as threads dos pools viram green threads,
+que se revezam em uma única thread do sistema. Um os.scandir, os.stat ou cópia de
+arquivo na rede não cede a vez e trava todas as requisições HTTP e do socket até
+terminar. executar_bloqueante() leva a chamada para o pool de threads do sistema do
+eventlet (tpool) quando o monkey patch está ativo, e a executa direto quando não está.
+"""
+import sys
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def eventlet_ativo():
+    """Indica se as threads foram trocadas por green threads do eventlet (sem importar o eventlet à toa)."""
+    if 'eventlet' not in sys.modules:
+        return False
+    from eventlet import patcher
+    return patcher.is_monkey_patched('thread')
+
+
+def executar_bloqueante(funcao, *args, **kwargs):
+    """
+    Executa uma função que bloqueia em I/O (ou em código C que não cede a vez).
+
+    A função roda em uma thread do sistema e não deve usar locks, filas nem logging:
+    com o monkey patch, esses objetos são do eventlet e só funcionam nas green threads.
+    Exceções da função são repassadas a quem chamou.
+    """
+    if eventlet_ativo():
+        from eventlet import tpool
+        return tpool.execute(funcao, *args, **kwargs)
+    return funcao(*args, **kwargs)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Fundo Branco - Verifica se as fotos de produto têm fundo branco
+Lê apenas as bordas de cada imagem com operações do próprio Pillow (em C, sem
+laço por pixel em Python), guarda o resultado por (caminho, mtime) e classifica
+lotes de imagens em paralelo para a conferência das fotos dos marketplaces.
+"""
+import os
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from PIL import Image, ImageChops
+from execucao_nativa import executar_bloqueante
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class VerificadorFundoBranco:
+    """
+    Classifica imagens como "fundo branco" a partir dos pixels da borda.
+
+    Um pixel é branco quando os três canais passam do limite; a imagem tem fundo
+    branco quando a fração de pixels brancos na borda (primeira e última linha,
+    primeira e última coluna) atinge o percentual pedido.
+    """
+
+    def __init__(self, max_itens_cache=50000, max_workers=8, lado_minimo_draft=1024):
+        """
+        Inicializa o verificador
+
+        Args:
+            max_itens_cache: Quantos resultados manter no cache (LRU)
+            max_workers: Imagens verificadas ao mesmo tempo em um lote
+            lado_minimo_draft: JPEGs são decodificados em escala reduzida, mas nunca abaixo deste lado
+        """
+        self.max_itens_cache = max_itens_cache
+        self.lado_minimo_draft = lado_minimo_draft
+        self.cache = OrderedDict()  # (caminho, mtime_ns, tamanho, threshold, percentage) -> bool
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fundo_branco')
+        self.verificadas = 0
+        self.reaproveitadas = 0
+
+    @staticmethod
+    def _faixas_da_borda(img):
+        """Recortes de 1 pixel com as bordas, cobrindo cada pixel da borda uma vez (como a versão original)."""
+        largura, altura = img.size
+        faixas = [img.crop((0, 0, largura, 1)), img.crop((0, altura - 1, largura, altura))]
+        if altura > 2:
+            faixas.append(img.crop((0, 1, 1, altura - 1)))
+            faixas.append(img.crop((largura - 1, 1, largura, altura - 1)))
+        return faixas
+
+    def _classificar(self, caminho, threshold, percentage):
+        tabela_limite = [0] * (threshold + 1) + [255] * (255 - threshold)
+        with Image.open(caminho) as img:
+            largura, altura = img.size
+            # Para JPEG, decodifica já reduzido: as bordas continuam representativas
+            img.draft('RGB', (min(largura, self.lado_minimo_draft), min(altura, self.lado_minimo_draft)))
+
+            brancos = 0
+            total = 0
+            for faixa in self._faixas_da_borda(img):
+                r, g, b = faixa.convert('RGB').split()
+                # Cada canal vira 255 (acima do limite) ou 0; o mais escuro dos três só é 255 se os três forem
+                mascara = ImageChops.darker(ImageChops.darker(r.point(tabela_limite), g.point(tabela_limite)),
+                                            b.point(tabela_limite))
+                brancos += mascara.histogram()[255]
+                total += mascara.size[0] * mascara.size[1]
+
+        return total > 0 and (brancos / total) >= percentage
+
+    def verificar(self, caminho, threshold=240, percentage=0.95):
+        """
+        Indica se a imagem tem fundo branco. Levanta exceção se o arquivo não puder ser lido.
+
+        Returns:
+            bool: True se a borda for (quase) toda branca
+        """
+        st = executar_bloqueante(os.stat, caminho)
+        chave = (os.path.normcase(caminho), st.st_mtime_ns, st.st_size, threshold, percentage)
+        with self.lock:
+            resultado = self.cache.get(chave)
+            if resultado is not None:
+                self.cache.move_to_end(chave)
+                self.reaproveitadas += 1
+                return resultado
+
+        # Leitura na rede e decodificação (Pillow) fora do hub do eventlet
+        resultado = executar_bloqueante(self._classificar, caminho, threshold, percentage)
+        with self.lock:
+            self.cache[chave] = resultado
+            while len(self.cache) > self.max_itens_cache:
+                self.cache.popitem(last=False)
+            self.verificadas += 1
+        return resultado
+
+    def verificar_lote(self, caminhos, threshold=240, percentage=0.95):
+        """
+        Verifica vários arquivos em paralelo
+
+        Args:
+            caminhos: Lista de caminhos de imagem
+
+        Returns:
+            dict: {caminho: True/False} e, para os que falharam, {caminho: Exception}
+        """
+        caminhos = list(dict.fromkeys(caminhos))
+        futuros = [self.executor.submit(self.verificar, caminho, threshold, percentage) for caminho in caminhos]
+        resultados = {}
+        for caminho, futuro in zip(caminhos, futuros):
+            try:
+                resultados[caminho] = futuro.result()
+            except Exception as e:
+                resultados[caminho] = e
+        return resultados
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'em_cache': len(self.cache),
+                'verificadas': self.verificadas,
+                'reaproveitadas': self.reaproveitadas
+            }
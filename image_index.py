@@ -0,0 +1,1610 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Índice de Imagens - Mapeamento único das imagens das pastas de rede
+Cada raiz de rede tem um ImageIndex: uma varredura incremental alimenta todas as
+consultas (menor imagem por SKU, arquivos por SKU base, regras da coleta), e a lista
+de arquivos fica guardada em SQLite para reabrir o índice em menos de um segundo.
+"""
+import os
+import re
+import sqlite3
+import logging
+import time
+import heapq
+from array import array
+from threading import Lock, Event
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import defaultdict, deque, Counter
+from difflib import SequenceMatcher
+from execucao_nativa import executar_bloqueante
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Extensões consideradas imagem (cards, miniaturas) e arte (imagens + arquivos de impressão)
+EXTENSOES_IMAGEM = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+EXTENSOES_ARTE = EXTENSOES_IMAGEM + ('.pdf', '.cdr')
+
+# Sufixos de variação removidos para chegar à chave da imagem de um SKU
+SUFIXOS_CHAVE_IMAGEM = ['-999', '-VF', '-100', '-130', '-175', '-F', '-P', '-V', '-C']
+
+# Tudo que não é letra ou dígito some da chave compacta (espaços, hífens, sublinhados...)
+_NAO_ALFANUMERICO = re.compile(r'[\W_]+')
+_SUFIXO_VARIACAO = re.compile('(?:' + '|'.join(map(re.escape, SUFIXOS_CHAVE_IMAGEM)) + r')\Z')
+
+
+def normalizar_chave_imagem(texto):
+    """
+    Chave da imagem de um SKU ou nome de arquivo, usada em todas as buscas por imagem.
+    Ex: "PRDA115-F.jpg" -> "prda115", "PRDA115-F" -> "prda115"
+    """
+    if not texto:
+        return None
+    base = texto.split(' ')[0].split('.')[0]
+    base_upper = base.upper()
+    for sufixo in SUFIXOS_CHAVE_IMAGEM:
+        if base_upper.endswith(sufixo):
+            base = base[:-len(sufixo)]
+            break
+    return base.lower()
+
+
+def familia_da_chave(chave):
+    """
+    Prefixo alfabético de uma chave de imagem, antes do primeiro dígito.
+    Ex: "prda115" -> "prda"
+    """
+    for i, caractere in enumerate(chave):
+        if caractere.isdigit():
+            return chave[:i]
+    return chave
+
+
+def normalizar_sku_base(texto):
+    """
+    SKU base (sem nenhuma variação) de um SKU ou nome de arquivo, em maiúsculas.
+    Ex: "PCRV029-150 - PAINEL.pdf" -> "PCRV029", "PCRV029.pdf" -> "PCRV029"
+    """
+    if not texto:
+        return None
+    raiz, extensao = os.path.splitext(texto)
+    if extensao.lower() in EXTENSOES_ARTE:
+        texto = raiz
+    return texto.split('-')[0].split(' ')[0].upper()
+
+
+def chave_compacta(texto):
+    """
+    Forma compacta de um SKU ou nome de arquivo para a busca aproximada: sem extensão,
+    sem sufixo de variação, em minúsculas e só com letras e dígitos.
+    Ex: "PRDA 115-F.jpg" -> "prda115", " prda-115 " -> "prda115"
+    """
+    if not texto:
+        return ''
+    texto = texto.strip().upper()
+    if texto.lower().endswith(EXTENSOES_ARTE):
+        texto = texto.rsplit('.', 1)[0].rstrip()
+    return _NAO_ALFANUMERICO.sub('', _SUFIXO_VARIACAO.sub('', texto, count=1)).lower()
+
+
+class ImageIndexSnapshot:
+    """
+    Snapshot em disco (SQLite) dos arquivos de imagem de cada raiz de rede.
+
+    Os diretórios ficam em uma tabela própria para que o caminho da pasta não
+    seja repetido em cada arquivo, o que mantém o snapshot pequeno e rápido de ler.
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path):
+        """
+        Inicializa o snapshot
+
+        Args:
+            db_path: Caminho do arquivo SQLite local (a pasta é criada se não existir)
+        """
+        self.db_path = db_path
+        self.write_lock = Lock()
+
+    def _conectar(self):
+        """Abre uma conexão nova (o sqlite3 não compartilha conexões entre threads)."""
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._garantir_esquema(conn)
+        return conn
+
+    def _garantir_esquema(self, conn):
+        """Cria as tabelas. Se o esquema for de outra versão, descarta tudo (é só um cache)."""
+        versao = conn.execute('PRAGMA user_version').fetchone()[0]
+        if versao == self.SCHEMA_VERSION:
+            return
+
+        conn.executescript("""
+            DROP TABLE IF EXISTS arquivos;
+            DROP TABLE IF EXISTS diretorios;
+            CREATE TABLE diretorios (
+                id INTEGER PRIMARY KEY,
+                raiz TEXT NOT NULL,
+                caminho TEXT NOT NULL,
+                mtime REAL,
+                UNIQUE (raiz, caminho)
+            );
+            CREATE TABLE arquivos (
+                diretorio_id INTEGER NOT NULL REFERENCES diretorios(id) ON DELETE CASCADE,
+                nome TEXT NOT NULL,
+                tamanho INTEGER,
+                mtime REAL,
+                PRIMARY KEY (diretorio_id, nome)
+            ) WITHOUT ROWID;
+        """)
+        conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        conn.commit()
+
+    def existe(self):
+        """Indica se já existe um snapshot gravado em disco."""
+        return os.path.isfile(self.db_path)
+
+    def salvar(self, raiz, registros, diretorios=None):
+        """
+        Substitui o conteúdo gravado de uma raiz pela lista de arquivos fornecida
+
+        Args:
+            raiz: Caminho raiz que foi varrido (ex: IMAGE_SOURCE_PATH)
+            registros: Iterável de tuplas (diretorio, nome, tamanho, mtime)
+            diretorios: Dicionário opcional {caminho: mtime} com todas as pastas varridas
+
+        Returns:
+            int: Quantidade de arquivos gravados
+        """
+        start_time = time.time()
+        diretorios = diretorios or {}
+        diretorio_ids = {}
+        linhas = []
+
+        with self.write_lock:
+            conn = self._conectar()
+            try:
+                with conn:
+                    conn.execute(
+                        'DELETE FROM arquivos WHERE diretorio_id IN (SELECT id FROM diretorios WHERE raiz = ?)',
+                        (raiz,)
+                    )
+                    conn.execute('DELETE FROM diretorios WHERE raiz = ?', (raiz,))
+
+                    for caminho, mtime in diretorios.items():
+                        cursor = conn.execute(
+                            'INSERT INTO diretorios (raiz, caminho, mtime) VALUES (?, ?, ?)', (raiz, caminho, mtime)
+                        )
+                        diretorio_ids[caminho] = cursor.lastrowid
+
+                    for diretorio, nome, tamanho, mtime in registros:
+                        diretorio_id = diretorio_ids.get(diretorio)
+                        if diretorio_id is None:
+                            cursor = conn.execute(
+                                'INSERT INTO diretorios (raiz, caminho) VALUES (?, ?)', (raiz, diretorio)
+                            )
+                            diretorio_id = cursor.lastrowid
+                            diretorio_ids[diretorio] = diretorio_id
+                        linhas.append((diretorio_id, nome, tamanho, mtime))
+
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO arquivos (diretorio_id, nome, tamanho, mtime) VALUES (?, ?, ?, ?)',
+                        linhas
+                    )
+            finally:
+                conn.close()
+
+        logger.info(f"💾 Snapshot de imagens salvo para '{raiz}': {len(linhas)} arquivos em {time.time() - start_time:.2f}s")
+        return len(linhas)
+
+    def aplicar_delta(self, raiz, delta):
+        """
+        Grava no snapshot apenas o que mudou em um reescaneamento incremental
+
+        Args:
+            raiz: Caminho raiz do scanner
+            delta: DeltaVarredura retornado por IncrementalImageScanner.reescanear()
+        """
+        with self.write_lock:
+            conn = self._conectar()
+            try:
+                with conn:
+                    diretorio_ids = dict(conn.execute(
+                        'SELECT caminho, id FROM diretorios WHERE raiz = ?', (raiz,)
+                    ).fetchall())
+
+                    for caminho in delta.diretorios_removidos:
+                        diretorio_id = diretorio_ids.pop(caminho, None)
+                        if diretorio_id is not None:
+                            conn.execute('DELETE FROM arquivos WHERE diretorio_id = ?', (diretorio_id,))
+                            conn.execute('DELETE FROM diretorios WHERE id = ?', (diretorio_id,))
+
+                    for caminho, mtime in delta.diretorios.items():
+                        if caminho in diretorio_ids:
+                            conn.execute('UPDATE diretorios SET mtime = ? WHERE id = ?', (mtime, diretorio_ids[caminho]))
+                        else:
+                            cursor = conn.execute(
+                                'INSERT INTO diretorios (raiz, caminho, mtime) VALUES (?, ?, ?)', (raiz, caminho, mtime)
+                            )
+                            diretorio_ids[caminho] = cursor.lastrowid
+
+                    conn.executemany(
+                        'DELETE FROM arquivos WHERE diretorio_id = ? AND nome = ?',
+                        [(diretorio_ids[d], n) for d, n in delta.removidos if d in diretorio_ids]
+                    )
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO arquivos (diretorio_id, nome, tamanho, mtime) VALUES (?, ?, ?, ?)',
+                        [(diretorio_ids[d], n, t, m) for d, n, t, m in delta.adicionados if d in diretorio_ids]
+                    )
+            finally:
+                conn.close()
+
+    def carregar_estado(self, raiz):
+        """
+        Lê do disco as pastas e os arquivos gravados de uma raiz
+
+        Args:
+            raiz: Caminho raiz usado em salvar() / aplicar_delta()
+
+        Returns:
+            tuple: ({caminho: mtime}, [(diretorio, nome, tamanho, mtime), ...]);
+                   vazios se não houver snapshot
+        """
+        if not self.existe():
+            return {}, []
+
+        start_time = time.time()
+        conn = self._conectar()
+        try:
+            diretorios = dict(conn.execute(
+                'SELECT caminho, mtime FROM diretorios WHERE raiz = ?', (raiz,)
+            ).fetchall())
+            registros = conn.execute("""
+                SELECT d.caminho, a.nome, a.tamanho, a.mtime
+                FROM arquivos a JOIN diretorios d ON d.id = a.diretorio_id
+                WHERE d.raiz = ?
+            """, (raiz,)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao ler snapshot de imagens ({self.db_path}): {e}")
+            return {}, []
+        finally:
+            conn.close()
+
+        logger.info(f"📂 Snapshot de imagens carregado para '{raiz}': {len(diretorios)} pastas, {len(registros)} arquivos em {time.time() - start_time:.2f}s")
+        return diretorios, registros
+
+
+class DeltaVarredura:
+    """
+    Resultado de um reescaneamento incremental.
+
+    - adicionados: tuplas (diretorio, nome, tamanho, mtime) de arquivos novos ou alterados
+    - removidos: tuplas (diretorio, nome) de arquivos que sumiram (ou foram alterados)
+    - ids_adicionados / ids_removidos: os mesmos arquivos como ids da TabelaArquivos do scanner
+    - diretorios: {caminho: mtime} das pastas que foram relistadas
+    - diretorios_removidos: pastas que não existem mais
+    """
+
+    __slots__ = ('adicionados', 'removidos', 'ids_adicionados', 'ids_removidos', 'diretorios', 'diretorios_removidos')
+
+    def __init__(self):
+        self.adicionados = []
+        self.removidos = []
+        self.ids_adicionados = array('I')
+        self.ids_removidos = array('I')
+        self.diretorios = {}
+        self.diretorios_removidos = []
+
+    def vazio(self):
+        """Indica se nada mudou desde o último reescaneamento."""
+        return not (self.adicionados or self.removidos or self.diretorios or self.diretorios_removidos)
+
+
+class TabelaArquivos:
+    """
+    Tabela compacta dos arquivos de uma raiz, onde cada arquivo é um id inteiro.
+
+    - Cada caminho de pasta é guardado uma única vez (tabela de diretórios internados).
+    - Os nomes ficam concatenados em um único bytearray (UTF-8), localizados por
+      arrays de início e comprimento; não existe um objeto str por arquivo.
+    - Pasta, tamanho e mtime ficam em arrays numéricos indexados pelo id.
+
+    O id de um arquivo é estável enquanto ele existir. Ids liberados só são
+    reaproveitados depois de reciclar(), chamado no início da varredura seguinte,
+    para que quem recebeu o delta ainda consiga ler o nome dos arquivos removidos.
+    """
+
+    def __init__(self):
+        self.diretorios = []       # id da pasta -> caminho
+        self.id_diretorio = {}     # caminho -> id da pasta
+        self.pastas = array('I')
+        self.comprimentos = array('H')
+        self.tamanhos = array('q')  # -1 quando o tamanho é desconhecido
+        self.mtimes = array('d')
+        # (bytearray dos nomes, array de inícios) trocados juntos quando a tabela é compactada
+        self._nomes = (bytearray(), array('I'))
+        self.livres = []
+        self.liberados = []
+        self.bytes_orfaos = 0
+
+    def __len__(self):
+        return len(self.pastas) - len(self.livres) - len(self.liberados)
+
+    def internar_diretorio(self, caminho):
+        """Retorna o id da pasta, registrando o caminho na primeira vez."""
+        id_pasta = self.id_diretorio.get(caminho)
+        if id_pasta is None:
+            id_pasta = len(self.diretorios)
+            self.diretorios.append(caminho)
+            self.id_diretorio[caminho] = id_pasta
+        return id_pasta
+
+    def adicionar(self, id_pasta, nome, tamanho, mtime):
+        """Registra um arquivo e retorna seu id."""
+        buffer, inicios = self._nomes
+        codificado = nome.encode('utf-8', 'surrogatepass')
+        tamanho = -1 if tamanho is None else tamanho
+        mtime = float('nan') if mtime is None else mtime
+        if self.livres:
+            id_arquivo = self.livres.pop()
+            self.pastas[id_arquivo] = id_pasta
+            inicios[id_arquivo] = len(buffer)
+            self.comprimentos[id_arquivo] = len(codificado)
+            self.tamanhos[id_arquivo] = tamanho
+            self.mtimes[id_arquivo] = mtime
+        else:
+            id_arquivo = len(self.pastas)
+            self.pastas.append(id_pasta)
+            inicios.append(len(buffer))
+            self.comprimentos.append(len(codificado))
+            self.tamanhos.append(tamanho)
+            self.mtimes.append(mtime)
+        buffer += codificado
+        return id_arquivo
+
+    def liberar(self, id_arquivo):
+        """Marca o id como removido; ele só volta a ser usado depois de reciclar()."""
+        self.liberados.append(id_arquivo)
+        self.bytes_orfaos += self.comprimentos[id_arquivo]
+
+    def reciclar(self):
+        """Libera para reuso os ids removidos na varredura anterior e compacta os nomes se preciso."""
+        # Um id livre tem nome vazio: quem guardou o id antes da remoção percebe que ele não vale mais
+        for id_arquivo in self.liberados:
+            self.comprimentos[id_arquivo] = 0
+        self.livres.extend(self.liberados)
+        self.liberados = []
+        buffer, inicios = self._nomes
+        if self.bytes_orfaos > 1024 * 1024 and self.bytes_orfaos * 2 > len(buffer):
+            livres = set(self.livres)
+            novo_buffer = bytearray()
+            novos_inicios = array('I', bytes(len(inicios) * inicios.itemsize))
+            for id_arquivo, inicio in enumerate(inicios):
+                if id_arquivo in livres:
+                    continue
+                novos_inicios[id_arquivo] = len(novo_buffer)
+                novo_buffer += buffer[inicio:inicio + self.comprimentos[id_arquivo]]
+            self._nomes = (novo_buffer, novos_inicios)
+            self.bytes_orfaos = 0
+
+    def nome(self, id_arquivo):
+        buffer, inicios = self._nomes
+        inicio = inicios[id_arquivo]
+        return buffer[inicio:inicio + self.comprimentos[id_arquivo]].decode('utf-8', 'surrogatepass')
+
+    def diretorio(self, id_arquivo):
+        return self.diretorios[self.pastas[id_arquivo]]
+
+    def caminho(self, id_arquivo):
+        return os.path.join(self.diretorios[self.pastas[id_arquivo]], self.nome(id_arquivo))
+
+    def info(self, id_arquivo):
+        """Tupla (tamanho, mtime) no mesmo formato da listagem do scanner."""
+        return self.tamanhos[id_arquivo], self.mtimes[id_arquivo]
+
+    def bytes_ocupados(self):
+        """Estimativa dos bytes ocupados pelos arrays e pelos nomes (sem a tabela de diretórios)."""
+        buffer, inicios = self._nomes
+        colunas = (self.pastas, self.comprimentos, self.tamanhos, self.mtimes, inicios)
+        return len(buffer) + sum(len(coluna) * coluna.itemsize for coluna in colunas)
+
+
+class EstadoPasta:
+    """Estado conhecido de uma pasta: mtime, ids dos arquivos e caminhos das subpastas."""
+
+    __slots__ = ('mtime', 'arquivos', 'subpastas')
+
+    def __init__(self, mtime, arquivos, subpastas):
+        self.mtime = mtime
+        self.arquivos = arquivos
+        self.subpastas = subpastas
+
+
+class IncrementalImageScanner:
+    """
+    Reescaneador incremental de uma raiz de rede.
+
+    Lembra o mtime e a listagem de cada pasta. Em cada reescaneamento faz apenas
+    um stat por pasta e só relista as pastas cujo mtime mudou (criação, remoção
+    ou renomeação de arquivos alteram o mtime da pasta). A listagem usa os.scandir
+    e o stat do próprio DirEntry (no Windows ele já vem da listagem, sem nova ida
+    à rede). Alterações feitas dentro de um arquivo já existente não mudam o mtime
+    da pasta e só são percebidas quando a pasta for relistada por outro motivo.
+
+    Os arquivos conhecidos ficam em uma TabelaArquivos; o estado de cada pasta
+    guarda apenas os ids dos seus arquivos.
+    """
+
+    def __init__(self, raiz, extensoes=None, max_workers=16):
+        """
+        Inicializa o scanner
+
+        Args:
+            raiz: Pasta raiz a ser varrida
+            extensoes: Tupla de extensões aceitas (ex: ('.jpg', '.png')); None aceita todos os arquivos
+            max_workers: Número máximo de pastas visitadas ao mesmo tempo
+        """
+        self.raiz = raiz
+        self.extensoes = tuple(ext.lower() for ext in extensoes) if extensoes else None
+        self.max_workers = max_workers
+        self.ultima_varredura = None
+        self.tabela = TabelaArquivos()
+        self.estado = {}  # caminho da pasta -> EstadoPasta
+        self.lock = Lock()
+
+    def carregar_estado(self, diretorios, registros):
+        """
+        Restaura o estado a partir do snapshot, sem tocar na rede
+
+        Args:
+            diretorios: {caminho: mtime} gravado no snapshot
+            registros: Tuplas (diretorio, nome, tamanho, mtime) gravadas no snapshot
+        """
+        tabela = TabelaArquivos()
+        estado = {}
+        for caminho, mtime in diretorios.items():
+            caminho = tabela.diretorios[tabela.internar_diretorio(caminho)]
+            estado[caminho] = EstadoPasta(mtime, array('I'), ())
+
+        for diretorio, nome, tamanho, mtime in registros:
+            id_pasta = tabela.internar_diretorio(diretorio)
+            pasta = estado.get(diretorio)
+            if pasta is None:
+                pasta = estado[tabela.diretorios[id_pasta]] = EstadoPasta(None, array('I'), ())
+            pasta.arquivos.append(tabela.adicionar(id_pasta, nome, tamanho, mtime))
+
+        filhas = defaultdict(list)
+        for caminho in estado:
+            pai = os.path.dirname(caminho)
+            if caminho != self.raiz and pai in estado:
+                filhas[pai].append(caminho)
+        for pai, caminhos in filhas.items():
+            estado[pai].subpastas = tuple(caminhos)
+
+        with self.lock:
+            self.tabela = tabela
+            self.estado = estado
+
+    def ids_arquivos(self):
+        """Ids (na tabela atual) de todos os arquivos conhecidos."""
+        with self.lock:
+            ids = array('I')
+            for pasta in self.estado.values():
+                ids.extend(pasta.arquivos)
+            return ids
+
+    def iterar_arquivos(self):
+        """Gera tuplas (diretorio, nome, tamanho, mtime) de todos os arquivos conhecidos."""
+        tabela = self.tabela
+        for id_arquivo in self.ids_arquivos():
+            tamanho, mtime = tabela.info(id_arquivo)
+            yield tabela.diretorio(id_arquivo), tabela.nome(id_arquivo), tamanho, mtime
+
+    def _listar(self, caminho):
+        """Lista uma pasta. Retorna ({nome: (tamanho, mtime)}, {subpastas}); levanta OSError se falhar."""
+        arquivos = {}
+        subpastas = set()
+        with os.scandir(caminho) as entradas:
+            for entrada in entradas:
+                try:
+                    if entrada.is_dir(follow_symlinks=False):
+                        subpastas.add(entrada.path)
+                        continue
+                    if not entrada.is_file():
+                        continue
+                    if self.extensoes and not entrada.name.lower().endswith(self.extensoes):
+                        continue
+                    info = entrada.stat()
+                    arquivos[entrada.name] = (info.st_size, info.st_mtime)
+                except OSError:
+                    continue
+        return arquivos, subpastas
+
+    def _ler_pasta(self, caminho, mtime_conhecido):
+        """
+        Só o I/O de uma visita (roda em thread nativa, ver executar_bloqueante): um stat da
+        pasta e, se o mtime mudou, uma nova listagem.
+
+        Returns:
+            None se a pasta sumiu; senão (mtime, listagem ou None, OSError da listagem ou None)
+        """
+        try:
+            mtime = os.stat(caminho).st_mtime
+        except OSError:
+            return None
+        if mtime_conhecido == mtime:
+            return mtime, None, None
+        try:
+            return mtime, self._listar(caminho), None
+        except OSError as e:
+            return mtime, None, e
+
+    def _visitar(self, caminho, atual):
+        """
+        Trabalho de uma thread do pool: um stat da pasta e, se o mtime mudou, uma nova listagem.
+        As idas à rede saem do hub do eventlet, para a varredura não travar as requisições.
+
+        Returns:
+            None se a pasta sumiu; senão (mtime, listagem), com listagem None quando a
+            pasta não mudou ou não pôde ser lida
+        """
+        resultado = executar_bloqueante(self._ler_pasta, caminho, atual.mtime if atual is not None else None)
+        if resultado is None:
+            return None
+        mtime, listagem, erro = resultado
+        if erro is not None:
+            logger.warning(f"Erro ao listar {caminho}: {erro}")
+        return mtime, listagem
+
+    def _remover_arquivo(self, delta, caminho, id_arquivo, nome):
+        delta.removidos.append((caminho, nome))
+        delta.ids_removidos.append(id_arquivo)
+        self.tabela.liberar(id_arquivo)
+
+    def reescanear(self, ao_progredir=None):
+        """
+        Compara a rede com o estado conhecido e devolve o que mudou
+
+        As pastas são visitadas em paralelo por um pool de até max_workers threads
+        (em SMB o tempo é dominado pela latência de cada ida à rede, não pela CPU).
+        Só a thread que chamou altera o estado, à medida que os resultados chegam, e
+        o lock é tomado só para aplicar cada pasta já listada: as consultas ao scanner
+        (ids_arquivos, iterar_arquivos) não esperam pelas idas à rede.
+
+        Args:
+            ao_progredir: Função opcional chamada com (ids_adicionados, ids_removidos)
+                          a cada pasta alterada, antes do fim da varredura
+
+        Returns:
+            DeltaVarredura: Mudanças encontradas; None se a raiz estiver inacessível
+        """
+        if not os.path.isdir(self.raiz):
+            logger.error(f"❌ Raiz de imagens inacessível: {self.raiz}")
+            return None
+
+        start_time = time.time()
+        delta = DeltaVarredura()
+        visitados = set()
+        agendados = set()
+        pendentes = {}
+        pastas_relistadas = 0
+        arquivos_vistos = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='varredura_imagens') as executor:
+            with self.lock:
+                tabela = self.tabela
+                tabela.reciclar()
+
+            def agendar(caminhos):
+                for caminho in caminhos:
+                    if caminho not in agendados:
+                        agendados.add(caminho)
+                        pendentes[executor.submit(self._visitar, caminho, self.estado.get(caminho))] = caminho
+
+            agendar([self.raiz])
+            while pendentes:
+                concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    caminho = pendentes.pop(futuro)
+                    resultado = futuro.result()
+                    if resultado is None:
+                        continue  # A pasta sumiu: será tratada como removida no final
+                    visitados.add(caminho)
+
+                    mtime, listagem = resultado
+                    atual = self.estado.get(caminho)
+                    if listagem is None:
+                        # Pasta sem mudança (ou falha pontual de leitura): mantém o que já se sabia
+                        if atual is not None:
+                            arquivos_vistos += len(atual.arquivos)
+                            agendar(atual.subpastas)
+                        continue
+
+                    arquivos, subpastas = listagem
+                    inicio_adicionados = len(delta.ids_adicionados)
+                    inicio_removidos = len(delta.ids_removidos)
+                    pastas_relistadas += 1
+                    arquivos_vistos += len(arquivos)
+                    # A listagem já veio da rede: o lock só cobre a troca do estado desta pasta
+                    with self.lock:
+                        id_pasta = tabela.internar_diretorio(caminho)
+                        caminho = tabela.diretorios[id_pasta]
+                        antigos = {tabela.nome(id_arquivo): id_arquivo for id_arquivo in atual.arquivos} if atual else {}
+                        ids = array('I')
+
+                        for nome, info in arquivos.items():
+                            id_arquivo = antigos.pop(nome, None)
+                            if id_arquivo is not None:
+                                if tabela.info(id_arquivo) == info:
+                                    ids.append(id_arquivo)
+                                    continue
+                                self._remover_arquivo(delta, caminho, id_arquivo, nome)
+                            id_arquivo = tabela.adicionar(id_pasta, nome, info[0], info[1])
+                            ids.append(id_arquivo)
+                            delta.adicionados.append((caminho, nome, info[0], info[1]))
+                            delta.ids_adicionados.append(id_arquivo)
+
+                        for nome, id_arquivo in antigos.items():
+                            self._remover_arquivo(delta, caminho, id_arquivo, nome)
+
+                        subpastas = tuple(tabela.diretorios[tabela.internar_diretorio(subpasta)] for subpasta in subpastas)
+                        self.estado[caminho] = EstadoPasta(mtime, ids, subpastas)
+                    delta.diretorios[caminho] = mtime
+                    agendar(subpastas)
+                    if ao_progredir is not None:
+                        ao_progredir(delta.ids_adicionados[inicio_adicionados:], delta.ids_removidos[inicio_removidos:])
+
+        inicio_removidos = len(delta.ids_removidos)
+        with self.lock:
+            for caminho in [c for c in self.estado if c not in visitados]:
+                for id_arquivo in self.estado.pop(caminho).arquivos:
+                    self._remover_arquivo(delta, caminho, id_arquivo, tabela.nome(id_arquivo))
+                delta.diretorios_removidos.append(caminho)
+        if ao_progredir is not None and len(delta.ids_removidos) > inicio_removidos:
+            ao_progredir(array('I'), delta.ids_removidos[inicio_removidos:])
+
+        duracao = time.time() - start_time
+        arquivos_por_segundo = arquivos_vistos / duracao if duracao > 0 else 0
+        self.ultima_varredura = {
+            'pastas': len(visitados),
+            'pastas_relistadas': pastas_relistadas,
+            'arquivos': arquivos_vistos,
+            'segundos': round(duracao, 2),
+            'arquivos_por_segundo': round(arquivos_por_segundo),
+            'threads': self.max_workers
+        }
+        logger.info(
+            f"🔄 Reescaneamento de '{self.raiz}': {len(visitados)} pastas verificadas, {pastas_relistadas} relistadas, "
+            f"+{len(delta.adicionados)} / -{len(delta.removidos)} arquivos em {duracao:.2f}s "
+            f"({arquivos_por_segundo:.0f} arquivos/s, {self.max_workers} threads)"
+        )
+        return delta
+
+
+class IndiceTrigramas:
+    """
+    Índice invertido de trigramas (sequências de 3 caracteres) sobre uma lista de textos.
+
+    Cada trigrama aponta para um array compacto com os índices dos textos que o
+    contêm. Serve para encontrar rapidamente os candidatos que podem conter um
+    trecho; o chamador confirma cada candidato com a comparação original.
+    """
+
+    def __init__(self, textos):
+        """
+        Constrói o índice
+
+        Args:
+            textos: Lista de textos já normalizados (ex: nomes de arquivo em maiúsculas)
+        """
+        self.total = len(textos)
+        postings = defaultdict(list)
+        for i, texto in enumerate(textos):
+            for trigrama in {texto[j:j + 3] for j in range(len(texto) - 2)}:
+                postings[trigrama].append(i)
+        self.postings = {trigrama: array('I', ids) for trigrama, ids in postings.items()}
+
+    def adicionar(self, texto):
+        """Acrescenta um texto no fim da lista e retorna o seu índice."""
+        i = self.total
+        self.total += 1
+        for trigrama in {texto[j:j + 3] for j in range(len(texto) - 2)}:
+            ids = self.postings.get(trigrama)
+            if ids is None:
+                self.postings[trigrama] = array('I', (i,))
+            else:
+                ids.append(i)
+        return i
+
+    def candidatos(self, trecho):
+        """
+        Retorna os índices dos textos que podem conter o trecho (um superconjunto).
+        Trechos com menos de 3 caracteres não são filtrados.
+        """
+        if len(trecho) < 3:
+            return range(self.total)
+
+        menor = None
+        for j in range(len(trecho) - 2):
+            ids = self.postings.get(trecho[j:j + 3])
+            if ids is None:
+                return ()
+            if menor is None or len(ids) < len(menor):
+                menor = ids
+        return menor
+
+
+class IndiceAproximado:
+    """
+    Busca aproximada (SKU digitado errado, arte com espaços ou sufixos no nome) sobre
+    os nomes das imagens, por trigramas de caracteres.
+
+    Cada nome vira a sua chave_compacta; os trigramas da consulta contam quantos
+    trigramas cada nome compartilha com ela, e os mais votados são ordenados pela
+    média entre o coeficiente de Dice dos trigramas e a semelhança de sequência
+    (difflib), que não penaliza tanto letras trocadas de lugar.
+
+    As varreduras atualizam o índice no lugar (aplicar): nomes novos entram no fim
+    e um nome que deixou de existir só tem a posição esvaziada, até a reconstrução.
+    """
+
+    # Nomes mais votados que são reavaliados pela similaridade exata
+    MAX_CANDIDATOS = 200
+    # Votos contados por consulta: os trigramas mais raros entram primeiro e os muito comuns ficam de fora
+    MAX_VOTOS = 300000
+    SIMILARIDADE_MINIMA = 0.3
+    # Fração de posições vazias a partir da qual vale reconstruir o índice
+    FRACAO_REMOVIDOS_RECONSTRUCAO = 0.25
+
+    def __init__(self, tabela, ids):
+        """
+        Constrói o índice
+
+        Args:
+            tabela: TabelaArquivos onde as imagens estão registradas
+            ids: Ids das imagens indexadas
+        """
+        self.tabela = tabela
+        # Pasta de cada id no momento da construção (indexado pelo id), para reconhecer ids reaproveitados
+        self.pastas = array('I', tabela.pastas)
+        grupos = {}  # chave compacta -> id da imagem ou array('I') com vários
+        for id_arquivo in ids:
+            compacta = chave_compacta(tabela.nome(id_arquivo))
+            if compacta:
+                ImageIndex._adicionar(grupos, compacta, id_arquivo)
+        self.grupos = grupos
+        self.textos = list(grupos)  # None nas posições de nomes removidos
+        self.trigramas = IndiceTrigramas([self._com_bordas(texto) for texto in self.textos])
+        self.removidos = 0
+        self.lock = Lock()
+
+    def aplicar(self, tabela, adicionados, removidos):
+        """
+        Leva ao índice o delta de uma varredura, sem reconstruí-lo.
+
+        Args:
+            tabela: Tabela atual do scanner (os nomes dos removidos ainda são legíveis nela)
+            adicionados: Ids das imagens novas
+            removidos: Ids das imagens removidas
+
+        Returns:
+            bool: False se o índice precisa ser reconstruído (é de outra tabela ou
+                  acumulou posições vazias demais)
+        """
+        if tabela is not self.tabela:
+            return False
+        with self.lock:
+            # Os adicionados primeiro: um arquivo alterado (removido + adicionado) mantém a posição do nome
+            for id_arquivo in adicionados:
+                compacta = chave_compacta(tabela.nome(id_arquivo))
+                if not compacta:
+                    continue
+                if id_arquivo >= len(self.pastas):
+                    self.pastas.extend(array('I', [0]) * (id_arquivo + 1 - len(self.pastas)))
+                self.pastas[id_arquivo] = tabela.pastas[id_arquivo]
+                if compacta not in self.grupos:
+                    self.textos.append(compacta)
+                    self.trigramas.adicionar(self._com_bordas(compacta))
+                ImageIndex._adicionar(self.grupos, compacta, id_arquivo)
+
+            for id_arquivo in removidos:
+                compacta = chave_compacta(tabela.nome(id_arquivo))
+                if compacta not in self.grupos:
+                    continue
+                ImageIndex._remover(self.grupos, compacta, id_arquivo)
+                if compacta not in self.grupos:
+                    for indice in self.trigramas.candidatos(self._com_bordas(compacta)):
+                        if self.textos[indice] == compacta:
+                            self.textos[indice] = None
+                            self.removidos += 1
+                            break
+            return self.removidos <= self.FRACAO_REMOVIDOS_RECONSTRUCAO * max(len(self.textos), 1000)
+
+    @staticmethod
+    def _com_bordas(texto):
+        # As bordas fazem o início e o fim do nome contarem, e nomes curtos terem trigramas
+        return f" {texto} "
+
+    @classmethod
+    def _trigramas_de(cls, texto):
+        texto = cls._com_bordas(texto)
+        return {texto[j:j + 3] for j in range(len(texto) - 2)}
+
+    def buscar(self, texto, limite=10):
+        """
+        Nomes mais parecidos com o texto
+
+        Returns:
+            list: (chave compacta, id ou array de ids, similaridade de 0 a 1), da mais parecida para a menos
+        """
+        consulta = chave_compacta(texto)
+        if not consulta:
+            return []
+        with self.lock:
+            return self._buscar(consulta, limite)
+
+    def _buscar(self, consulta, limite):
+        trigramas_consulta = self._trigramas_de(consulta)
+
+        postings = [ids for ids in (self.trigramas.postings.get(t) for t in trigramas_consulta) if ids is not None]
+        if not postings:
+            return []
+        votos = Counter()
+        contados = 0
+        for ids in sorted(postings, key=len):
+            if contados and contados + len(ids) > self.MAX_VOTOS:
+                break
+            votos.update(ids)
+            contados += len(ids)
+
+        resultados = []
+        sequencia = SequenceMatcher(None, b=consulta)
+        for indice, _ in heapq.nlargest(self.MAX_CANDIDATOS, votos.items(), key=lambda item: item[1]):
+            texto_candidato = self.textos[indice]
+            if texto_candidato is None:
+                continue
+            trigramas_candidato = self._trigramas_de(texto_candidato)
+            comuns = len(trigramas_consulta & trigramas_candidato)
+            sequencia.set_seq1(texto_candidato)
+            similaridade = (2 * comuns / (len(trigramas_consulta) + len(trigramas_candidato)) + sequencia.ratio()) / 2
+            if similaridade >= self.SIMILARIDADE_MINIMA:
+                resultados.append((-similaridade, abs(len(texto_candidato) - len(consulta)), texto_candidato, indice))
+        resultados.sort()
+        return [(texto_candidato, self.grupos[texto_candidato], -similaridade)
+                for similaridade, _, texto_candidato, _ in resultados[:limite]]
+
+    def exato(self, texto):
+        """Nome com a mesma chave compacta do texto, no formato de buscar(), ou lista vazia."""
+        consulta = chave_compacta(texto)
+        valor = self.grupos.get(consulta)
+        return [(consulta, valor, 1.0)] if valor is not None else []
+
+
+class ColetaImagensIndex:
+    """
+    Índice dos nomes de arquivo da pasta de origem para as regras de /api/images/collect.
+
+    As regras da coleta comparam trechos do nome do arquivo (SKU base, SKU com
+    variação, marcador CILINDRO). Em vez de testar cada SKU contra todos os
+    arquivos, o índice de trigramas devolve só os candidatos que contêm o trecho
+    e cada um é confirmado com a mesma comparação da regra, então o resultado é
+    idêntico ao da varredura completa.
+
+    As varreduras atualizam o índice no lugar (aplicar): arquivos novos entram no
+    fim e os removidos ficam com o nome vazio, que não casa com nenhuma regra.
+    """
+
+    # Variações que excluem um arquivo da busca pelo SKU base (REGRA 3)
+    SUFIXOS_EXCLUIDOS_BUSCA_BASE = ['100', '130', '999', 'VF', 'F', 'P', 'V', 'C']
+    # Fração de posições vazias a partir da qual vale reconstruir o índice
+    FRACAO_REMOVIDOS_RECONSTRUCAO = 0.25
+
+    def __init__(self, tabela, ids):
+        """
+        Constrói o índice
+
+        Args:
+            tabela: TabelaArquivos onde os arquivos estão registrados
+            ids: Ids dos arquivos da origem nessa tabela
+        """
+        start_time = time.time()
+        self.tabela = tabela
+        self.ids = array('I', ids)
+        self.pastas = array('I', (tabela.pastas[id_arquivo] for id_arquivo in self.ids))
+        self.nomes = [tabela.nome(id_arquivo).upper() for id_arquivo in self.ids]
+        self.trigramas = IndiceTrigramas(self.nomes)
+        self.cilindros = {i for i, nome in enumerate(self.nomes) if 'CILINDRO' in nome}
+        # Posição de cada id no índice (indexado pelo id; -1 = fora do índice)
+        self.posicoes = array('i', [-1]) * len(tabela.pastas)
+        for i, id_arquivo in enumerate(self.ids):
+            self.posicoes[id_arquivo] = i
+        self.removidos = 0
+        self.lock = Lock()
+        logger.info(f"🗂️ Índice de coleta construído: {len(self.ids)} arquivos em {time.time() - start_time:.2f}s")
+
+    def aplicar(self, tabela, adicionados, removidos):
+        """
+        Leva ao índice o delta de uma varredura, sem reconstruí-lo.
+
+        Args:
+            tabela: Tabela atual do scanner
+            adicionados: Ids dos arquivos novos
+            removidos: Ids dos arquivos removidos
+
+        Returns:
+            bool: False se o índice precisa ser reconstruído (é de outra tabela ou
+                  acumulou posições vazias demais)
+        """
+        if tabela is not self.tabela:
+            return False
+        with self.lock:
+            for id_arquivo in removidos:
+                i = self.posicoes[id_arquivo] if id_arquivo < len(self.posicoes) else -1
+                if i < 0:
+                    continue
+                self.posicoes[id_arquivo] = -1
+                self.nomes[i] = ''
+                self.cilindros.discard(i)
+                self.removidos += 1
+
+            for id_arquivo in adicionados:
+                nome = tabela.nome(id_arquivo).upper()
+                i = self.trigramas.adicionar(nome)
+                self.ids.append(id_arquivo)
+                self.pastas.append(tabela.pastas[id_arquivo])
+                self.nomes.append(nome)
+                if 'CILINDRO' in nome:
+                    self.cilindros.add(i)
+                if id_arquivo >= len(self.posicoes):
+                    self.posicoes.extend(array('i', [-1]) * (id_arquivo + 1 - len(self.posicoes)))
+                self.posicoes[id_arquivo] = i
+            return self.removidos <= self.FRACAO_REMOVIDOS_RECONSTRUCAO * max(len(self.nomes), 1000)
+
+    def _contendo(self, trecho):
+        """Índices dos arquivos cujo nome (em maiúsculas) contém o trecho (posições vazias nunca entram)."""
+        nomes = self.nomes
+        return [i for i in self.trigramas.candidatos(trecho) if nomes[i] and trecho in nomes[i]]
+
+    def selecionar(self, skus_to_search):
+        """
+        Aplica as regras de coleta para um conjunto de SKUs
+
+        Args:
+            skus_to_search: Conjunto de SKUs já normalizados (strip + upper)
+
+        Returns:
+            tuple: (set de caminhos a copiar, set de SKUs encontrados)
+        """
+        # As varreduras alteram o índice no lugar (ver aplicar)
+        with self.lock:
+            selecionados = set()
+            found_skus = set()
+
+            for sku in skus_to_search:
+                sku_base = sku.split('-')[0]
+                is_base_search = (sku == sku_base)
+                com_sku_base = self._contendo(sku_base)
+                encontrados = set()
+
+                # REGRA 1: BUSCA POR CILINDROS (Universal)
+                # Sempre busca cilindros que correspondam ao SKU base.
+                encontrados.update(i for i in com_sku_base if i in self.cilindros)
+
+                if not is_base_search:
+                    # REGRA 2: BUSCA POR SKU COM VARIAÇÃO (ex: "VCFZ001-VF", "PCRV029-130")
+                    # O nome do arquivo DEVE conter o SKU completo.
+                    encontrados.update(self._contendo(sku))
+                else:
+                    # REGRA 3: BUSCA POR SKU BASE (ex: "PRDA001", "PCRV029")
+                    # O arquivo deve começar com o SKU base e NÃO PODE conter uma variação
+                    # que não seja a padrão. Ex: "PRDA001-130" é ignorado, "PRDA001 - ARTE" entra.
+                    for i in com_sku_base:
+                        nome = self.nomes[i]
+                        if nome.startswith(sku_base):
+                            resto = nome[len(sku_base):]
+                            if not any(f'-{suffix}' in resto for suffix in self.SUFIXOS_EXCLUIDOS_BUSCA_BASE):
+                                encontrados.add(i)
+
+                    # REGRA ESPECIAL: Se a busca for por "PCRV029", incluir também o painel "-150".
+                    if sku == 'PCRV029':
+                        encontrados.update(self._contendo('PCRV029-150'))
+
+                if encontrados:
+                    found_skus.add(sku)
+                    selecionados.update(encontrados)
+
+            caminhos = set()
+            for i in selecionados:
+                id_arquivo = self.ids[i]
+                # Uma varredura mais nova pode ter removido o arquivo e reaproveitado o id
+                # (inclusive para um arquivo de mesmo nome em outra pasta)
+                if self.tabela.pastas[id_arquivo] == self.pastas[i] and self.tabela.nome(id_arquivo).upper() == self.nomes[i]:
+                    caminhos.add(self.tabela.caminho(id_arquivo))
+            return caminhos, found_skus
+
+
+class HistoricoGeracoes:
+    """
+    Contador de gerações e registro das últimas mudanças de um índice chave -> valor.
+
+    Cada publicação que altera o índice ganha um número de geração novo. Um
+    cliente que já tem a geração N pede só o que mudou desde então; se N for
+    mais antiga que o registro guardado, ele recebe o índice completo.
+    """
+
+    def __init__(self, max_geracoes=200):
+        """
+        Inicializa o histórico
+
+        Args:
+            max_geracoes: Quantas gerações manter no registro de mudanças
+        """
+        # A numeração parte do relógio (ms), então uma geração de antes de um
+        # reinício é sempre menor que as novas e cai no caso "índice completo".
+        self.geracao = int(time.time() * 1000)
+        self.geracao_inicial = self.geracao
+        self.registro = deque(maxlen=max_geracoes)  # (geracao, {chave: valor novo ou None se removida})
+        self.lock = Lock()
+
+    @staticmethod
+    def diferenca(anterior, novo):
+        """Calcula as mudanças entre dois mapas chave -> valor (None marca remoção)."""
+        mudancas = {chave: valor for chave, valor in novo.items() if anterior.get(chave) != valor}
+        for chave in anterior:
+            if chave not in novo:
+                mudancas[chave] = None
+        return mudancas
+
+    def registrar(self, mudancas):
+        """
+        Publica uma nova geração com as mudanças informadas.
+
+        Returns:
+            int: Número da geração criada, ou None se não houve mudança
+        """
+        if not mudancas:
+            return None
+        with self.lock:
+            self.geracao += 1
+            self.registro.append((self.geracao, mudancas))
+            return self.geracao
+
+    def reiniciar(self):
+        """
+        Publica uma nova geração sem registro de mudanças (ex: índice refeito do zero).
+        Qualquer cliente em uma geração anterior passa a receber o índice completo.
+        """
+        with self.lock:
+            self.geracao += 1
+            self.geracao_inicial = self.geracao
+            self.registro.clear()
+            return self.geracao
+
+    def geracao_atual(self):
+        with self.lock:
+            return self.geracao
+
+    def mudancas_desde(self, geracao):
+        """
+        Junta as mudanças publicadas depois da geração informada.
+
+        Returns:
+            tuple: (geração atual, {chave: valor ou None}) ou (geração atual, None)
+                   quando a geração pedida não pode ser atendida pelo registro
+        """
+        with self.lock:
+            atual = self.geracao
+            if geracao == atual:
+                return atual, {}
+            mais_antiga = self.registro[0][0] if self.registro else atual + 1
+            # O registro precisa ter todas as gerações depois da do cliente
+            if geracao > atual or geracao < mais_antiga - 1 or geracao < self.geracao_inicial:
+                return atual, None
+            mudancas = {}
+            for numero, alteracoes in self.registro:
+                if numero > geracao:
+                    mudancas.update(alteracoes)
+            return atual, mudancas
+
+
+class ImageIndex:
+    """
+    Índice único de uma raiz de imagens da rede.
+
+    Uma única varredura (IncrementalImageScanner) alimenta todas as visões:
+    - arquivos por SKU base (artes de impressão, ex: para a coleta/otimização)
+    - menor imagem por chave de SKU (cards e miniaturas), com histórico de gerações
+    - regras de /api/images/collect (ColetaImagensIndex)
+
+    As visões guardam apenas os ids da TabelaArquivos do scanner; nome, pasta e
+    tamanho são lidos da tabela e o caminho completo só é montado quando alguém pede.
+    """
+
+    # Sondagem dirigida durante o aquecimento
+    MAX_PASTAS_SONDAGEM = 20
+    TIMEOUT_SONDAGEM = 30
+
+    def __init__(self, raiz, snapshot, extensoes=None, com_menores=False, com_coleta=False, ao_publicar=None,
+                 max_workers=16, com_aproximado=False):
+        """
+        Inicializa o índice
+
+        Args:
+            raiz: Pasta raiz na rede
+            snapshot: ImageIndexSnapshot onde a lista de arquivos é persistida
+            extensoes: Extensões varridas (None = todos os arquivos, necessário para a coleta)
+            com_menores: Mantém a visão "menor imagem por chave" e seu histórico de gerações
+            com_coleta: Mantém o índice das regras de coleta
+            ao_publicar: Função chamada com (geracao, mudancas) quando a visão de menores muda
+            max_workers: Threads da varredura (pastas visitadas ao mesmo tempo)
+            com_aproximado: Mantém o índice da busca aproximada sobre os nomes das imagens
+        """
+        self.raiz = raiz
+        self.snapshot = snapshot
+        self.scanner = IncrementalImageScanner(raiz, extensoes, max_workers=max_workers)
+        self.com_menores = com_menores
+        self.com_coleta = com_coleta
+        self.com_aproximado = com_aproximado
+        self.ao_publicar = ao_publicar
+
+        self.lock = Lock()
+        # Uma varredura por vez: os ids removidos só podem ser reaproveitados depois de aplicados nas visões
+        self.lock_varredura = Lock()
+        self.pronto = False
+        # Os valores são o id do arquivo (o caso comum) ou um array('I') quando a chave tem vários
+        self.por_base = {}     # SKU base -> arquivo(s) das artes
+        self.candidatos = {}   # chave da imagem -> arquivo(s) das imagens (a menor é escolhida na consulta)
+        self.historico = HistoricoGeracoes(max_geracoes=200)
+        self.coleta = None
+        self.evento_coleta = Event()
+        self.aproximado = None
+
+        # Só durante o aquecimento (primeira varredura sem snapshot)
+        self.pastas_por_familia = {}  # família da chave (ex: "prda") -> ids das pastas onde ela já apareceu
+        self.sondagens = {}           # chave -> resultado da sondagem dirigida
+        self.sondando = {}            # chave -> Event da sondagem em andamento
+        self.sondagens_feitas = 0
+
+    @property
+    def tabela(self):
+        return self.scanner.tabela
+
+    # ------------------------------------------------------------------
+    # Manutenção
+    # ------------------------------------------------------------------
+
+    def carregar_snapshot(self):
+        """Restaura o índice a partir do snapshot local, sem tocar na rede. Retorna True se havia dados."""
+        with self.lock_varredura:
+            diretorios, registros = self.snapshot.carregar_estado(self.raiz)
+            # As visões atuais apontam para a tabela que será substituída
+            menores_anteriores = self.mapa_menores() if self.com_menores else {}
+            self.scanner.carregar_estado(diretorios, registros)
+            del registros
+            ids = self.scanner.ids_arquivos()
+            if not ids:
+                return False
+            self._aplicar(ids, (), menores_anteriores=menores_anteriores)
+            return True
+
+    def reescanear(self):
+        """
+        Atualiza o índice a partir da rede (apenas as pastas que mudaram) e grava
+        as mudanças no snapshot. Retorna o DeltaVarredura ou None se a raiz estiver inacessível.
+
+        Na primeira varredura (sem snapshot), cada pasta entra nas visões assim que é
+        listada, para que localizar() já responda com o índice parcial.
+        """
+        with self.lock_varredura:
+            aquecendo = not self.pronto
+            delta = self.scanner.reescanear(ao_progredir=self._aplicar_parcial if aquecendo else None)
+
+            if aquecendo:
+                # Sem rede, fica valendo o que já tinha sido listado
+                self._concluir_aquecimento()
+            elif delta is None:
+                return None
+            elif not delta.vazio():
+                self._aplicar(delta.ids_adicionados, delta.ids_removidos)
+
+            if delta is not None and not delta.vazio():
+                try:
+                    self.snapshot.aplicar_delta(self.raiz, delta)
+                except Exception as e:
+                    logger.error(f"❌ Erro ao gravar o snapshot de '{self.raiz}': {e}")
+            if self.com_coleta and (aquecendo or self.coleta is None):
+                self.atualizar_coleta()
+            if self.com_aproximado and (aquecendo or self.aproximado is None):
+                self.atualizar_aproximado()
+            return delta
+
+    @staticmethod
+    def _ids(valor):
+        """Ids de um valor das visões (id único, array ou None)."""
+        if valor is None:
+            return ()
+        return (valor,) if isinstance(valor, int) else valor
+
+    @staticmethod
+    def _adicionar(mapa, chave, id_arquivo):
+        valor = mapa.get(chave)
+        if valor is None:
+            mapa[chave] = id_arquivo
+        elif isinstance(valor, int):
+            mapa[chave] = array('I', (valor, id_arquivo))
+        else:
+            valor.append(id_arquivo)
+
+    @staticmethod
+    def _remover(mapa, chave, id_arquivo):
+        valor = mapa.get(chave)
+        if valor is None:
+            return
+        if isinstance(valor, int):
+            if valor == id_arquivo:
+                del mapa[chave]
+        elif id_arquivo in valor:
+            valor.remove(id_arquivo)
+            if len(valor) == 1:
+                mapa[chave] = valor[0]
+
+    def _menor(self, chave):
+        """Id da menor imagem da chave, ou None. Chamar com o lock."""
+        valor = self.candidatos.get(chave)
+        if valor is None or isinstance(valor, int):
+            return valor
+        return min(valor, key=self.tabela.tamanhos.__getitem__)
+
+    def _caminho_menor(self, chave):
+        id_arquivo = self._menor(chave)
+        return self.tabela.caminho(id_arquivo) if id_arquivo is not None else None
+
+    def _alterar_visoes(self, adicionados, removidos, anteriores=None):
+        """
+        Aplica os ids adicionados e removidos nas visões. Chamar com o lock.
+
+        Args:
+            anteriores: Dicionário opcional onde é guardado o caminho da menor imagem
+                        de cada chave antes da primeira alteração (para o histórico)
+        """
+        tabela = self.tabela
+        for id_arquivo in removidos:
+            nome = tabela.nome(id_arquivo)
+            self._remover(self.por_base, normalizar_sku_base(nome), id_arquivo)
+            if self.com_menores:
+                chave = normalizar_chave_imagem(nome)
+                if anteriores is not None and chave not in anteriores:
+                    anteriores[chave] = self._caminho_menor(chave)
+                self._remover(self.candidatos, chave, id_arquivo)
+
+        for id_arquivo in adicionados:
+            nome = tabela.nome(id_arquivo)
+            extensao = os.path.splitext(nome)[1].lower()
+            if extensao not in EXTENSOES_ARTE:
+                continue
+            self._adicionar(self.por_base, normalizar_sku_base(nome), id_arquivo)
+            if self.com_menores and tabela.tamanhos[id_arquivo] >= 0 and extensao in EXTENSOES_IMAGEM:
+                chave = normalizar_chave_imagem(nome)
+                if chave:
+                    if anteriores is not None and chave not in anteriores:
+                        anteriores[chave] = self._caminho_menor(chave)
+                    self._adicionar(self.candidatos, chave, id_arquivo)
+                    if self.pastas_por_familia is not None:
+                        self.pastas_por_familia.setdefault(familia_da_chave(chave), set()).add(tabela.pastas[id_arquivo])
+
+    def _aplicar(self, adicionados, removidos, menores_anteriores=None):
+        """
+        Aplica os ids de arquivos adicionados e removidos (da tabela do scanner) em todas as visões.
+        Com menores_anteriores (mapa chave -> caminho antes da troca da tabela), as visões são refeitas do zero.
+        """
+        do_zero = menores_anteriores is not None
+        mudancas = {}
+        geracao = None
+        with self.lock:
+            if do_zero:
+                self.por_base = {}
+                self.candidatos = {}
+
+            # Menor imagem de cada chave antes da primeira alteração (para o histórico de gerações)
+            anteriores = {}
+            self._alterar_visoes(adicionados, removidos, None if do_zero else anteriores)
+
+            if self.com_menores:
+                if do_zero:
+                    novos = {chave: self._caminho_menor(chave) for chave in self.candidatos}
+                    mudancas = HistoricoGeracoes.diferenca(menores_anteriores, novos)
+                    # O registro não guarda o mapa inteiro: quem estiver em uma geração anterior recebe o índice completo
+                    geracao = self.historico.reiniciar() if mudancas else None
+                else:
+                    for chave, anterior in anteriores.items():
+                        atual = self._caminho_menor(chave)
+                        if atual != anterior:
+                            mudancas[chave] = atual
+                    geracao = self.historico.registrar(mudancas)
+            self._marcar_pronto()
+
+        # Na carga do snapshot os índices de nomes são montados depois, fora do caminho de inicialização
+        if (len(adicionados) or len(removidos)) and not do_zero:
+            self._atualizar_indices_nomes(adicionados, removidos)
+        self._publicar(geracao, mudancas)
+
+    def _atualizar_indices_nomes(self, adicionados, removidos):
+        """
+        Leva o delta de uma varredura aos índices de trigramas (coleta e busca aproximada)
+        no lugar; só os reconstrói quando ainda não existem ou acumularam remoções demais.
+        """
+        tabela = self.tabela
+        if self.com_coleta:
+            if self.coleta is None or not self.coleta.aplicar(tabela, adicionados, removidos):
+                self.atualizar_coleta()
+        if self.com_aproximado:
+            # A busca aproximada só tem as imagens que entraram nas visões (candidatos)
+            with self.lock:
+                imagens = [id_arquivo for id_arquivo in adicionados
+                           if id_arquivo in self._ids(self.candidatos.get(normalizar_chave_imagem(tabela.nome(id_arquivo))))]
+            if self.aproximado is None or not self.aproximado.aplicar(tabela, imagens, removidos):
+                self.atualizar_aproximado()
+
+    def _aplicar_parcial(self, adicionados, removidos):
+        """Durante o aquecimento: coloca nas visões os arquivos de uma pasta recém-listada."""
+        with self.lock:
+            self._alterar_visoes(adicionados, removidos)
+
+    def _concluir_aquecimento(self):
+        """Fim da primeira varredura: as visões já estão completas, só falta publicar a geração."""
+        mudancas = {}
+        geracao = None
+        with self.lock:
+            if self.com_menores:
+                mudancas = {chave: self._caminho_menor(chave) for chave in self.candidatos}
+                geracao = self.historico.reiniciar() if mudancas else None
+            self._marcar_pronto()
+        self._publicar(geracao, mudancas)
+
+    def _marcar_pronto(self):
+        """Chamar com o lock. Descarta as estruturas que só servem durante o aquecimento."""
+        self.pronto = True
+        self.pastas_por_familia = None
+        self.sondagens = {}
+
+    def _publicar(self, geracao, mudancas):
+        if geracao is not None and self.ao_publicar is not None:
+            try:
+                self.ao_publicar(geracao, mudancas)
+            except Exception as e:
+                logger.error(f"❌ Erro ao notificar nova geração do índice de imagens: {e}")
+
+    def montar_indices_do_snapshot(self):
+        """
+        Monta os índices de nomes (coleta e busca aproximada) que ainda não existem a partir
+        do que o snapshot carregou, para que respondam antes da primeira varredura da rede.
+        Chamar fora do caminho de inicialização (na thread de reescaneamento).
+        """
+        with self.lock_varredura:
+            if self.com_coleta and self.coleta is None:
+                self.atualizar_coleta()
+            if self.com_aproximado and self.aproximado is None:
+                self.atualizar_aproximado()
+
+    def atualizar_coleta(self):
+        """Reconstrói o índice da coleta fora do lock e o publica de uma vez."""
+        ids = self.scanner.ids_arquivos()
+        if ids:
+            self.coleta = ColetaImagensIndex(self.tabela, ids)
+            self.evento_coleta.set()
+
+    def atualizar_aproximado(self):
+        """Reconstrói o índice da busca aproximada fora do lock e o publica de uma vez. Chamar com lock_varredura."""
+        start_time = time.time()
+        ids = array('I')
+        with self.lock:
+            for valor in self.candidatos.values():
+                ids.extend(self._ids(valor))
+        self.aproximado = IndiceAproximado(self.tabela, ids) if ids else None
+        logger.info(f"🔤 Índice de busca aproximada de '{self.raiz}': {len(ids)} imagens em {time.time() - start_time:.2f}s")
+
+    def aguardar_coleta(self, timeout=None):
+        """Espera o índice da coleta ficar pronto (ex: logo após subir sem snapshot). Retorna None se esgotar o tempo."""
+        self.evento_coleta.wait(timeout)
+        return self.coleta
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def menor_imagem(self, chave):
+        """Retorna {'path', 'size'} da menor imagem da chave, ou None."""
+        with self.lock:
+            id_arquivo = self._menor(chave)
+            if id_arquivo is None:
+                return None
+            return {'path': self.tabela.caminho(id_arquivo), 'size': self.tabela.tamanhos[id_arquivo]}
+
+    def localizar(self, chave):
+        """
+        Menor imagem da chave ({'path', 'size'} ou None), também durante o aquecimento.
+
+        Enquanto a primeira varredura não termina, uma chave que ainda não está no
+        índice parcial é procurada só nas pastas onde já apareceram SKUs da mesma
+        família. Pedidos simultâneos da mesma chave esperam a mesma sondagem e o
+        resultado fica guardado até o fim do aquecimento; nunca é feita uma
+        varredura completa fora do scanner.
+        """
+        encontrada = self.menor_imagem(chave)
+        if encontrada is not None or self.pronto or not chave:
+            return encontrada
+
+        with self.lock:
+            if self.pronto:
+                return None
+            if chave in self.sondagens:
+                return self.sondagens[chave]
+            evento = self.sondando.get(chave)
+            responsavel = evento is None
+            if responsavel:
+                evento = self.sondando[chave] = Event()
+                pastas = [self.tabela.diretorios[id_pasta]
+                          for id_pasta in (self.pastas_por_familia or {}).get(familia_da_chave(chave), ())]
+
+        if not responsavel:
+            evento.wait(self.TIMEOUT_SONDAGEM)
+            with self.lock:
+                return self.sondagens.get(chave)
+
+        encontrada = None
+        try:
+            encontrada = self._sondar(chave, pastas[:self.MAX_PASTAS_SONDAGEM])
+        finally:
+            with self.lock:
+                # Sem pastas da família ainda não há o que sondar; um pedido posterior tenta de novo
+                if not self.pronto and pastas:
+                    self.sondagens[chave] = encontrada
+                self.sondando.pop(chave, None)
+            evento.set()
+        return encontrada
+
+    def _sondar(self, chave, pastas):
+        """
+        Procura a menor imagem da chave nas pastas informadas e, se não achar, nas
+        pastas vizinhas delas (mesma pasta pai) que a varredura talvez ainda não listou.
+        """
+        self.sondagens_feitas += 1
+        encontrada = self._procurar_nas_pastas(chave, pastas)
+        if encontrada is not None or not pastas:
+            return encontrada
+
+        conhecidas = set(pastas)
+        vizinhas = []
+        for pai in dict.fromkeys(os.path.dirname(pasta) for pasta in pastas):
+            try:
+                with os.scandir(pai) as entradas:
+                    vizinhas.extend(entrada.path for entrada in entradas
+                                    if entrada.path not in conhecidas and entrada.is_dir(follow_symlinks=False))
+            except OSError as e:
+                logger.warning(f"Erro ao sondar {pai}: {e}")
+            if len(vizinhas) >= self.MAX_PASTAS_SONDAGEM:
+                break
+        return self._procurar_nas_pastas(chave, vizinhas[:self.MAX_PASTAS_SONDAGEM])
+
+    @staticmethod
+    def _procurar_nas_pastas(chave, pastas):
+        """Lista as pastas (sem descer nas subpastas) e retorna {'path', 'size'} da menor imagem da chave."""
+        encontrada = None
+        for pasta in pastas:
+            try:
+                with os.scandir(pasta) as entradas:
+                    for entrada in entradas:
+                        if not entrada.name.lower().endswith(EXTENSOES_IMAGEM):
+                            continue
+                        if normalizar_chave_imagem(entrada.name) != chave:
+                            continue
+                        try:
+                            if not entrada.is_file():
+                                continue
+                            tamanho = entrada.stat().st_size
+                        except OSError:
+                            continue
+                        if encontrada is None or tamanho < encontrada['size']:
+                            encontrada = {'path': entrada.path, 'size': tamanho}
+            except OSError as e:
+                logger.warning(f"Erro ao sondar {pasta}: {e}")
+        return encontrada
+
+    def buscar_aproximado(self, texto, limite=10, somente_exata=False):
+        """
+        Imagens com nome parecido com o texto (SKU digitado errado, arte com espaços ou sufixos no nome).
+        Fica vazia até a primeira varredura terminar. Com somente_exata, só procura (em O(1)) o nome
+        cuja forma compacta é igual à do texto.
+
+        Returns:
+            list: {'key', 'name', 'path', 'size', 'score', 'exact'} da menor imagem de cada nome,
+                  da mais parecida para a menos ('exact' quando as formas compactas são iguais)
+        """
+        indice = self.aproximado
+        if indice is None:
+            return []
+        consulta = chave_compacta(texto)
+        encontrados = indice.exato(texto) if somente_exata else indice.buscar(texto, limite)
+
+        resultados = []
+        with self.lock:
+            tabela = self.tabela
+            if indice.tabela is not tabela:
+                return []
+            for compacta, valor, similaridade in encontrados:
+                # Uma varredura mais nova pode ter removido o arquivo e reaproveitado o id
+                # (inclusive para um arquivo de nome parecido em outra pasta)
+                ids = [id_arquivo for id_arquivo in self._ids(valor)
+                       if tabela.pastas[id_arquivo] == indice.pastas[id_arquivo]
+                       and chave_compacta(tabela.nome(id_arquivo)) == compacta]
+                if not ids:
+                    continue
+                id_arquivo = min(ids, key=tabela.tamanhos.__getitem__)
+                nome = tabela.nome(id_arquivo)
+                resultados.append({
+                    'key': normalizar_chave_imagem(nome),
+                    'name': nome,
+                    'path': tabela.caminho(id_arquivo),
+                    'size': tabela.tamanhos[id_arquivo],
+                    'score': round(similaridade, 3),
+                    'exact': compacta == consulta
+                })
+        return resultados
+
+    def mapa_menores(self):
+        """Mapa chave -> caminho da menor imagem."""
+        with self.lock:
+            return {chave: self._caminho_menor(chave) for chave in self.candidatos}
+
+    def arquivos_da_base(self, sku_base, extensoes=EXTENSOES_ARTE):
+        """Caminhos completos de todas as artes de um SKU base."""
+        with self.lock:
+            caminhos = [self.tabela.caminho(id_arquivo)
+                        for id_arquivo in self._ids(self.por_base.get(normalizar_sku_base(sku_base)))]
+        return [caminho for caminho in caminhos if caminho.lower().endswith(extensoes)]
+
+    def bases_vizinhas(self, sku_base, limite=5):
+        """
+        SKUs base de outras artes que estão nas mesmas pastas das artes do SKU informado,
+        lidos da listagem já guardada pelo scanner (sem acessar a rede).
+        """
+        sku_base = normalizar_sku_base(sku_base)
+        tabela = self.tabela
+        with self.lock:
+            pastas = dict.fromkeys(tabela.diretorio(id_arquivo) for id_arquivo in self._ids(self.por_base.get(sku_base)))
+
+        vizinhas = []
+        for pasta in pastas:
+            estado = self.scanner.estado.get(pasta)
+            if estado is None:
+                continue
+            for id_arquivo in estado.arquivos:
+                nome = tabela.nome(id_arquivo)
+                if not nome.lower().endswith(EXTENSOES_ARTE):
+                    continue
+                base = normalizar_sku_base(nome)
+                if base != sku_base and base not in vizinhas:
+                    vizinhas.append(base)
+                    if len(vizinhas) >= limite:
+                        return vizinhas
+        return vizinhas
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'raiz': self.raiz,
+                'pronto': self.pronto,
+                'skus_base': len(self.por_base),
+                'chaves_imagem': len(self.candidatos),
+                'arquivos': len(self.tabela),
+                'pastas': len(self.scanner.estado),
+                'bytes_tabela': self.tabela.bytes_ocupados(),
+                'geracao': self.historico.geracao_atual() if self.com_menores else None,
+                'coleta_pronta': self.coleta is not None,
+                'nomes_busca_aproximada': len(self.aproximado.grupos) if self.aproximado is not None else None,
+                'sondagens_aquecimento': self.sondagens_feitas,
+                'ultima_varredura': self.scanner.ultima_varredura
+            }
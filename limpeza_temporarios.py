@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Limpeza de Temporários - Mantém a pasta temporária da rede dentro de uma cota
+Remove as pastas de sessão das coletas (busca_*) e os anexos do chat (chat_files) que
+passaram da idade máxima e, se o total ainda estiver acima da cota, descarta os itens
+mais antigos primeiro. Cada ciclo registra quanto foi liberado e quanto tempo levou.
+"""
+import os
+import shutil
+import logging
+import time
+from threading import Lock, Event, Thread
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class LimpezaTemporarios:
+    """
+    Coletor da pasta temporária compartilhada.
+
+    Cada pasta busca_* é um item (apagada inteira) e cada arquivo de
+    chat_files/<conversa>/ é um item. Pastas com outros nomes (como o armazém
+    _staging, que tem a sua própria cota) nunca são tocadas.
+    """
+
+    PASTA_CHAT = 'chat_files'
+    PREFIXO_SESSAO = 'busca_'
+
+    def __init__(self, raiz, limite_bytes, idade_maxima_sessao=24 * 3600, idade_maxima_chat=90 * 24 * 3600,
+                 idade_minima=15 * 60, intervalo=900, em_uso=None):
+        """
+        Inicializa o coletor
+
+        Args:
+            raiz: Pasta temporária (IMAGE_TEMP_DEST_PATH)
+            limite_bytes: Cota total das sessões + anexos; acima dela os itens mais antigos saem primeiro
+            idade_maxima_sessao: Idade (s) a partir da qual uma pasta busca_* é removida
+            idade_maxima_chat: Idade (s) a partir da qual um anexo do chat é removido
+            idade_minima: Itens mais novos que isto (s) nunca são removidos pela cota
+            intervalo: Tempo (s) entre dois ciclos automáticos
+            em_uso: Função que retorna os nomes das pastas busca_* que ainda estão sendo preenchidas
+        """
+        self.raiz = raiz
+        self.limite_bytes = limite_bytes
+        self.idade_maxima_sessao = idade_maxima_sessao
+        self.idade_maxima_chat = idade_maxima_chat
+        self.idade_minima = idade_minima
+        self.intervalo = intervalo
+        self.em_uso = em_uso or (lambda: ())
+        self.lock = Lock()
+        self.lock_ciclo = Lock()
+        self.acordar = Event()
+        self.thread = None
+
+        self.ciclos = 0
+        self.bytes_ocupados = 0
+        self.bytes_liberados_total = 0
+        self.itens_removidos_total = 0
+        self.erros = 0
+        self.ultimo_ciclo = None
+
+    def iniciar(self):
+        """Inicia a thread que executa um ciclo a cada intervalo (ou antes, quando solicitado)."""
+        if self.thread is None:
+            self.thread = Thread(target=self._loop, daemon=True, name='limpeza_temporarios')
+            self.thread.start()
+            logger.info(f"🧹 Limpeza de temporários iniciada em '{self.raiz}' "
+                        f"(cota {self.limite_bytes / (1024 ** 3):.1f} GB, a cada {self.intervalo // 60} min)")
+
+    def solicitar(self):
+        """Pede um ciclo antecipado (ex: depois de uma coleta grande)."""
+        self.acordar.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.executar()
+            except Exception as e:
+                logger.error(f"❌ [CLEANUP] Erro crítico no ciclo de limpeza: {e}")
+            self.acordar.wait(self.intervalo)
+            self.acordar.clear()
+
+    @staticmethod
+    def _tamanho_pasta(caminho):
+        """Soma os arquivos de uma pasta. Hardlinks do armazém de staging não ocupam espaço próprio."""
+        total = 0
+        pendentes = [caminho]
+        while pendentes:
+            atual = pendentes.pop()
+            try:
+                with os.scandir(atual) as entradas:
+                    for entry in entradas:
+                        if entry.is_dir(follow_symlinks=False):
+                            pendentes.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            # No Windows o stat do DirEntry vem da listagem e traz st_nlink = 0;
+                            # o número de links só vem de um os.stat do próprio arquivo
+                            st = os.stat(entry.path, follow_symlinks=False)
+                            if st.st_nlink <= 1:
+                                total += st.st_size
+            except OSError:
+                pass
+        return total
+
+    def _listar_itens(self):
+        """
+        Lista os itens removíveis
+
+        Returns:
+            tuple: (lista de (criado_em, caminho, tamanho, é_pasta, idade_maxima), pastas das conversas)
+        """
+        itens = []
+        with os.scandir(self.raiz) as entradas:
+            for entry in entradas:
+                if not entry.is_dir(follow_symlinks=False) or not entry.name.startswith(self.PREFIXO_SESSAO):
+                    continue
+                # 'busca_1761840769_9324' -> 1761840769; sem timestamp no nome, usa o mtime da pasta
+                partes = entry.name.split('_')
+                if len(partes) >= 2 and partes[1].isdigit():
+                    criado_em = int(partes[1])
+                else:
+                    criado_em = entry.stat().st_mtime
+                itens.append((criado_em, entry.path, self._tamanho_pasta(entry.path), True, self.idade_maxima_sessao))
+
+        pasta_chat = os.path.join(self.raiz, self.PASTA_CHAT)
+        try:
+            conversas = [entry.path for entry in os.scandir(pasta_chat) if entry.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            conversas = []
+        for conversa in conversas:
+            try:
+                with os.scandir(conversa) as entradas:
+                    for entry in entradas:
+                        if entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            itens.append((st.st_mtime, entry.path, st.st_size, False, self.idade_maxima_chat))
+            except OSError as e:
+                logger.warning(f"⚠️ [CLEANUP] Não foi possível listar {conversa}: {e}")
+        return itens, conversas
+
+    def _remover(self, caminho, e_pasta):
+        try:
+            if e_pasta:
+                shutil.rmtree(caminho)
+            else:
+                os.remove(caminho)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            logger.warning(f"⚠️ [CLEANUP] Erro ao remover {caminho}: {e}")
+            with self.lock:
+                self.erros += 1
+            return False
+
+    def executar(self):
+        """
+        Executa um ciclo: remove o que passou da idade e, se preciso, os itens mais antigos até caber na cota.
+
+        Returns:
+            dict: Métricas do ciclo
+        """
+        with self.lock_ciclo:
+            inicio = time.time()
+            if not os.path.isdir(self.raiz):
+                logger.warning(f"⚠️ [CLEANUP] Pasta temporária não encontrada: {self.raiz}. A limpeza será ignorada.")
+                return None
+
+            itens, conversas = self._listar_itens()
+            protegidos = {os.path.join(self.raiz, nome) for nome in self.em_uso()}
+            itens.sort()  # mais antigos primeiro
+            ocupados = sum(item[2] for item in itens)
+
+            liberados = 0
+            removidos_idade = 0
+            removidos_cota = 0
+            for criado_em, caminho, tamanho, e_pasta, idade_maxima in itens:
+                idade = inicio - criado_em
+                if caminho in protegidos or idade < self.idade_minima:
+                    continue
+                if idade > idade_maxima:
+                    motivo = 'idade'
+                elif ocupados > self.limite_bytes:
+                    motivo = 'cota'
+                else:
+                    continue
+                if self._remover(caminho, e_pasta):
+                    ocupados -= tamanho
+                    liberados += tamanho
+                    if motivo == 'idade':
+                        removidos_idade += 1
+                    else:
+                        removidos_cota += 1
+
+            # Conversas que ficaram sem anexos
+            for conversa in conversas:
+                try:
+                    os.rmdir(conversa)
+                except OSError:
+                    pass
+
+            ciclo = {
+                'inicio': inicio,
+                'duracao_segundos': round(time.time() - inicio, 3),
+                'itens_analisados': len(itens),
+                'removidos_por_idade': removidos_idade,
+                'removidos_por_cota': removidos_cota,
+                'bytes_liberados': liberados,
+                'bytes_ocupados': ocupados
+            }
+            with self.lock:
+                self.ciclos += 1
+                self.bytes_ocupados = ocupados
+                self.bytes_liberados_total += liberados
+                self.itens_removidos_total += removidos_idade + removidos_cota
+                self.ultimo_ciclo = ciclo
+
+        if removidos_idade or removidos_cota:
+            logger.info(f"🗑️ [CLEANUP] {removidos_idade} item(ns) expirado(s) e {removidos_cota} pela cota removidos, "
+                        f"{liberados / (1024 * 1024):.1f} MB liberados em {ciclo['duracao_segundos']:.1f}s")
+        else:
+            logger.debug("✅ [CLEANUP] Nenhum item a remover.")
+        return ciclo
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'limite_bytes': self.limite_bytes,
+                'bytes_ocupados': self.bytes_ocupados,
+                'ciclos': self.ciclos,
+                'bytes_liberados_total': self.bytes_liberados_total,
+                'itens_removidos_total': self.itens_removidos_total,
+                'erros': self.erros,
+                'ultimo_ciclo': self.ultimo_ciclo
+            }
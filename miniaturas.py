@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Miniaturas - Versões reduzidas das imagens de produto para os cards
+Gera miniaturas de tamanho fixo (WebP ou JPEG) a partir das imagens da rede e as
+guarda em disco local, identificadas pelo caminho e mtime do original, para que as
+grades de estoque e pedidos carreguem kilobytes em vez do arquivo original.
+"""
+import os
+import hashlib
+import logging
+from threading import Lock, Event
+from PIL import Image, ImageOps
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class ServicoMiniaturas:
+    """
+    Gera e guarda em disco as miniaturas das imagens de produto.
+
+    O nome de cada miniatura é o hash de (caminho, tamanho do arquivo, mtime,
+    dimensões, formato) do original. Esse mesmo hash é o ETag forte devolvido
+    ao navegador, então uma imagem alterada na rede gera uma miniatura e um
+    ETag novos sem nenhuma invalidação manual.
+    """
+
+    MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+    def __init__(self, pasta_cache, tamanho=(320, 320), qualidade=80):
+        """
+        Inicializa o serviço
+
+        Args:
+            pasta_cache: Pasta local onde as miniaturas são gravadas
+            tamanho: Caixa máxima (largura, altura) da miniatura; a proporção é mantida
+            qualidade: Qualidade de compressão do WebP/JPEG (0-100)
+        """
+        self.pasta_cache = pasta_cache
+        self.tamanho = tamanho
+        self.qualidade = qualidade
+        self.lock = Lock()
+        self.em_geracao = {}  # chave -> Event, para não gerar a mesma miniatura duas vezes
+        self.geradas = 0
+        self.reaproveitadas = 0
+
+        Image.init()
+        self.suporta_webp = 'WEBP' in Image.SAVE
+        if not self.suporta_webp:
+            logger.warning("⚠️ Pillow sem suporte a WebP. As miniaturas serão geradas apenas em JPEG.")
+
+    def formato_para(self, accept_mimetypes):
+        """Escolhe o formato da miniatura a partir do cabeçalho Accept do navegador."""
+        if self.suporta_webp and accept_mimetypes and accept_mimetypes['image/webp']:
+            return 'webp'
+        return 'jpeg'
+
+    def chave(self, origem, formato, st=None):
+        """
+        Calcula a chave (e ETag) da miniatura de um arquivo sem abri-lo.
+
+        Returns:
+            str: Hash hexadecimal que identifica a miniatura
+        """
+        if st is None:
+            st = os.stat(origem)
+        texto = f"{os.path.normcase(origem)}|{st.st_size}|{st.st_mtime_ns}|{self.tamanho[0]}x{self.tamanho[1]}|{self.qualidade}|{formato}"
+        return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+    def _caminho(self, chave, formato):
+        extensao = '.webp' if formato == 'webp' else '.jpg'
+        return os.path.join(self.pasta_cache, chave[:2], chave + extensao)
+
+    def _gerar(self, origem, destino, formato):
+        """Abre o original, reduz para a caixa configurada e grava a miniatura de forma atômica."""
+        with Image.open(origem) as img:
+            # Para JPEG, decodifica já em escala reduzida (bem mais rápido para originais grandes)
+            img.draft('RGB', self.tamanho)
+            img = ImageOps.exif_transpose(img)
+
+            tem_transparencia = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+            if tem_transparencia:
+                img = img.convert('RGBA')
+                if formato == 'jpeg':
+                    # JPEG não tem canal alfa: aplica sobre fundo branco
+                    fundo = Image.new('RGB', img.size, (255, 255, 255))
+                    fundo.paste(img, mask=img.getchannel('A'))
+                    img = fundo
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+
+            img.thumbnail(self.tamanho, Image.LANCZOS)
+
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            temporario = destino + '.parcial'
+            try:
+                if formato == 'webp':
+                    img.save(temporario, 'WEBP', quality=self.qualidade, method=4)
+                else:
+                    img.save(temporario, 'JPEG', quality=self.qualidade, optimize=True, progressive=True)
+                os.replace(temporario, destino)
+            except Exception:
+                try:
+                    os.remove(temporario)
+                except OSError:
+                    pass
+                raise
+
+    def obter(self, origem, formato, chave=None):
+        """
+        Retorna o caminho da miniatura de um arquivo, gerando-a se ainda não existir.
+
+        Args:
+            origem: Caminho da imagem original
+            formato: 'webp' ou 'jpeg'
+            chave: Chave já calculada por self.chave (evita um novo stat)
+
+        Returns:
+            str: Caminho da miniatura no cache local
+        """
+        if chave is None:
+            chave = self.chave(origem, formato)
+        destino = self._caminho(chave, formato)
+
+        while True:
+            if os.path.exists(destino):
+                with self.lock:
+                    self.reaproveitadas += 1
+                return destino
+            with self.lock:
+                aguardando = self.em_geracao.get(chave)
+                if aguardando is None:
+                    aguardando = self.em_geracao[chave] = Event()
+                    break
+            # Outra requisição já está gerando esta miniatura
+            aguardando.wait()
+
+        try:
+            self._gerar(origem, destino, formato)
+            with self.lock:
+                self.geradas += 1
+            return destino
+        finally:
+            with self.lock:
+                self.em_geracao.pop(chave, None)
+            aguardando.set()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'geradas': self.geradas,
+                'reaproveitadas': self.reaproveitadas,
+                'suporta_webp': self.suporta_webp
+            }
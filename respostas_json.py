@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Módulo de Respostas JSON - Serialização rápida e compressão das respostas da API
+Usa o orjson (quando instalado) no lugar do json da biblioteca padrão para o jsonify
+e para os módulos do /api/data, e comprime com brotli ou gzip, conforme o navegador
+aceitar, as respostas JSON acima de um tamanho mínimo (inclusive as em streaming).
+"""
+import json
+import logging
+import zlib
+from threading import Lock
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+if orjson is not None:
+    # Tipos que o orjson não conhece (Decimal, date, set...) e datetimes passam pelo
+    # default do Flask, para o JSON sair igual ao do jsonify padrão
+    _OPCOES_ORJSON = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps_bytes(valor, ordenar=False):
+        """Serializa um valor em JSON compacto (UTF-8)."""
+        opcoes = _OPCOES_ORJSON | orjson.OPT_SORT_KEYS if ordenar else _OPCOES_ORJSON
+        return orjson.dumps(valor, default=DefaultJSONProvider.default, option=opcoes)
+else:
+    def dumps_bytes(valor, ordenar=False):
+        """Serializa um valor em JSON compacto (UTF-8)."""
+        return json.dumps(valor, ensure_ascii=False, separators=(',', ':'), sort_keys=ordenar,
+                          default=DefaultJSONProvider.default).encode('utf-8')
+
+
+class ProvedorJSONRapido(DefaultJSONProvider):
+    """Provedor JSON do Flask que serializa com dumps_bytes (orjson quando disponível)."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Opções específicas (indent, cls...) ficam com o json padrão
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj, ordenar=self.sort_keys).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj, ordenar=self.sort_keys), mimetype=self.mimetype)
+
+
+class CompressaoRespostas:
+    """
+    Comprime as respostas JSON com a codificação aceita pelo cliente (br > gzip).
+
+    Respostas prontas só são comprimidas a partir de tamanho_minimo bytes; respostas
+    em streaming (carga completa do /api/data) são comprimidas bloco a bloco.
+    Downloads de arquivo (send_file), respostas já codificadas e status sem corpo
+    passam direto.
+
+    Cada codificação é uma representação diferente, então uma resposta comprimida
+    com ETag leva a codificação no fim dele (ex: "g5" vira "g5-gzip"). O hook de
+    before_request tira esse sufixo do If-None-Match, para que as rotas continuem
+    comparando com o ETag original, e o 304 devolve o ETag como o cliente enviou.
+    """
+
+    CODIFICACOES = ('br', 'gzip')
+    CHAVE_IF_NONE_MATCH = 'compressao_respostas.if_none_match'
+
+    def __init__(self, tamanho_minimo=1024, nivel_gzip=4, qualidade_brotli=4):
+        """
+        Inicializa a compressão
+
+        Args:
+            tamanho_minimo: Respostas menores que isto (bytes) vão sem compressão
+            nivel_gzip: Nível do gzip (1-9)
+            qualidade_brotli: Qualidade do brotli (0-11; acima de 5 fica lento para respostas dinâmicas)
+        """
+        self.tamanho_minimo = tamanho_minimo
+        self.nivel_gzip = nivel_gzip
+        self.qualidade_brotli = qualidade_brotli
+        self.lock = Lock()
+        self.respostas = {'br': 0, 'gzip': 0}
+        self.bytes_originais = 0
+        self.bytes_comprimidos = 0
+
+    def preparar(self, request):
+        """Hook de before_request: tira a codificação dos ETags do If-None-Match."""
+        cabecalho = request.environ.get('HTTP_IF_NONE_MATCH')
+        if not cabecalho:
+            return
+        original = cabecalho
+        for codificacao in self.CODIFICACOES:
+            cabecalho = cabecalho.replace(f'-{codificacao}"', '"')
+        if cabecalho != original:
+            request.environ['HTTP_IF_NONE_MATCH'] = cabecalho
+            request.environ[self.CHAVE_IF_NONE_MATCH] = original
+
+    def _marcar_etag(self, response, codificacao):
+        """Acrescenta a codificação ao ETag da resposta, se ela tiver um."""
+        etag, fraco = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{codificacao}", weak=fraco)
+
+    def _escolher(self, request):
+        aceitas = request.accept_encodings
+        if brotli is not None and aceitas['br']:
+            return 'br'
+        if aceitas['gzip']:
+            return 'gzip'
+        return None
+
+    def _compressor(self, codificacao):
+        """Retorna (comprimir, finalizar) para a codificação."""
+        if codificacao == 'br':
+            compressor = brotli.Compressor(quality=self.qualidade_brotli)
+            return compressor.process, compressor.finish
+        compressor = zlib.compressobj(self.nivel_gzip, zlib.DEFLATED, 31)  # 31 = cabeçalho gzip
+        return compressor.compress, compressor.flush
+
+    def _registrar(self, codificacao, originais, comprimidos):
+        with self.lock:
+            self.respostas[codificacao] += 1
+            self.bytes_originais += originais
+            self.bytes_comprimidos += comprimidos
+
+    def _comprimir_stream(self, partes, codificacao):
+        comprimir, finalizar = self._compressor(codificacao)
+        originais = comprimidos = 0
+        try:
+            for parte in partes:
+                originais += len(parte)
+                bloco = comprimir(parte)
+                if bloco:
+                    comprimidos += len(bloco)
+                    yield bloco
+            bloco = finalizar()
+            comprimidos += len(bloco)
+            yield bloco
+            self._registrar(codificacao, originais, comprimidos)
+        finally:
+            # Cliente desconectado no meio: fecha o gerador original (libera o contexto e o cursor do banco)
+            if hasattr(partes, 'close'):
+                partes.close()
+
+    def processar(self, request, response):
+        """Hook de after_request: comprime a resposta se valer a pena."""
+        if response.status_code == 304:
+            # Revalidação de uma versão comprimida: o 304 confirma o ETag que o cliente tem
+            enviado = request.environ.get(self.CHAVE_IF_NONE_MATCH)
+            etag, fraco = response.get_etag()
+            if enviado and etag:
+                response.vary.add('Accept-Encoding')
+                for codificacao in self.CODIFICACOES:
+                    if f'{etag}-{codificacao}"' in enviado:
+                        response.set_etag(f"{etag}-{codificacao}", weak=fraco)
+                        break
+            return response
+
+        if (response.mimetype != 'application/json' or response.direct_passthrough
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        codificacao = self._escolher(request)
+        if codificacao is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._comprimir_stream(response.response, codificacao)
+            response.headers['Content-Encoding'] = codificacao
+            self._marcar_etag(response, codificacao)
+            return response
+
+        dados = response.get_data()
+        if len(dados) < self.tamanho_minimo:
+            return response
+        comprimir, finalizar = self._compressor(codificacao)
+        comprimidos = comprimir(dados) + finalizar()
+        response.set_data(comprimidos)
+        response.headers['Content-Encoding'] = codificacao
+        self._marcar_etag(response, codificacao)
+        self._registrar(codificacao, len(dados), len(comprimidos))
+        return response
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'serializador': 'orjson' if orjson is not None else 'json',
+                'brotli_disponivel': brotli is not None,
+                'respostas': dict(self.respostas),
+                'bytes_originais': self.bytes_originais,
+                'bytes_comprimidos': self.bytes_comprimidos
+            }
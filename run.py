@@ -5,16 +5,24 @@
 import eventlet
 eventlet.monkey_patch()
 
+#    O I/O de rede dos pools (varredura 16, cópia 8, fundo branco 8, espelho 4) roda nas
+#    threads do sistema do eventlet (ver execucao_nativa.py); o padrão é 20.
+from eventlet import tpool
+tpool.set_num_threads(40)
+
 # 2. Importa o SERVIDOR WSGI do próprio Eventlet.
 from eventlet import wsgi
 
 # 3. Importa a sua aplicação Flask e o objeto SocketIO.
-from app import app, socketio
+from app import app, socketio, iniciar_servicos_de_imagem
 
 # 4. Inicia o servidor de produção do Eventlet.
 if __name__ == '__main__':
     print("🚀 Iniciando o servidor em modo de produção com o servidor WSGI do Eventlet...")
     print("   O servidor estará disponível em http://localhost:5000" )
+
+    # Carrega o índice de imagens do snapshot local e atualiza a partir da rede em segundo plano.
+    iniciar_servicos_de_imagem()
     
     # Cria um "listener" de rede na porta 5000 para todos os endereços IP.
     listener = eventlet.listen(('0.0.0.0', 5000))
@@ -64,11 +64,8 @@ socket.on('dados_atualizados', async (data) => {
         // Tratamento especial e prioritário para o CHAT
         if (data.modulo === 'chat') {
             console.log("🔄 Atualização específica para o Chat em andamento...");
-            const res = await fetch('/api/data?modulos=conversas');
-            const chatData = await res.json();
-            if (chatData.conversas) {
-                conversas = chatData.conversas;
-            }
+            // O delta traz só as mensagens novas ou alteradas desde a última carga
+            await loadFromServer();
             updateNotificationCounter();
             if (document.getElementById('chat') && !document.getElementById('chat').classList.contains('hidden')) {
                 const oldConversaAtivaId = conversaAtivaId;
@@ -130,22 +127,23 @@ socket.on('dados_atualizados', async (data) => {
 socket.on('image_collection_complete', (data) => {
     console.log("✅ Imagens prontas!", data);
 
-    // Esconde o overlay de loading
-    hideLoading();
-
-    if (data.status === 'ok') {
-        showToast('Busca de imagens concluída com sucesso!', 'success');
-        
-        // AQUI, você coloca a lógica que antes acontecia depois do fetch:
-        // Por exemplo, abrir a pasta de resultados, mostrar os links, etc.
-        // Exemplo:
-        // window.open(`file:///${data.session_folder_full_path}`); // Se for o caso
-        // renderizarResultadosDaBusca(data.found, data.not_found); // Se você tiver uma função para isso
-        
-        alert(`Busca concluída!\n\nEncontrados: ${data.found.length} arquivos.\nNão encontrados: ${data.not_found.length} SKUs.\n\nOs arquivos estão na pasta de sessão: ${data.session_folder}`);
+    // Ignora resultados de coletas que não são a atual desta tela
+    if (typeof coletaImagensAtual !== 'undefined' && coletaImagensAtual !== COLETA_AGUARDANDO_ID && data.session_folder !== coletaImagensAtual) return;
+    coletaImagensAtual = null;
 
+    if (data.status === 'ok' || data.status === 'cancelado') {
+        if (data.status === 'ok') {
+            showToast('Busca de imagens concluída com sucesso!', 'success');
+        } else {
+            showToast('Coleta de imagens cancelada. Os arquivos já copiados foram mantidos.', 'info');
+        }
+        renderizarResultadosBuscaImagens(data);
     } else {
-        showToast('Ocorreu um erro durante a coleta de imagens.', 'error');
+        showToast(data.message || 'Ocorreu um erro durante a coleta de imagens.', 'error');
+        const tempFolder = document.getElementById('image-temp-folder');
+        if (tempFolder) {
+            tempFolder.innerHTML = `<p class="col-span-full text-center p-8 text-red-500">Falha na busca. Verifique o console.</p>`;
+        }
     }
 });
 
@@ -176,9 +174,88 @@ const ITENS_POR_PAGINA_BUSCA_GERAL = 100;
 // FUNÇÕES DE COMUNICAÇÃO COM BACKEND FLASK
 // ============================================================================
 
-async function loadFromServer() {
-    const res = await fetch('/api/data');
+// Cursor da última carga de /api/data: com ele, as próximas cargas trazem só o que mudou
+let cursorDados = null;
+
+// Leitura e escrita das variáveis globais de cada módulo do /api/data (para aplicar o delta)
+const estadoModulosDados = {
+    users: [() => users, v => { users = v; }],
+    itensEstoque: [() => itensEstoque, v => { itensEstoque = v; }],
+    logs: [() => logs, v => { logs = v; }],
+    pedidos: [() => pedidos, v => { pedidos = v; }],
+    costura: [() => costura, v => { costura = v; }],
+    producao: [() => producao, v => { producao = v; }],
+    expedicao: [() => expedicao, v => { expedicao = v; }],
+    historicoExpedicao: [() => historicoExpedicao, v => { historicoExpedicao = v; }],
+    relatoriosArquivados: [() => relatoriosArquivados, v => { relatoriosArquivados = v; }],
+    transacoesEstoque: [() => transacoesEstoque, v => { transacoesEstoque = v; }],
+    stockClearRequests: [() => stockClearRequests, v => { stockClearRequests = v; }],
+    historicoArtes: [() => historicoArtes, v => { historicoArtes = v; }],
+    pedidosComErro: [() => pedidosComErro, v => { pedidosComErro = v; }],
+    conversas: [() => conversas, v => { conversas = v; }]
+};
+
+/**
+ * Aplica um módulo do delta de /api/data?since= sobre a lista atual.
+ * - completo: o módulo inteiro
+ * - recentes: linhas novas (mais novas primeiro) que vão para o topo, respeitando o limite
+ * - campo/chaves/itens: as linhas dessas chaves são trocadas pelas novas, na mesma posição
+ */
+function mesclarModuloDados(atual, delta) {
+    if (delta.completo) return delta.completo;
+
+    if (delta.recentes) {
+        const ids = new Set(delta.recentes.map(linha => linha.id).filter(id => id !== undefined));
+        const antigas = atual.filter(linha => linha.id === undefined || !ids.has(linha.id));
+        return delta.recentes.concat(antigas).slice(0, delta.limite);
+    }
+
+    const chaves = new Set(delta.chaves);
+    const novasPorChave = new Map();
+    delta.itens.forEach(linha => {
+        const chave = linha[delta.campo];
+        if (!novasPorChave.has(chave)) novasPorChave.set(chave, []);
+        novasPorChave.get(chave).push(linha);
+    });
+
+    const resultado = [];
+    atual.forEach(linha => {
+        const chave = linha[delta.campo];
+        if (!chaves.has(chave)) {
+            resultado.push(linha);
+        } else if (novasPorChave.has(chave)) {
+            resultado.push(...novasPorChave.get(chave));
+            novasPorChave.delete(chave);
+        }
+    });
+    novasPorChave.forEach(linhas => resultado.push(...linhas));
+    return resultado;
+}
+
+// Cargas simultâneas (vários sinais do socket em sequência) rodam uma de cada vez,
+// para que cada uma parta do cursor deixado pela anterior e o mesmo delta não seja aplicado duas vezes
+let cargaDadosEmAndamento = Promise.resolve();
+
+function loadFromServer() {
+    const carga = cargaDadosEmAndamento.then(carregarDadosDoServidor, carregarDadosDoServidor);
+    cargaDadosEmAndamento = carga.catch(() => {});
+    return carga;
+}
+
+async function carregarDadosDoServidor() {
+    // Com um cursor, pede só o que mudou; o servidor devolve a carga completa se ele tiver expirado
+    const res = await fetch(cursorDados ? `/api/data?since=${encodeURIComponent(cursorDados)}` : '/api/data');
     const data = await res.json();
+    if (data.delta) {
+        Object.entries(data.modulos).forEach(([modulo, delta]) => {
+            const estado = estadoModulosDados[modulo];
+            if (!estado) return;
+            const [ler, gravar] = estado;
+            gravar(mesclarModuloDados(ler() || [], delta));
+        });
+        cursorDados = data.cursor;
+        return;
+    }
     users = data.users || [];
     itensEstoque = data.itensEstoque || [];
     logs = data.logs || [];
@@ -195,6 +272,7 @@ async function loadFromServer() {
     pedidosComErro = data.pedidosComErro || [];
     errosDeImportacaoEAN = data.errosDeImportacaoEAN || [];
     stockClearRequests = data.stockClearRequests || [];
+    cursorDados = data.cursor || null;
 }
 
 async function saveData() {
@@ -707,6 +785,108 @@ function getCardImageUrl(sku) {
     return `${API_BASE_URL}/get_card_image/${encodeURIComponent(sku)}`;
 }
 
+// Mesmo limite de MAX_SKUS_RESOLVE no backend (acima disso a rota responde 400)
+const MAX_SKUS_POR_RESOLVE = 5000;
+
+// Cache das resoluções (sku -> { key, url, thumbnail_url }, ou null se o SKU não tem imagem),
+// válido para a geração `geracaoImagensResolvidas` do índice de imagens do backend
+const imagensResolvidas = new Map();
+let geracaoImagensResolvidas = null;
+let sincronizacaoImagens = Promise.resolve();
+
+/**
+ * Resolve as imagens de vários SKUs no backend, em lotes de até MAX_SKUS_POR_RESOLVE.
+ * SKUs já resolvidos vêm do cache; só os novos vão para o backend.
+ * @param {string[]} skus - Lista de SKUs (duplicados são ignorados).
+ * @returns {Promise<object>} Mapa sku -> { key, url, thumbnail_url } apenas com os SKUs encontrados.
+ */
+async function resolverImagensDosSkus(skus) {
+    const unicos = [...new Set((skus || []).filter(sku => sku))];
+    if (unicos.length === 0) return {};
+
+    const resultado = {};
+    const pendentes = [];
+    for (const sku of unicos) {
+        if (!imagensResolvidas.has(sku)) pendentes.push(sku);
+        else if (imagensResolvidas.get(sku)) resultado[sku] = imagensResolvidas.get(sku);
+    }
+
+    const lotes = [];
+    for (let inicio = 0; inicio < pendentes.length; inicio += MAX_SKUS_POR_RESOLVE) {
+        lotes.push(pendentes.slice(inicio, inicio + MAX_SKUS_POR_RESOLVE));
+    }
+    // Um lote que falha só deixa os SKUs dele sem imagem
+    const resultados = await Promise.all(lotes.map(resolverLoteDeSkus));
+    return Object.assign(resultado, ...resultados);
+}
+
+async function resolverLoteDeSkus(skus) {
+    try {
+        const response = await fetch('/api/images/resolve', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ skus })
+        });
+        if (!response.ok) {
+            const erro = await response.json().catch(() => ({}));
+            console.error(`Falha ao resolver as imagens de ${skus.length} SKUs (HTTP ${response.status}):`, erro.error || response.statusText);
+            return {};
+        }
+        const data = await response.json();
+        guardarImagensResolvidas(skus, data);
+        return data.resolved || {};
+    } catch (error) {
+        console.error("Falha ao resolver as imagens dos SKUs:", error);
+        return {};
+    }
+}
+
+function guardarImagensResolvidas(skus, data) {
+    // Enquanto o índice aquece a resposta é parcial: não vai para o cache
+    if (!data.cache_ready || data.geracao == null) return;
+    if (geracaoImagensResolvidas === null) geracaoImagensResolvidas = data.geracao;
+    // Resposta de uma geração anterior à do cache (chegou depois de uma sincronização): descarta
+    if (data.geracao < geracaoImagensResolvidas) return;
+    const resolvidos = data.resolved || {};
+    for (const sku of skus) imagensResolvidas.set(sku, resolvidos[sku] || null);
+}
+
+/**
+ * Traz o cache de imagens para a geração atual do índice: pede a
+ * /api/images/get_all_cached só o que mudou desde a geração do cache e
+ * descarta os SKUs afetados (serão resolvidos de novo na próxima exibição).
+ */
+async function sincronizarImagensResolvidas() {
+    if (geracaoImagensResolvidas === null) return;
+    try {
+        const response = await fetch(`/api/images/get_all_cached?desde=${geracaoImagensResolvidas}`);
+        if (response.status === 304) return;
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const delta = await response.json();
+        if (delta.completo) {
+            imagensResolvidas.clear();
+        } else {
+            const chaves = new Set([...Object.keys(delta.alterados || {}), ...(delta.removidos || [])]);
+            if (chaves.size > 0) {
+                for (const [sku, imagem] of imagensResolvidas) {
+                    // SKUs sem imagem não têm chave conhecida: qualquer mudança pode ter criado a deles
+                    if (!imagem || chaves.has(imagem.key)) imagensResolvidas.delete(sku);
+                }
+            }
+        }
+        geracaoImagensResolvidas = delta.geracao;
+    } catch (error) {
+        console.error("Falha ao sincronizar o cache de imagens:", error);
+        imagensResolvidas.clear();
+        geracaoImagensResolvidas = null;
+    }
+}
+
+// O índice de imagens publicou uma nova geração (as sincronizações rodam uma de cada vez)
+socket.on('indice_imagens_atualizado', () => {
+    sincronizacaoImagens = sincronizacaoImagens.then(sincronizarImagensResolvidas);
+});
+
 
 
 
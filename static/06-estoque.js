@@ -890,22 +890,6 @@ async function loadItens(filters = {}) {
     const canDelete = hasPermission('estoque', 'excluir');
     const canReserve = hasPermission('estoque', 'movimentar');
 
-    // ETAPA 1: BUSCAR O MAPA DE IMAGENS DO BACKEND
-    let imageMap = {};
-    try {
-        const response = await fetch('/api/images/get_all_cached');
-        if (response.ok) {
-            const rawImageMap = await response.json();
-            for (const skuKey in rawImageMap) {
-                const encodedPath = encodeURIComponent(rawImageMap[skuKey].replace(/\\/g, '/'));
-                // A chave já vem processada do backend, então usamos como está.
-                imageMap[skuKey.toLowerCase()] = `/api/images/${encodedPath}`;
-            }
-        }
-    } catch (error) {
-        console.error("Falha ao carregar o mapa de imagens do estoque:", error);
-    }
-
     // Lógica de agrupamento e filtragem (sem alterações)
     const skuData = itensEstoque.reduce((acc, item) => {
         const skuKey = item.sku.toLowerCase();
@@ -947,6 +931,9 @@ async function loadItens(filters = {}) {
         return statusMatch;
     });
 
+    // Busca as imagens apenas dos SKUs que vão aparecer na tabela, em uma única requisição
+    const imageMap = await resolverImagensDosSkus(itensFiltrados.map(item => item.sku));
+
     // Cabeçalho da tabela (sem alterações)
     const tableHead = `
         <thead class="sticky top-0 bg-gray-100 z-10">
@@ -998,17 +985,15 @@ async function loadItens(filters = {}) {
             const editableClass = !isLocked ? 'editable' : '';
             const ondblclick = !isLocked ? 'ondblclick' : '';
 
-            // ======================= INÍCIO DA CORREÇÃO =======================
-            // Usa a nova função getSkuBaseForCache para encontrar a imagem correta.
-            const imageCacheKey = getSkuBaseForCache(item.sku);
-            const imageUrl = imageMap[imageCacheKey];
-            // ======================== FIM DA CORREÇÃO =========================
+            // A resolução (SKU -> chave base -> arquivo) é feita pelo backend em /api/images/resolve
+            const imagem = imageMap[item.sku];
             
             let imageCellHtml = `<td class="p-2 text-center align-middle">`;
-            if (imageUrl) {
+            if (imagem) {
+                // Miniatura na tabela; o original só é carregado ao ampliar
                 imageCellHtml += `
-                    <button onclick="openImageZoomModal('${imageUrl}')" class="block w-14 h-14 mx-auto">
-                        <img src="${imageUrl}" alt="${item.sku}" class="w-full h-full object-cover rounded-md shadow-sm border border-gray-200">
+                    <button onclick="openImageZoomModal('${imagem.url}')" class="block w-14 h-14 mx-auto">
+                        <img src="${imagem.thumbnail_url}" alt="${item.sku}" loading="lazy" class="w-full h-full object-cover rounded-md shadow-sm border border-gray-200">
                     </button>
                 `;
             } else {
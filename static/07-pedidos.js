@@ -1133,46 +1133,41 @@ async function removerErro(index) {
 }
 
 
+// Elementos <img> aguardando a resolução em lote das imagens
+let filaImagensPedidos = [];
+let timerFilaImagensPedidos = null;
+
 /**
- * Busca a URL de uma imagem para um SKU específico fazendo uma requisição ao backend.
+ * Agenda a busca da imagem de um SKU no backend. Todas as chamadas feitas durante a
+ * mesma renderização são agrupadas em uma única requisição a /api/images/resolve.
  * @param {HTMLElement} imgElement - O elemento <img> que precisa ter seu 'src' atualizado.
  */
-async function buscarImagemPeloBackend(imgElement) {
-  const sku = imgElement.dataset.sku;
-  if (!sku) {
+function buscarImagemPeloBackend(imgElement) {
+  if (!imgElement.dataset.sku) {
     imgElement.src = '/static/images/sem-imagem.png';
     return;
   }
-
-  try {
-    // 1. Faz a requisição para a nova API de busca
-    const res = await fetch(`/api/images/search?sku=${encodeURIComponent(sku)}`);
-    
-    if (!res.ok) {
-      // Se a resposta não for 200 OK (ex: 404 Not Found), usa a imagem padrão
-      imgElement.src = '/static/images/sem-imagem.png';
-      return;
-    }
-
-    const data = await res.json();
-
-    if (data.image && data.image.full_path) {
-      // 2. Constrói a URL para o endpoint que serve a imagem
-      // Substitui barras invertidas por normais e codifica para ser uma URL válida
-      const imagePathForUrl = data.image.full_path.replace(/\\/g, '/');
-      const encodedPath = encodeURIComponent(imagePathForUrl);
-      
-      // 3. Define o src da imagem para a URL da API que serve o arquivo
-      imgElement.src = `/api/images/${encodedPath}`;
-    } else {
-      imgElement.src = '/static/images/sem-imagem.png';
-    }
-  } catch (error) {
-    console.error(`Erro ao carregar imagem para o SKU ${sku}:`, error);
-    imgElement.src = '/static/images/sem-imagem.png';
+  filaImagensPedidos.push(imgElement);
+  if (!timerFilaImagensPedidos) {
+    timerFilaImagensPedidos = setTimeout(processarFilaImagensPedidos, 0);
   }
 }
 
+/**
+ * Resolve de uma vez as imagens de todos os elementos na fila.
+ */
+async function processarFilaImagensPedidos() {
+  const elementos = filaImagensPedidos;
+  filaImagensPedidos = [];
+  timerFilaImagensPedidos = null;
+
+  const resolvidas = await resolverImagensDosSkus(elementos.map(el => el.dataset.sku));
+  elementos.forEach(imgElement => {
+    const imagem = resolvidas[imgElement.dataset.sku];
+    imgElement.src = imagem ? imagem.thumbnail_url : '/static/images/sem-imagem.png';
+  });
+}
+
 
 
 
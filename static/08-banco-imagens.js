@@ -76,6 +76,18 @@ async function deleteImage(index) {
 // 08 BANCO DE IMAGENS (VERSÃO COM PASTAS DE SESSÃO DINÂMICAS)
 // ================================================================================
 
+// Sessão da coleta de imagens em andamento (enquanto o servidor copia em segundo plano)
+let coletaImagensAtual = null;
+const COLETA_AGUARDANDO_ID = '__aguardando__';
+
+// Atualiza o texto do carregamento a cada arquivo copiado pelo servidor
+socket.on('image_collection_progress', (data) => {
+    const progressoEl = document.getElementById('image-collect-progress');
+    if (!progressoEl || (data.session_folder !== coletaImagensAtual && coletaImagensAtual !== COLETA_AGUARDANDO_ID)) return;
+    const megas = (data.bytes_copiados / (1024 * 1024)).toFixed(1);
+    progressoEl.textContent = `Copiando imagens... ${data.concluidos} de ${data.total} (${megas} MB)`;
+});
+
 // (A função procurarImagensServidor permanece a mesma)
 async function procurarImagensServidor() {
     if (!hasPermission('bancoImagens', 'pesquisar')) {
@@ -97,25 +109,37 @@ async function procurarImagensServidor() {
     document.getElementById('image-errors-container').innerHTML = ''; // Limpa a área de resultados
     tempFolder.innerHTML = `<div class="col-span-full text-center p-8 text-gray-500">
                                 <i class="fas fa-spinner fa-spin fa-2x"></i>
-                                <p class="mt-2 font-semibold">Criando pasta e copiando imagens...</p>
+                                <p id="image-collect-progress" class="mt-2 font-semibold">Criando pasta e copiando imagens...</p>
+                                <button onclick="cancelarColetaImagens()" class="mt-4 bg-red-500 text-white px-3 py-2 rounded-lg hover:bg-red-600">
+                                    <i class="fas fa-stop mr-2"></i>Cancelar
+                                </button>
                             </div>`;
 
     const skusParaBuscar = skusInput.split(/[\s,]+/).filter(sku => sku.trim() !== '');
+    // Uma coleta muito curta pode terminar antes de a resposta do POST chegar
+    coletaImagensAtual = COLETA_AGUARDANDO_ID;
 
     try {
         const response = await fetch('/api/images/collect', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Socket-ID': socket.id // Permite ao servidor enviar o progresso da cópia só para este cliente
+            },
             body: JSON.stringify({ skus: skusParaBuscar })
         });
 
         const data = await response.json();
 
         if (!response.ok) {
+            coletaImagensAtual = null;
             throw new Error(data.message || 'Ocorreu um erro no servidor.');
         }
 
-        renderizarResultadosBuscaImagens(data);
+        // A coleta roda em segundo plano; o resultado chega pelo evento 'image_collection_complete'
+        if (coletaImagensAtual === COLETA_AGUARDANDO_ID) {
+            coletaImagensAtual = data.session_folder;
+        }
         logAction('Banco de Imagens', 'Busca de imagens realizada', { skus: skusParaBuscar, pasta_criada: data.session_folder });
 
     } catch (error) {
@@ -126,6 +150,77 @@ async function procurarImagensServidor() {
 }
 
 
+/**
+ * Baixa as artes dos SKUs digitados em um único ZIP, transmitido direto da origem pelo servidor.
+ * Usa um formulário (e não fetch) para que o navegador grave o download em disco enquanto ele chega.
+ */
+function baixarZipImagens() {
+    if (!hasPermission('bancoImagens', 'pesquisar')) {
+        showToast('Você não tem permissão para pesquisar imagens.', 'error');
+        return;
+    }
+
+    const skusParaBuscar = document.getElementById('image-search-input').value
+        .split(/[\s,]+/).filter(sku => sku.trim() !== '');
+    if (skusParaBuscar.length === 0) {
+        showToast('Por favor, digite pelo menos um SKU para pesquisar.', 'info');
+        return;
+    }
+
+    // O ZIP chega como anexo; se o servidor responder com erro, a resposta aparece no iframe e vira um aviso
+    let alvo = document.getElementById('image-zip-download-frame');
+    if (!alvo) {
+        alvo = document.createElement('iframe');
+        alvo.id = 'image-zip-download-frame';
+        alvo.name = 'image-zip-download-frame';
+        alvo.style.display = 'none';
+        alvo.addEventListener('load', () => {
+            if (alvo.contentWindow.location.href === 'about:blank') return;
+            let mensagem = 'Não foi possível gerar o ZIP.';
+            try {
+                mensagem = JSON.parse(alvo.contentDocument.body.textContent).message || mensagem;
+            } catch (e) { /* resposta sem JSON */ }
+            showToast(`Erro: ${mensagem}`, 'error');
+        });
+        document.body.appendChild(alvo);
+    }
+
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '/api/images/collect/zip';
+    form.target = alvo.name;
+    const campo = document.createElement('input');
+    campo.type = 'hidden';
+    campo.name = 'skus';
+    campo.value = skusParaBuscar.join(',');
+    form.appendChild(campo);
+    document.body.appendChild(form);
+    form.submit();
+    form.remove();
+
+    showToast('Preparando o download do ZIP...', 'info');
+    logAction('Banco de Imagens', 'Download em ZIP das artes', { skus: skusParaBuscar });
+}
+
+
+/**
+ * Pede ao servidor para interromper a coleta de imagens em andamento.
+ */
+async function cancelarColetaImagens() {
+    if (!coletaImagensAtual || coletaImagensAtual === COLETA_AGUARDANDO_ID) return;
+    try {
+        const response = await fetch(`/api/images/collect/${coletaImagensAtual}/cancel`, { method: 'POST' });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.message || 'Não foi possível cancelar a coleta.');
+        }
+        showToast('Cancelando a coleta de imagens...', 'info');
+    } catch (error) {
+        showToast(`Erro: ${error.message}`, 'error');
+    }
+}
+
+
 /**
  * VERSÃO MODIFICADA: Renderiza os resultados da busca na interface, mas SEM exibir a galeria de imagens.
  * @param {object} resultados - O objeto de resposta da API.
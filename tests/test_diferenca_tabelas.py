@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Testes do diferenca_tabelas.calcular_diferenca com janela (módulos com 'limite' no /api/save)
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diferenca_tabelas import calcular_diferenca
+
+COLUNAS = ['acao', 'usuario']
+
+
+def log(id_registro):
+    return {'id': id_registro, 'acao': f'acao {id_registro}', 'usuario': 'admin'}
+
+
+def sem_id(registro):
+    return {coluna: registro[coluna] for coluna in COLUNAS}
+
+
+class TestDiferencaJanela(unittest.TestCase):
+
+    def test_regravar_janela_inalterada_nao_remove(self):
+        # 1000 logs no banco, o frontend só conhece 401-900
+        existentes = [log(i) for i in range(1, 1001)]
+        novos = [sem_id(log(i)) for i in range(401, 901)]
+
+        inserir, atualizar, remover = calcular_diferenca(existentes, novos, COLUNAS, somente_janela=True)
+
+        self.assertEqual(inserir, [])
+        self.assertEqual(atualizar, [])
+        self.assertEqual(remover, [])
+
+    def test_remove_so_dentro_da_janela(self):
+        existentes = [log(i) for i in range(1, 1001)]
+        novos = [sem_id(log(i)) for i in range(401, 901) if i != 500]
+
+        inserir, atualizar, remover = calcular_diferenca(existentes, novos, COLUNAS, somente_janela=True)
+
+        self.assertEqual(inserir, [])
+        self.assertEqual([registro['id'] for registro in remover], [500])
+
+    def test_sem_janela_remove_o_que_nao_veio(self):
+        existentes = [log(i) for i in range(1, 11)]
+        novos = [sem_id(log(i)) for i in range(1, 6)]
+
+        _, _, remover = calcular_diferenca(existentes, novos, COLUNAS)
+
+        self.assertEqual(sorted(registro['id'] for registro in remover), list(range(6, 11)))
+
+
+if __name__ == '__main__':
+    unittest.main()